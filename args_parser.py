@@ -49,4 +49,141 @@ parser.add_argument('--outputDir',
                     help="Specify the path where to save the final .html report and .csv files"
                     )
 
+parser.add_argument('--jobs',
+                    '-j',
+                    type=int,
+                    required=False,
+                    default=1,
+                    help="Number of processes used to parse the awr reports and to build the figures of the report, "
+                         "0 to use all the available cores"
+                    )
+
+parser.add_argument('--engine',
+                    type=str,
+                    required=False,
+                    default="soup",
+                    help="Specify the parsing engine, can be 'soup' to build the whole html tree of each report or "
+                         "'lxml' to stream the reports and extract only the tables of interest"
+                    )
+
+parser.add_argument('--format',
+                    type=str,
+                    required=False,
+                    default="csv",
+                    help="Specify the format of the parsed tables, can be 'csv', 'parquet', 'feather' or 'sqlite' "
+                         "(a single indexed database file)"
+                    )
+
+parser.add_argument('--pages',
+                    type=str,
+                    required=False,
+                    default="system,overview,load,critical,wait,tablespace,regressions",
+                    help="Comma separated list of the pages of the report, can be 'system', 'overview', 'load', "
+                         "'critical', 'wait', 'tablespace' and 'regressions' (only the tables used by these pages "
+                         "are read)"
+                    )
+
+parser.add_argument('--figureCache',
+                    type=str2bool,
+                    required=False,
+                    default=True,
+                    help="If the figures of the report must be stored in the 'figures' folder of the output directory, "
+                         "so that only the figures whose data changed are built again by the next report"
+                    )
+
+parser.add_argument('--maxPoints',
+                    type=int,
+                    required=False,
+                    default=1000,
+                    help="Maximum number of points of each plotted series, longer series are downsampled keeping "
+                         "their shape and their peaks (0 to plot all the points)"
+                    )
+
+parser.add_argument('--webglThreshold',
+                    type=int,
+                    required=False,
+                    default=10000,
+                    help="Number of points of a figure above which it is drawn with WebGL instead of SVG "
+                         "(0 to always use SVG)"
+                    )
+
+parser.add_argument('--detector',
+                    type=str,
+                    required=False,
+                    default="iqr",
+                    help="Anomaly detector of the load profile peaks, can be 'iqr', 'mad' (robust z-score) or "
+                         "'rolling' (robust z-score against the previous snapshots)"
+                    )
+
+parser.add_argument('--onlineState',
+                    type=str,
+                    required=False,
+                    default=None,
+                    help="Path of the .json file with the running statistics of the online anomaly detector: "
+                         "the snapshots of the new AWR reports are scored against it and their peaks are printed "
+                         "right after parsing (disabled if not specified)"
+                    )
+
+parser.add_argument('--regressionFactor',
+                    type=float,
+                    required=False,
+                    default=2.0,
+                    help="Ratio between the elapsed time per execution of a query and its baseline above which "
+                         "the query is reported as regressed"
+                    )
+
+parser.add_argument('--regressionBaseline',
+                    type=int,
+                    required=False,
+                    default=5,
+                    help="Number of snapshots of a query whose median elapsed time per execution is its baseline"
+                    )
+
+parser.add_argument('--stageCache',
+                    type=str2bool,
+                    required=False,
+                    default=True,
+                    help="Store the pages of the report in the 'stages' folder of the outputDir with the fingerprint "
+                         "of their tables and options, so that only the pages whose input changed are built again"
+                    )
+
+parser.add_argument('--profile',
+                    type=str,
+                    required=False,
+                    default=None,
+                    help="Path of the .json file of the timing and memory trace of the stages of the run "
+                         "(parsing, tables, processors, figures, report), a summary table is printed at the end "
+                         "(disabled if not specified)"
+                    )
+
+parser.add_argument('--profileFormat',
+                    type=str,
+                    required=False,
+                    default="json",
+                    help="Format of the trace, 'json' or 'chrome' (to be opened with chrome://tracing or Perfetto)"
+                    )
+
+parser.add_argument('--watch',
+                    type=str2bool,
+                    required=False,
+                    default=False,
+                    help="After the report is created, keep polling the input directory and update the report "
+                         "when new AWR reports appear, keeping the parsed data in memory"
+                    )
+
+parser.add_argument('--interval',
+                    type=int,
+                    required=False,
+                    default=60,
+                    help="Seconds between two polls of the input directory in watch mode"
+                    )
+
+parser.add_argument('--fleet',
+                    type=str2bool,
+                    required=False,
+                    default=False,
+                    help="Fleet mode, for the AWR reports of several databases: one report for each database (DB_ID) "
+                         "generated in parallel in res/awr/fleet, plus a summary page ranking the databases by DB time"
+                    )
+
 args = parser.parse_args()
@@ -0,0 +1,79 @@
+"""
+Compare the parsing engines of AWRParser on a directory of AWR reports
+
+usage (from the root of the repository):
+    python -m benchmarks.parse_engines --inputDir data/raw/awr [--repeat 3]
+"""
+import argparse
+from pathlib import Path
+from time import perf_counter
+
+from parsing.awr_parser import AWRParser, get_tables_from_json, ENGINES
+
+
+def time_engine(tables, engine, filelist, repeat=1, workers=1):
+    """
+    Parse the reports with the specified engine
+
+    Parameters
+    ----------
+    tables : dict
+                AWR tables information (see get_tables_from_json)
+    engine : str
+                one of the parsing engines
+    filelist : list
+                list of html files to parse
+    repeat : (optional) int
+                number of runs, the best one is returned
+    workers : (optional) int
+                number of processes used by the parser
+
+    Returns
+    -------
+    best : float
+            best wall time of the runs, in seconds
+    output : dict
+            the parsed data
+    """
+
+    p = AWRParser(tables, engine=engine)
+    best = None
+    output = None
+    for _ in range(repeat):
+        start = perf_counter()
+        output = p.parse(filelist, workers=workers)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the AWR parsing engines')
+    parser.add_argument('--inputDir', type=str, required=True, help="Path where to find the awr reports")
+    parser.add_argument('--tables', type=str, default='tables.json', help="Path of the json file of the AWR tables")
+    parser.add_argument('--recursive', '-r', action='store_true', help="Search the awr reports recursively")
+    parser.add_argument('--repeat', type=int, default=1, help="Number of runs for each engine")
+    parser.add_argument('--jobs', '-j', type=int, default=1, help="Number of processes used by the parser")
+    args = parser.parse_args()
+
+    filepath = Path(args.inputDir)
+    filelist = sorted(filepath.rglob('*.html') if args.recursive else filepath.glob('*.html'))
+    tables = get_tables_from_json(args.tables)
+
+    results = {}
+    for engine in ENGINES:
+        results[engine] = time_engine(tables, engine, filelist, repeat=args.repeat, workers=args.jobs)
+
+    print(f'\n{len(filelist)} reports')
+    baseline = results[ENGINES[0]][0]
+    for engine, (elapsed, _) in results.items():
+        print(f'  {engine:<6} {elapsed:8.3f} s  ({baseline / elapsed:.1f}x)')
+
+    outputs = [output for _, output in results.values()]
+    identical = all(output == outputs[0] for output in outputs[1:])
+    print('Output identical across engines: ' + ('yes' if identical else 'NO'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Benchmark of the whole pipeline (parsing, processing, peak detection and report rendering) on synthetic
+AWR reports of increasing size, see synthetic_awr. The results are written to a .json file, so that
+the ones of two versions can be compared
+
+usage (from the root of the repository):
+    python -m benchmarks.pipeline [--sizes 10,100,1000,10000] [--instances 2] [--output bench.json]
+                                  [--baseline previous_bench.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import datapane as dp
+
+from parsing.awr_parser import AWRParser, get_tables_from_json
+from preprocessing.awr_preprocessing.dataset import AWRDataset
+from preprocessing.awr_preprocessing.load_profile_processing import LoadProcessor
+from preprocessing.awr_preprocessing.sql_processing import SqlProcessor
+from preprocessing.awr_preprocessing.wait_classes_processing import WaitClassProcessor
+from preprocessing.awr_preprocessing.foreground_events_waits_processing import ForegroundEventWaitProcessor
+from preprocessing.awr_preprocessing.tablespace_io_processing import TablespaceIoProcessor
+from reporting.downsampling import MAX_POINTS
+from reporting.plot_utils import melt_df, generate_overview
+from reporting.reporting_utils import (generate_overiview_list, generate_wait_class_list, generate_tbs_io_list,
+                                       generate_sql_regressions_list)
+from .synthetic_awr import generate_reports
+
+
+SIZES = [10, 100, 1000, 10000]
+
+PROCESSORS = {
+    'load': LoadProcessor,
+    'wc': WaitClassProcessor,
+    'tio': TablespaceIoProcessor,
+    'sql': SqlProcessor,
+    'fw': ForegroundEventWaitProcessor,
+}
+
+
+class Timer:
+    """
+    Wall time of the stages of a benchmark run
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def __call__(self, stage, function, *args, **kwargs):
+        start = perf_counter()
+        result = function(*args, **kwargs)
+        self.stages[stage] = perf_counter() - start
+        return result
+
+
+def peak_rss_mb():
+    # peak resident set size of this process and of its terminated children (ie the parsing workers)
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024 * 1024 if platform.system() == 'Darwin' else 1024  # bytes on macOS, KB on Linux
+    return round(self_rss / scale, 1), round(children_rss / scale, 1)
+
+
+def render_report(processors, path):
+    """
+    Render a report with the pages of the load profile, the wait classes, the tablespaces and the
+    SQL regressions (the figures are built serially, without the figure cache)
+    """
+
+    l = processors['load']
+    melt_list = []
+    for i in range(l.tot_instances):
+        peaks = l.get_peaks_instance(i) if len(l.grouped_dfs[i]) > MAX_POINTS else None
+        df_melt = melt_df(l.grouped_dfs[i], max_points=MAX_POINTS, peaks=peaks)
+        df_melt['INST_NUM'] = np.full(len(df_melt), i + 1)
+        melt_list.append(df_melt)
+
+    def instance_blocks(blocks):
+        return dp.Select(blocks=blocks) if len(blocks) > 1 else dp.Group(blocks=blocks)
+
+    pages = [
+        dp.Page(dp.Plot(generate_overview(pd.concat(melt_list))), instance_blocks(generate_overiview_list(melt_list)),
+                title='Overview'),
+        dp.Page(instance_blocks(generate_wait_class_list(processors['wc'], max_points=MAX_POINTS)), title='Wait'),
+        dp.Page(instance_blocks(generate_tbs_io_list(processors['tio'], max_points=MAX_POINTS)), title='Tablespace'),
+        dp.Page(instance_blocks(generate_sql_regressions_list(processors['sql'], max_points=MAX_POINTS)),
+                title='SQL Regressions'),
+    ]
+    dp.save_report(dp.Blocks(blocks=pages), path=str(path))
+
+
+def run_size(n_reports, work_dir, instances=1, top_n=10, workers=1, engine='soup', output_format='csv',
+             tables='tables.json'):
+    """
+    Benchmark of the pipeline on 'n_reports' synthetic reports.
+    Runs in a process of its own, so that the peak RSS is the one of this size only
+
+    Parameters
+    ----------
+    n_reports : int
+                number of reports, split among the instances
+    work_dir : str or Path()
+                folder of the reports, of the parsed data and of the report
+    instances : (optional) int
+    top_n : (optional) int
+                number of rows of the top tables of the reports
+    workers : (optional) int
+                number of processes used by the parser
+    engine : (optional) str
+                parsing engine
+    output_format : (optional) str
+                format of the parsed tables
+    tables : (optional) str
+                path of the tables .json file
+
+    Returns
+    -------
+    dict with the configuration, the wall time of each stage (seconds) and the peak RSS (MB)
+    """
+
+    work_dir = Path(work_dir)
+    raw_dir, parsed_dir = work_dir / 'raw', work_dir / 'parsed'
+    tables = get_tables_from_json(tables)
+    timer = Timer()
+
+    filelist = timer('generate', generate_reports, raw_dir, max(1, n_reports // instances), instances=instances,
+                     top_n=top_n, tables=tables)
+    awr_parser = AWRParser(tables, engine=engine)
+    timer('parse', awr_parser.parse, filelist, workers=workers)
+    timer('make_csv', awr_parser.make_csv, mode='new', input_dir=raw_dir, output_dir=parsed_dir,
+          workers=workers, output_format=output_format)
+
+    dataset = AWRDataset(parsed_dir)
+    for csvname in ['load_profile.csv', 'wait_classes.csv', 'tablespace_io.csv', 'sql_cpu.csv', 'sql_elapsed.csv',
+                    'sql_user_io.csv', 'foreground_events_wait.csv']:
+        timer(f'read {csvname}', dataset.get_table, csvname)
+
+    # the tables are already in memory, set_df only processes them
+    processors = {key: timer(f'set_df {key}', processor_class, f'{key}-bench', input_path=parsed_dir,
+                             dataset=dataset)
+                  for key, processor_class in PROCESSORS.items()}
+
+    tot_instances = processors['load'].tot_instances
+    l, wc = processors['load'], processors['wc']
+    timer('peaks load', lambda: [l.get_peaks_instance(i) for i in range(tot_instances)])
+    timer('peaks wc', lambda: [wc.find_peaks_instance(i, metric) for i in range(tot_instances)
+                               for metric in wc.grouped_dfs[i].columns])
+    timer('sql regressions', processors['sql'].find_regressions)
+
+    timer('render', render_report, processors, work_dir / 'awr_report.html')
+
+    rss, children_rss = peak_rss_mb()
+    return {'reports': len(filelist), 'instances': instances, 'top_n': top_n, 'workers': workers,
+            'engine': engine, 'format': output_format,
+            'seconds': {stage: round(elapsed, 4) for stage, elapsed in timer.stages.items()},
+            'peak_rss_mb': rss, 'peak_rss_workers_mb': children_rss}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Print the wall time of each stage against the one of a previous run with the same number of reports
+    and instances
+
+    Parameters
+    ----------
+    results : list
+                results of the sizes, see run_size
+    baseline : dict
+                content of the .json file of the previous run
+    """
+
+    previous = {(r['reports'], r['instances']): r for r in baseline['results']}
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('created')}):")
+    for result in results:
+        old = previous.get((result['reports'], result['instances']))
+        if old is None:
+            continue
+        print(f"  {result['reports']} reports")
+        for stage, elapsed in result['seconds'].items():
+            if stage in old['seconds'] and old['seconds'][stage] > 0:
+                print(f"    {stage:<34} {old['seconds'][stage]:9.3f} s -> {elapsed:9.3f} s  "
+                      f"({elapsed / old['seconds'][stage]:.2f}x)")
+        print(f"    {'peak RSS':<34} {old['peak_rss_mb']:9.1f} MB -> {result['peak_rss_mb']:9.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the pipeline on synthetic AWR reports')
+    parser.add_argument('--sizes', type=str, default=','.join(str(s) for s in SIZES),
+                        help="Comma separated numbers of reports")
+    parser.add_argument('--instances', type=int, default=2, help="Number of instances of the database")
+    parser.add_argument('--topN', type=int, default=10, help="Number of rows of the top tables (ie top SQL)")
+    parser.add_argument('--jobs', '-j', type=int, default=1, help="Number of processes used by the parser")
+    parser.add_argument('--engine', type=str, default='soup', help="Parsing engine")
+    parser.add_argument('--format', type=str, default='csv', help="Format of the parsed tables")
+    parser.add_argument('--tables', type=str, default='tables.json', help="Path of the json file of the AWR tables")
+    parser.add_argument('--workDir', type=str, default=None,
+                        help="Folder of the generated data, a temporary one removed at the end if not specified")
+    parser.add_argument('--output', type=str, default='bench.json', help="Path of the .json file of the results")
+    parser.add_argument('--baseline', type=str, default=None,
+                        help="Path of the .json file of a previous run to compare with")
+    args = parser.parse_args()
+
+    work_dir = Path(args.workDir if args.workDir is not None else tempfile.mkdtemp(prefix='awr-bench-'))
+    results = []
+    try:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            print(f'{size} reports...')
+            size_dir = work_dir / str(size)
+            if os.path.isdir(size_dir):
+                shutil.rmtree(size_dir)
+            with ProcessPoolExecutor(max_workers=1) as executor:  # a fresh process for each size
+                result = executor.submit(run_size, size, size_dir, instances=args.instances, top_n=args.topN,
+                                         workers=args.jobs, engine=args.engine, output_format=args.format,
+                                         tables=args.tables).result()
+            results.append(result)
+            for stage, elapsed in result['seconds'].items():
+                print(f'  {stage:<34} {elapsed:9.3f} s')
+            print(f"  {'peak RSS':<34} {result['peak_rss_mb']:9.1f} MB")
+    finally:
+        if args.workDir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {'created': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+              'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+              'results': results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Generate synthetic AWR reports in html format, with the tables listed in the tables .json file
+plus the instance, snapshot and host tables read by AWRParser
+
+usage (from the root of the repository):
+    python -m benchmarks.synthetic_awr --outputDir data/raw/synthetic --snapshots 100 [--instances 2] [--topN 10]
+"""
+import argparse
+import html
+import os
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from parsing.awr_parser import get_tables_from_json, INSTANCE_SECTION, SNAPSHOT_SECTION, HOST_SECTION
+
+
+LOAD_METRICS = ['DB Time(s)', 'DB CPU(s)', 'Background CPU(s)', 'Redo size (bytes)', 'Logical read (blocks)',
+                'Block changes', 'Physical read (blocks)', 'Physical write (blocks)', 'Read IO requests',
+                'Write IO requests', 'Read IO (MB)', 'Write IO (MB)', 'User calls', 'Parses (SQL)',
+                'Hard parses (SQL)', 'Logons', 'Executes (SQL)', 'Rollbacks', 'Transactions']
+
+WAIT_CLASSES = ['DB CPU', 'User I/O', 'Commit', 'Concurrency', 'Network', 'System I/O', 'Other', 'Application',
+                'Configuration', 'Cluster', 'Administrative', 'Scheduler']
+
+EVENTS = ['db file sequential read', 'log file sync', 'DB CPU', 'db file scattered read', 'direct path read',
+          'enq: TX - row lock contention', 'gc cr block 2-way', 'log file parallel write', 'latch: shared pool',
+          'SQL*Net more data to client', 'read by other session', 'buffer busy waits']
+
+TABLESPACES = ['SYSTEM', 'SYSAUX', 'USERS', 'UNDOTBS1', 'TEMP', 'DATA', 'INDEXES']
+
+# columns whose values are the rows of the table, the other tables have 'top_n' rows
+KEY_COLUMNS = {'Name': LOAD_METRICS, 'Wait Class': WAIT_CLASSES, 'Tablespace': TABLESPACES}
+
+# share of the snapshots with a peak of the load profile
+PEAK_PROBABILITY = 0.08
+
+SNAP_TIME_FORMAT = '%d-%b-%y %H:%M:%S'
+
+
+def html_table(summary, header, rows):
+    """
+    Html table as found in the AWR reports
+
+    Parameters
+    ----------
+    summary : str
+                'summary' attribute of the table, used by the parser to find it
+    header : list
+                column names
+    rows : list
+                rows of the table, lists of cells already formatted
+
+    Returns
+    -------
+    the html of the table as a string
+    """
+
+    lines = [f'<table border="0" class="tdiff" summary="{summary}">',
+             '<tr>' + ''.join(f'<th class="awrbg" scope="col">{html.escape(h)}</th>' for h in header) + '</tr>']
+    for row in rows:
+        lines.append('<tr>' + ''.join(f'<td class="awrc">{c}</td>' for c in row) + '</tr>')
+    lines.append('</table><p />')
+    return '\n'.join(lines)
+
+
+def number(rnd, scale=1000.0, decimals=2):
+    # formatted as in the reports, with the thousands separator
+    return f'{rnd.random() * scale:,.{decimals}f}'
+
+
+def cell(rnd, column, sql_ids):
+    """
+    Random value of a cell, based on the name of its column
+
+    Parameters
+    ----------
+    rnd : random.Random
+    column : str
+    sql_ids : list
+                SQL Ids the queries are drawn from, so that the same queries appear in several snapshots
+
+    Returns
+    -------
+    the formatted cell
+    """
+
+    column = column.strip()
+    if column == 'SQL Id':
+        return f'<a class="awr" href="#{sql_ids[0]}">{rnd.choice(sql_ids)}</a>'
+    if column == 'SQL Module':
+        return rnd.choice(['SQL*Plus', 'JDBC Thin Client', 'batch.exe'])
+    if column == 'PDB Name':
+        return 'PDB1'
+    if column == 'SQL Text':
+        return html.escape(f'select a, b from t{rnd.randint(1, 99)} where x = :1')
+    if column in ('Event', 'Event Caused'):
+        return rnd.choice(EVENTS)
+    if column == 'Wait Class':
+        return rnd.choice(WAIT_CLASSES)
+    if column.startswith('Avg Wait'):
+        return f'{rnd.random() * 10:.2f}ms'
+    if column == 'Blocking Sid (Inst)':
+        return f'{rnd.randint(1, 999)},{rnd.randint(1, 99999)}@{rnd.randint(1, 4)}'
+    if column == 'User':
+        return rnd.choice(['SYS', 'APP', 'BATCH'])
+    if column == 'Program':
+        return rnd.choice(['sqlplus', 'JDBC Thin Client', 'oracle (LGWR)'])
+    if column == 'XIDs':
+        return '0'
+    if column.startswith('%'):
+        return number(rnd, 100, 1)
+    return number(rnd)
+
+
+def table_rows(rnd, header, top_n, sql_ids, peak=False):
+    """
+    Random rows of one of the tables of the tables .json file
+
+    Parameters
+    ----------
+    rnd : random.Random
+    header : list
+                column names
+    top_n : int
+            number of rows of the tables without key column (ie the top SQL tables)
+    sql_ids : list
+                see cell
+    peak : (optional) bool
+                whether the values of the snapshot are a peak of the load profile
+
+    Returns
+    -------
+    list of rows
+    """
+
+    keys = KEY_COLUMNS.get(header[0].strip())
+    if keys is None:
+        return [[cell(rnd, column, sql_ids) for column in header] for _ in range(top_n)]
+
+    rows = []
+    for key in keys:
+        if header[0].strip() == 'Wait Class' and rnd.random() < 0.1:  # the classes without waits are left out
+            continue
+        row = [key + (':' if header[0].strip() == 'Name' else '')]
+        for column in header[1:]:
+            if column.strip() == 'Per Second':
+                value = (1000 + rnd.random() * 100) * (8 if peak else 1)
+                row.append(f'{value:,.1f}')
+            else:
+                row.append(cell(rnd, column, sql_ids))
+        rows.append(row)
+
+    return rows
+
+
+def generate_report(rnd, tables, begin, inst_num, db_name='ORCL', db_id='1234567890', interval=60, top_n=10,
+                    sql_ids=None, filler=100):
+    """
+    Generate a single AWR report
+
+    Parameters
+    ----------
+    rnd : random.Random
+    tables : dict
+                AWR tables information (see get_tables_from_json)
+    begin : datetime
+                begin snapshot time
+    inst_num : int
+                INST_NUM of the instance
+    db_name : (optional) str
+    db_id : (optional) str
+    interval : (optional) int
+                minutes between the begin and the end snapshot
+    top_n : (optional) int
+                number of rows of the top tables (ie the top SQL tables)
+    sql_ids : (optional) list
+                see cell
+    filler : (optional) int
+                number of rows of the sections not read by the parser, as the big ones of the real reports
+
+    Returns
+    -------
+    the html of the report as a string
+    """
+
+    if sql_ids is None:
+        sql_ids = [f'{i:013x}' for i in range(50)]
+    end = begin + timedelta(minutes=interval)
+    peak = rnd.random() < PEAK_PROBABILITY
+
+    out = ['<html><head><title>AWR Report</title></head><body class="awr">',
+           '<h1 class="awr">WORKLOAD REPOSITORY report for</h1>',
+           html_table(INSTANCE_SECTION, ['DB Name', 'DB Id', 'Unique Name', 'Role', 'Edition', 'Release', 'RAC'],
+                      [[db_name, db_id, db_name.lower(), 'PRIMARY', 'EE', '19.0.0.0.0', 'YES']]),
+           html_table(INSTANCE_SECTION, ['Instance', 'Inst Num', 'Startup Time'],
+                      [[f'{db_name.lower()}{inst_num}', str(inst_num), '01-Jan-23 00:00']]),
+           html_table(HOST_SECTION, ['Host Name', 'Platform', 'CPUs', 'Cores', 'Sockets', 'Memory (GB)'],
+                      [[f'{db_name.lower()}-host{inst_num}', 'Linux x86 64-bit', '16', '8', '1', '125.80']]),
+           html_table(SNAPSHOT_SECTION, ['', 'Snap Id', 'Snap Time', 'Sessions'],
+                      [['Begin Snap:', '100', begin.strftime(SNAP_TIME_FORMAT), '50'],
+                       ['End Snap:', '101', end.strftime(SNAP_TIME_FORMAT), '52'],
+                       ['Elapsed:', '', f'{interval:.2f} (mins)', '']])]
+
+    for summary, (_, header) in tables.items():
+        header = header.split(',')
+        out.append(html_table(summary, header, table_rows(rnd, header, top_n, sql_ids, peak)))
+
+    # sections not read by the parser
+    out.append(html_table('This table displays the text of the SQL statements which have been referred to in the report',
+                          ['SQL Id', 'SQL Text'],
+                          [[f'<a name="{sql_id}"></a>{sql_id}', 'select * from dual where ' +
+                            ' and '.join(f'c{j} = {j}' for j in range(30))] for sql_id in sql_ids[:filler]]))
+    out.append(html_table('This table displays name and value of init.ora parameters',
+                          ['Parameter Name', 'Begin value', 'End value'],
+                          [[f'_param_{i}', str(i), '&#160;'] for i in range(filler)]))
+    out.append('</body></html>')
+
+    return '\n'.join(out)
+
+
+def generate_reports(output_dir, snapshots, instances=1, databases=1, top_n=10, n_sql_ids=50, interval=60,
+                     filler=100, tables='tables.json', start=datetime(2023, 1, 1), seed=0):
+    """
+    Generate the AWR reports of 'snapshots' consecutive snapshots of each instance of each database
+
+    Parameters
+    ----------
+    output_dir : str or Path()
+                    folder of the reports, created if it does not exist
+    snapshots : int
+                    number of snapshots of each instance
+    instances : (optional) int
+                    number of instances of each database
+    databases : (optional) int
+                    number of databases (DB_ID), see the fleet mode of main.py
+    top_n : (optional) int
+                number of rows of the top tables
+    n_sql_ids : (optional) int
+                number of distinct queries of each database
+    interval : (optional) int
+                minutes between two snapshots
+    filler : (optional) int
+                see generate_report
+    tables : (optional) str or dict
+                path of the tables .json file, or the AWR tables information
+    start : (optional) datetime
+                begin time of the first snapshot
+    seed : (optional) int
+                seed of the random values, the same seed gives the same reports
+
+    Returns
+    -------
+    list of the paths of the reports
+    """
+
+    if not isinstance(tables, dict):
+        tables = get_tables_from_json(tables)
+    output_dir = Path(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    rnd = random.Random(seed)
+
+    filelist = []
+    for d in range(databases):
+        db_name = 'ORCL' if databases == 1 else f'DB{d + 1:03d}'
+        db_id = str(1234567890 + d)
+        sql_ids = [f'{db_id[-4:]}{i:09x}' for i in range(n_sql_ids)]
+        for s in range(snapshots):
+            begin = start + timedelta(minutes=interval * s)
+            for inst_num in range(1, instances + 1):
+                path = output_dir / f'awrrpt_{db_name}_{inst_num}_{s:05d}.html'
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(generate_report(rnd, tables, begin, inst_num, db_name=db_name, db_id=db_id,
+                                            interval=interval, top_n=top_n, sql_ids=sql_ids, filler=filler))
+                filelist.append(path)
+
+    return filelist
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic AWR reports')
+    parser.add_argument('--outputDir', type=str, required=True, help="Folder of the generated reports")
+    parser.add_argument('--snapshots', type=int, required=True, help="Number of snapshots of each instance")
+    parser.add_argument('--instances', type=int, default=1, help="Number of instances of each database")
+    parser.add_argument('--databases', type=int, default=1, help="Number of databases")
+    parser.add_argument('--topN', type=int, default=10, help="Number of rows of the top tables (ie top SQL)")
+    parser.add_argument('--sqlIds', type=int, default=50, help="Number of distinct queries of each database")
+    parser.add_argument('--interval', type=int, default=60, help="Minutes between two snapshots")
+    parser.add_argument('--tables', type=str, default='tables.json', help="Path of the json file of the AWR tables")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    filelist = generate_reports(args.outputDir, args.snapshots, instances=args.instances, databases=args.databases,
+                                top_n=args.topN, n_sql_ids=args.sqlIds, interval=args.interval,
+                                tables=args.tables, seed=args.seed)
+    print(f'{len(filelist)} reports written to {args.outputDir}')
+
+
+if __name__ == "__main__":
+    main()
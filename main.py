@@ -1,5 +1,9 @@
 from parsing.awr_parser import AWRParser, get_tables_from_json
+from parsing.storage import read_table, table_fingerprint
 import os.path
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -15,253 +19,620 @@ import datapane as dp
 from reporting.plot_utils import *
 from reporting.reporting_utils import *
 
-from preprocessing.awr_preprocessing.load_profile_processing import LoadProcessor
+from preprocessing.awr_preprocessing.load_profile_processing import LoadProcessor, summarize_databases
 from preprocessing.awr_preprocessing.sql_processing import SqlProcessor
 from preprocessing.awr_preprocessing.wait_classes_processing import WaitClassProcessor
 from preprocessing.awr_preprocessing.foreground_events_waits_processing import ForegroundEventWaitProcessor
 from preprocessing.awr_preprocessing.tablespace_io_processing import TablespaceIoProcessor
+from preprocessing.awr_preprocessing.dataset import AWRDataset
+from preprocessing.awr_preprocessing.anomaly import OnlineDetector
+from reporting.figure_cache import FigureCache
+from reporting.stages import StageCache, fingerprint, source_fingerprint, run_concurrently
+from profiling import PROFILER, TRACE_FORMATS, run_profiled
 
 from args_parser import args
 
 
 ### PARSE DATA
 
-data = get_tables_from_json(args.tables)
-p = AWRParser(data)
-
-print("Parsing data...")
-p.make_csv(mode=args.mode, 
-           input_dir=args.inputDir, 
-           output_dir=args.outputDir, 
-           recursive=args.recursive)
-
-print("Parsing complete!")
+REPORT_PATH = 'res/awr/awr_report.html'
+FLEET_PATH = 'res/awr/fleet'
+
+PAGES = ['system', 'overview', 'load', 'critical', 'wait', 'tablespace', 'regressions']
+
+# tables read by each page, in watch mode a page is generated again only if one of them changed
+PAGE_TABLES = {
+    'system': ['host_info.csv', 'load_profile.csv'],
+    'overview': ['load_profile.csv'],
+    'load': ['load_profile.csv'],
+    'critical': ['load_profile.csv', 'wait_classes.csv', 'tablespace_io.csv', 'sql_cpu.csv', 'sql_elapsed.csv',
+                 'sql_user_io.csv', 'foreground_events_wait.csv'],
+    'wait': ['wait_classes.csv'],
+    'tablespace': ['tablespace_io.csv'],
+    'regressions': ['sql_cpu.csv', 'sql_elapsed.csv', 'sql_user_io.csv'],
+}
+
+# tables only looked up at given snapshots by the pages: with the sqlite format they are queried in the
+# database instead of being read (see AWRDataset.in_store)
+PAGE_LOOKUPS = {
+    'critical': ['sql_cpu.csv', 'sql_elapsed.csv', 'sql_user_io.csv', 'foreground_events_wait.csv'],
+}
+
+# options used by each page, part of the fingerprint of the page (see generate_report)
+PAGE_OPTIONS = {
+    'system': [],
+    'overview': ['detector', 'maxPoints', 'webglThreshold'],
+    'load': ['detector', 'maxPoints', 'webglThreshold'],
+    'critical': ['detector', 'maxPoints', 'webglThreshold'],
+    'wait': ['maxPoints', 'webglThreshold'],
+    'tablespace': ['maxPoints', 'webglThreshold'],
+    'regressions': ['regressionFactor', 'regressionBaseline', 'maxPoints', 'webglThreshold'],
+}
+
+
+def parse_reports(awr_parser, mode):
+    """
+    Parse the AWR reports of the input directory not parsed yet (see AWRParser.make_csv)
+
+    Returns
+    -------
+    dict with the rows of the new reports of each table, empty if there are no new reports
+    """
+
+    print("Parsing data...")
+    with PROFILER.stage('make_csv', 'main'):
+        new_data = awr_parser.make_csv(mode=mode,
+                                       input_dir=args.inputDir,
+                                       output_dir=args.outputDir,
+                                       recursive=args.recursive,
+                                       workers=args.jobs,
+                                       output_format=args.format)
+
+    print("Parsing complete!")
+    return new_data
+
+
+
+### ONLINE PEAKS
+
+def print_online_peaks(processor, online):
+    for i, labels in enumerate(processor.find_online_anomalies(online)):
+        for timestamp, row in labels.iterrows():
+            metrics = row.index[row.values].tolist()
+            if len(metrics) > 0:
+                print(f'  Instance {i + 1} {timestamp}: ' + ', '.join(metrics))
+
+
+def score_online(new_data, online):
+    # only the snapshots of the reports just parsed, scored against the running statistics
+    new_dataset = AWRDataset(args.outputDir)
+    for csvname, processor_class in [('load_profile.csv', LoadProcessor), ('wait_classes.csv', WaitClassProcessor)]:
+        if len(new_data.get(csvname, [])) < 2:  # header only
+            continue
+        new_dataset.add_rows(csvname, new_data[csvname])
+        print(f"Peaks of the new snapshots ({csvname}):")
+        print_online_peaks(processor_class('online-prc', input_path=args.outputDir, dataset=new_dataset), online)
+    online.save()
 
 
 
 ### GENERATE REPORT
 
-print("Generating report...")
-input_path = args.inputDir
-l = LoadProcessor('load-prc', input_path=input_path)
-df = l.grouped_dfs
-
-melt_list = []
-for i in range(l.tot_instances):
-    df_melt = melt_df(df[i])
-    df_melt['INST_NUM'] = np.full(len(df_melt), i+1)
-    melt_list.append(df_melt)
-
-df_melt = pd.concat(melt_list)
-
-
-# df_melt = melt_df(df)
-fig1 = generate_overview(df_melt)
-fig2 = generate_big_plots(df_melt)
-
-metric_list = ['DB Time(s)', 'Hard parses (SQL)', 'Read IO (MB)', 'Write IO (MB)']
-
-peaks_list = []
-figures_list = []
-for i in range(l.tot_instances):
-    peak_list_inst, figure_list_inst = generate_peaks_figures(l, i, df[i], metric_list)
-    peaks_list.append(peak_list_inst)
-    figures_list.append(figure_list_inst)
-
-
-### SQL Processor
-p = SqlProcessor('sql-proc', input_path=input_path)
-
-# list of 3 tuples, one for each instance
-top_list = []
-for i in range(p.get_num_instances()):
-    t1,t2,t3 = p.get_top_n(n=3, instance=i, start=str(peaks_list[i][0].index[0]), end=str(peaks_list[i][0].index[0]))
-    top_list.append((t1,t2,t3))
-
-
-wc = WaitClassProcessor('waitClasses-prc', input_path=input_path)
-# fig3 = generate_wait_classes_plot(wc.grouped_dfs[1])
-
-
-fw = ForegroundEventWaitProcessor('feWait-prc', input_path=input_path)
-
-overview_list = generate_overiview_list(melt_list)
-overview_list.insert(0, dp.Plot(
-    fig1, label='All Instances'
-))
-
-
-big_plots_list = generate_big_plots_lis(melt_list)
-big_plots_list.insert(0, dp.Plot(
-    fig2, label='All Instances'
-))
-
-
-wait_class_list = generate_wait_class_list(wc)
+def instance_blocks(blocks, num_instances, all_instances=None):
+    # one block for each instance (plus the summary of all instances) only if there is more than one instance
+    if num_instances > 1:
+        if all_instances is not None:
+            blocks = [all_instances] + blocks
+        return dp.Select(blocks=blocks)
+
+    return dp.Blocks(blocks=blocks)
+
+
+def get_processors(dataset, pages, processors, changed=None):
+    """
+    Processors needed by the pages, the ones already built are kept unless one of their tables changed
+
+    Parameters
+    ----------
+    dataset : AWRDataset
+    pages : list
+                pages of the report
+    processors : dict
+                    processors already built, updated in place
+    changed : (optional) set
+                tables whose rows changed, None if every processor must be built.
+                The processors of the changed tables not needed by the pages are dropped
+    """
+
+    input_path = args.outputDir
+    needed = {
+        'load': ('overview' in pages or 'load' in pages or 'critical' in pages, ['load_profile.csv'],
+                 lambda: LoadProcessor('load-prc', input_path=input_path, dataset=dataset, detector=args.detector)),
+        'wc': ('critical' in pages or 'wait' in pages, ['wait_classes.csv'],
+               lambda: WaitClassProcessor('waitClasses-prc', input_path=input_path, dataset=dataset)),
+        'tio': ('critical' in pages or 'tablespace' in pages, ['tablespace_io.csv'],
+                lambda: TablespaceIoProcessor('tbs-proc', input_path=input_path, dataset=dataset)),
+        'sql': ('critical' in pages or 'regressions' in pages,
+                ['sql_cpu.csv', 'sql_elapsed.csv', 'sql_user_io.csv'],
+                lambda: SqlProcessor('sql-proc', input_path=input_path, dataset=dataset)),
+        'fw': ('critical' in pages, ['foreground_events_wait.csv'],
+               lambda: ForegroundEventWaitProcessor('feWait-prc', input_path=input_path, dataset=dataset)),
+    }
+
+    for key, (used, tables, build) in needed.items():
+        stale = changed is None or len(changed.intersection(tables)) > 0
+        if not used:
+            if stale:
+                processors.pop(key, None)
+            continue
+        if key not in processors or stale:
+            with PROFILER.stage(key, 'process'):
+                processors[key] = build()
+
+    return processors
+
+
+def generate_pages(dataset, pages, figure_cache, processors, report_pages, changed=None):
+    """
+    Generate the pages of the report missing from 'report_pages'
+
+    Parameters
+    ----------
+    dataset : AWRDataset
+    pages : list
+                pages of the report
+    figure_cache : FigureCache
+    processors : dict
+                    see get_processors
+    report_pages : dict
+                    pages already generated and still valid, updated in place
+    changed : (optional) set
+                tables whose rows changed, see get_processors
+
+    Returns
+    -------
+    List of datapane Page, in the order of 'pages'
+    """
+
+    input_path = args.outputDir
+    todo = [page for page in pages if page not in report_pages]
+    if len(todo) == 0:
+        return [report_pages[page] for page in pages]
+
+    get_processors(dataset, todo, processors, changed)
+    num_instances = dataset.get_num_instances()
+
+    if 'system' in todo:
+        ### host info ###
+        if dataset.db_id is None:
+            df_host = read_table(input_path, 'host_info.csv')
+            df_host = df_host.set_index('Host Name')
+        ### db info ###
+        df_db = dataset.get_table('load_profile.csv')
+        df_db = df_db[['DB_NAME', 'DB_ID', 'UNIQUE_NAME', 'ROLE', 'INSTANCE_NAME', 'INST_NUM']].drop_duplicates()
+        df_db = df_db.set_index('INSTANCE_NAME')
+
+        if dataset.db_id is not None:  # a database of a fleet, the hosts are listed in the fleet summary
+            report_pages['system'] = dp.Page(
+                dp.Group(
+                    dp.Text("## Database Info"),
+                    dp.Table(df_db),
+                    columns=1
+                ),
+                title='System Info'
+            )
+        else:
+            report_pages['system'] = dp.Page(
+                dp.Group(
+                    dp.Text("## Database Info"),
+                    dp.Table(df_db),
+                    columns=1
+                ),
+                dp.HTML("""
+                    <html>
+                    <body style="background-color:white;">
+                        <div>
+                        <p> &nbsp&nbsp&nbsp  </p>
+                        </div>
+                    </body>
+                    </html>
+                    """),
+                dp.Group(
+                    dp.Text("## Host Info"),
+                    dp.Table(df_host),
+                    columns=1
+                ),
+                title='System Info'
+            )
+
+    if 'overview' in todo or 'load' in todo or 'critical' in todo:
+        l = processors['load']
+        df = l.grouped_dfs
+
+        melt_list = []
+        for i in range(l.tot_instances):
+            # the long series are downsampled, always keeping their peaks
+            peaks = l.get_peaks_instance(i) if args.maxPoints and len(df[i]) > args.maxPoints else None
+            df_melt = melt_df(df[i], max_points=args.maxPoints, peaks=peaks)
+            df_melt['INST_NUM'] = np.full(len(df_melt), i+1)
+            melt_list.append(df_melt)
+
+        df_melt = pd.concat(melt_list)
+
+    if 'overview' in todo:
+        fig1 = figure_cache.build(generate_overview, df_melt, webgl_threshold=args.webglThreshold)
+        overview_list = generate_overiview_list(melt_list, figure_cache=figure_cache,
+                                                webgl_threshold=args.webglThreshold)
+
+        report_pages['overview'] = dp.Page(
+            instance_blocks(overview_list, num_instances, all_instances=dp.Plot(fig1, label='All Instances')),
+            title='Overview'
+        )
 
-tio = TablespaceIoProcessor('tbs-proc', input_path=input_path)
+    if 'load' in todo:
+        fig2 = figure_cache.build(generate_big_plots, df_melt, webgl_threshold=args.webglThreshold)
+        big_plots_list = generate_big_plots_lis(melt_list, figure_cache=figure_cache,
+                                                webgl_threshold=args.webglThreshold)
 
+        report_pages['load'] = dp.Page(
+            instance_blocks(big_plots_list, num_instances, all_instances=dp.Plot(fig2, label='All Instances')),
+            title="Load Profile"
+        )
 
-select_list = []
+    if 'critical' in todo:
+        metric_list = ['DB Time(s)', 'Hard parses (SQL)', 'Read IO (MB)', 'Write IO (MB)']
+
+        peaks_list = []
+        figures_list = []
+        for i in range(l.tot_instances):
+            peak_list_inst, figure_list_inst = generate_peaks_figures(l, i, df[i], metric_list,
+                                                                        figure_cache=figure_cache,
+                                                                        max_points=args.maxPoints,
+                                                                        webgl_threshold=args.webglThreshold)
+            peaks_list.append(peak_list_inst)
+            figures_list.append(figure_list_inst)
+
+        select_list = []
+        for i in range(len(figures_list)): # for each instance
+            select_list.append(generate_critical_timestamps_instance(processors['sql'], processors['wc'],
+                                                                     processors['fw'], processors['tio'],
+                                                                     figures_list[i], peaks_list[i], metric_list,
+                                                                     instance=i, figure_cache=figure_cache))
+
+        report_pages['critical'] = dp.Page(
+            instance_blocks(select_list, num_instances),
+            title="Critical Timestamps"
+        )
 
-for i in range(len(figures_list)): # for each instance
-    block_list = []
-    for j in range(len(metric_list)):
-        block = generate_critical_timestamp_block(p, wc, fw, tio, figures_list[i][j], peaks_list[i][j], metric_list[j],
-                                                  instance=i)
-        block_list.append(block)
+    if 'wait' in todo:
+        # fig3 = generate_wait_classes_plot(wc.grouped_dfs[1])
+        wait_class_list = generate_wait_class_list(processors['wc'], figure_cache=figure_cache,
+                                                   max_points=args.maxPoints, webgl_threshold=args.webglThreshold)
 
-    select_block = dp.Select(
-        blocks=block_list,
-        label=f'Instance {i+1}'
-    )
-    select_list.append(select_block)
-
-
-### host info ###
-df_host = pd.read_csv('data/parsed/centrico_2h/host_info.csv')
-df_host = df_host.set_index('Host Name')
-### db info ###
-df_db = l.df[['DB_NAME', 'DB_ID', 'UNIQUE_NAME', 'ROLE', 'INSTANCE_NAME', 'INST_NUM']].drop_duplicates()
-df_db = df_db.set_index('INSTANCE_NAME')
-
-# set the number of instances
-NUM_INSTANCES=l.get_num_instances(df)
-
-#TODO reformat all "Critical Timestamps" tables
-#TODO add log io stats
-
-if NUM_INSTANCES > 1:
-
-    datapane_app = dp.Blocks(
-        dp.Page(
-            dp.Group(
-                dp.Text("## Database Info"),
-                dp.Table(df_db),
-                columns=1
-            ),
-            dp.HTML("""
-                <html>
-                <body style="background-color:white;">
-                    <div>
-                    <p> &nbsp&nbsp&nbsp  </p>
-                    </div>
-                </body>
-                </html>
-                """),
-            dp.Group(
-                dp.Text("## Host Info"),
-                dp.Table(df_host),
-                columns=1
-            ),
-            title='System Info'
-        ),
-        dp.Page(
-            dp.Select(
-                blocks=overview_list
-            ),
-            title='Overview'
-        ),
-        dp.Page(
-            dp.Select(
-                blocks=big_plots_list
-            ),
-            title="Load Profile"
-        ),
-        dp.Page(
-            dp.Select(
-                blocks=select_list
-            ),
-            title="Critical Timestamps"
-        ),
-        dp.Page(
-            dp.Select(
-                blocks=wait_class_list
-            ),
+        report_pages['wait'] = dp.Page(
+            instance_blocks(wait_class_list, num_instances),
             title="Wait Classes",
-        ),
-        dp.Page(
-            dp.Text("#### Top 10 most used tablespace"),
-            dp.Text("###### (ordered by IOs (Reads + Writes) desc)"),
-            dp.Select(
-                blocks=generate_tbs_io_list(tio),
-            ),
-            title="Tablespace IO"
         )
-    )
 
-else:
-
-    datapane_app = dp.Blocks(
-        dp.Page(
-            dp.Group(
-                dp.Text("## Database Info"),
-                dp.Table(df_db),
-                columns=1
-            ),
-            dp.HTML("""
-                <html>
-                <body style="background-color:white;">
-                    <div>
-                    <p> &nbsp&nbsp&nbsp  </p>
-                    </div>
-                </body>
-                </html>
-                """),
-            dp.Group(
-                dp.Text("## Host Info"),
-                dp.Table(df_host),
-                columns=1
-            ),
-            title='System Info'
-        ),
-        dp.Page(
-            dp.Blocks(
-                blocks=overview_list[1:]  # only the summary plot
-            ),
-            title='Overview'
-        ),
-        dp.Page(
-            dp.Blocks(
-                blocks=big_plots_list[1:]  # only the summary plot
-            ),
-            title="Load Profile"
-        ),
-        dp.Page(
-            dp.Blocks(
-                blocks=select_list
-            ),
-            title="Critical Timestamps"
-        ),
-        dp.Page(
-            dp.Blocks(
-                blocks=wait_class_list
-            ),
-            title="Wait Classes",
-        ),
-        dp.Page(
+    if 'tablespace' in todo:
+        report_pages['tablespace'] = dp.Page(
             dp.Text("#### Top 10 most used tablespace"),
             dp.Text("###### (ordered by IOs (Reads + Writes) desc)"),
-            dp.Blocks(
-                blocks=generate_tbs_io_list(tio),
-            ),
+            instance_blocks(generate_tbs_io_list(processors['tio'], figure_cache=figure_cache,
+                                                 max_points=args.maxPoints, webgl_threshold=args.webglThreshold),
+                            num_instances),
             title="Tablespace IO"
         )
-    )
 
+    if 'regressions' in todo:
+        report_pages['regressions'] = dp.Page(
+            dp.Text("#### Top 10 regressed queries"),
+            dp.Text(f"###### (elapsed time per execution above {args.regressionFactor} times the median of their first "
+                    f"{args.regressionBaseline} snapshots, ordered by excess elapsed time desc)"),
+            instance_blocks(generate_sql_regressions_list(processors['sql'], factor=args.regressionFactor,
+                                                          baseline=args.regressionBaseline, figure_cache=figure_cache,
+                                                          max_points=args.maxPoints,
+                                                          webgl_threshold=args.webglThreshold),
+                            num_instances),
+            title="SQL Regressions"
+        )
 
+    #TODO reformat all "Critical Timestamps" tables
+    #TODO add log io stats
+
+    figure_cache.close()
+    print(f"Figures: {figure_cache.misses} built, {figure_cache.hits} already stored")
+
+    return [report_pages[page] for page in pages]
+
+
+def generate_report(dataset, pages, figure_cache, stage_cache, state):
+    """
+    Generate the report as a graph of stages, each one skipped if the fingerprint of its inputs did not change:
+
+        parsed tables -> processors -> figures (see FigureCache) -> pages -> html
+
+    The fingerprint of a table is its content, the one of a page is made of the fingerprints of its tables
+    (see PAGE_TABLES), its options (see PAGE_OPTIONS) and the code. Only the processors of the changed tables
+    and the pages that use them are built again, the other pages are taken from memory or from the stage cache.
+    The tables of the pages to build are read at once
+
+    Parameters
+    ----------
+    dataset : AWRDataset
+    pages : list
+                pages of the report
+    figure_cache : FigureCache
+    stage_cache : StageCache
+    state : dict
+                processors, pages and fingerprints of the previous call (ie in watch mode), updated in place
+    """
+
+    processors = state.setdefault('processors', {})
+    report_pages = state.setdefault('pages', {})
+    previous = state.setdefault('fingerprints', {})
+    if 'code' not in state:
+        source_dir = Path(__file__).parent
+        state['code'] = source_fingerprint([source_dir / 'main.py'] +
+                                           list((source_dir / 'reporting').glob('*.py')) +
+                                           list((source_dir / 'preprocessing' / 'awr_preprocessing').glob('*.py')))
+
+    ### table stages ###
+    csvnames = sorted({csvname for page in pages for csvname in PAGE_TABLES[page]})
+    with PROFILER.stage('fingerprint_tables', 'main'):
+        tables = run_concurrently({csvname: partial(table_fingerprint, args.outputDir, csvname)
+                                   for csvname in csvnames}, args.jobs)
+    changed = {csvname for csvname in csvnames if previous.get(csvname) != tables[csvname]}
+    previous.update(tables)
+
+    ### page stages ###
+    page_keys = {page: fingerprint(page, [tables[csvname] for csvname in PAGE_TABLES[page]],
+                                   {option: getattr(args, option) for option in PAGE_OPTIONS[page]},
+                                   state['code'], dp.__version__)
+                 for page in pages}
+    report_key = fingerprint([page_keys[page] for page in pages], REPORT_PATH)
+    if stage_cache.load('report', report_key) is not None and os.path.isfile(REPORT_PATH):
+        print(f"Report unchanged ({REPORT_PATH})")
+        return
+
+    for page in pages:
+        if previous.get(page) != page_keys[page]:
+            report_pages.pop(page, None)
+            stored_page = stage_cache.load(f'page-{page}', page_keys[page])
+            if stored_page is not None:
+                report_pages[page] = stored_page
+            previous[page] = page_keys[page]
+
+    todo = [page for page in pages if page not in report_pages]
+    print(f"Pages: {len(todo)} built, {len(pages) - len(todo)} unchanged")
+
+    if len(todo) > 0:
+        # the tables of the pages to build not in memory yet, read at once
+        full = {csvname for page in todo for csvname in PAGE_TABLES[page] if csvname not in PAGE_LOOKUPS.get(page, [])}
+        to_read = sorted({csvname for page in todo for csvname in PAGE_TABLES[page]
+                          if tables[csvname] is not None and csvname not in dataset.tables
+                          and (csvname in full or not dataset.in_store(csvname))} - {'host_info.csv'})
+        run_concurrently({csvname: partial(dataset.get_table, csvname) for csvname in to_read}, args.jobs)
+
+        with PROFILER.stage('generate_pages', 'report'):
+            generate_pages(dataset, pages, figure_cache, processors, report_pages, changed)
+        for page in todo:
+            stage_cache.store(f'page-{page}', page_keys[page], report_pages[page])
+
+    ### html stage ###
+    save_report([report_pages[page] for page in pages])
+    stage_cache.store('report', report_key, True)
+
+
+def save_report(report_pages, path=REPORT_PATH):
+    if len(report_pages) == 1:  # a single page is shown without the page selector
+        datapane_app = dp.Blocks(blocks=report_pages[0].blocks)
+    else:
+        datapane_app = dp.Blocks(blocks=report_pages)
+
+    os.makedirs(Path(path).parent, exist_ok=True)
+    with PROFILER.stage('save_report', 'report', path=path):
+        dp.save_report(
+            datapane_app,
+            path=path,
+            formatting=dp.Formatting(
+                light_prose=False,
+                accent_color="DarkSlateBlue",
+                bg_color="#EEE",
+                # text_alignment=dp.TextAlignment.RIGHT,
+                font=dp.FontChoice.MONOSPACE,
+                width=dp.Width.FULL,
+            )
+        )
 
-dp.save_report(
-    datapane_app,
-    path="res/awr/awr_report.html",
-    formatting=dp.Formatting(
-        light_prose=False,
-        accent_color="DarkSlateBlue",
-        bg_color="#EEE",
-        # text_alignment=dp.TextAlignment.RIGHT,
-        font=dp.FontChoice.MONOSPACE,
-        width=dp.Width.FULL,
+    print(f"Report created! ({path})")
+
+
+
+### FLEET
+
+def generate_database_report(dataset, pages, path):
+    # runs in the worker processes, one database at a time
+    figure_cache = FigureCache(Path(args.outputDir) / 'figures' if args.figureCache else None, workers=1)
+    with PROFILER.stage('generate_pages', 'report', database=dataset.db_id):
+        report_pages = generate_pages(dataset, pages, figure_cache, {}, {})
+    save_report(report_pages, path)
+    return path
+
+
+def generate_fleet(dataset, pages):
+    """
+    Fleet mode: one report for each database of the parsed data, generated in parallel (one process
+    for each database), plus a summary page ranking the databases by DB time.
+    The tables are read and partitioned by database once, every report is generated from its partitions
+
+    Parameters
+    ----------
+    dataset : AWRDataset
+                tables of every database
+    pages : list
+                pages of the report of each database
+    """
+
+    databases = dataset.get_databases()
+    csvnames = sorted({csvname for page in pages for csvname in PAGE_TABLES[page]} - {'host_info.csv'})
+    datasets = dataset.split_by_database(csvnames)
+    print(f"Generating the reports of {len(databases)} databases...")
+
+    os.makedirs(FLEET_PATH, exist_ok=True)
+    paths = {db_id: f'{FLEET_PATH}/awr_report_{db_name}_{db_id}.html'
+             for db_id, db_name in zip(databases['DB_ID'], databases['DB_NAME'])}
+
+    # the pages of the tables a database has no rows in are left out of its report
+    db_pages = {}
+    for db_id, db_dataset in datasets.items():
+        empty = {csvname for csvname in csvnames
+                 if csvname in db_dataset.tables and len(db_dataset.tables[csvname]) == 0}
+        db_pages[db_id] = [page for page in pages if len(empty.intersection(PAGE_TABLES[page])) == 0]
+        if len(db_pages[db_id]) < len(pages):
+            print(f"  {paths[db_id]}: no rows in {', '.join(sorted(empty))}, pages left out: "
+                  f"{', '.join(page for page in pages if page not in db_pages[db_id])}")
+
+    workers = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    if workers == 1 or len(datasets) < 2:
+        for db_id, db_dataset in datasets.items():
+            generate_database_report(db_dataset, db_pages[db_id], paths[db_id])
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(datasets))) as executor:
+            if PROFILER.enabled:  # the events of the workers are returned with the results
+                futures = [executor.submit(run_profiled, generate_database_report, db_dataset, db_pages[db_id],
+                                           paths[db_id])
+                           for db_id, db_dataset in datasets.items()]
+                list(PROFILER.collect(future.result() for future in futures))
+            else:
+                futures = [executor.submit(generate_database_report, db_dataset, db_pages[db_id], paths[db_id])
+                           for db_id, db_dataset in datasets.items()]
+                for future in futures:
+                    future.result()
+
+    ### fleet summary ###
+    summary = summarize_databases(dataset.get_table('load_profile.csv'))
+    reports = [f"- [{row['DB_NAME']} ({row['DB_ID']})](awr_report_{row['DB_NAME']}_{row['DB_ID']}.html)"
+               for _, row in summary.iterrows()]
+    df_host = read_table(args.outputDir, 'host_info.csv')
+    df_host = df_host.set_index('Host Name')
+
+    fleet_page = dp.Page(
+        dp.Text("## Databases by DB time"),
+        dp.Text("###### (DB time per second of all the instances of each database, ie the average active "
+                "sessions, averaged over the snapshots)"),
+        dp.Plot(generate_fleet_plot(summary)),
+        dp.Table(summary.set_index('Rank')),
+        dp.Text("## Reports\n" + "\n".join(reports)),
+        dp.Text("## Host Info"),
+        dp.Table(df_host),
+        title='Fleet Summary'
     )
-)
-
-print("Report created!")
\ No newline at end of file
+    save_report([fleet_page], path=f'{FLEET_PATH}/fleet_summary.html')
+
+
+### WATCH
+
+def input_state():
+    # size and modification time of the reports in the input directory
+    filepath = Path(args.inputDir)
+    filelist = filepath.rglob('*.html') if args.recursive else filepath.glob('*.html')
+    return {str(f): (os.stat(f).st_size, os.stat(f).st_mtime) for f in filelist}
+
+
+def watch(awr_parser, dataset, pages, figure_cache, stage_cache, state, online=None):
+    """
+    Poll the input directory and update the report when new AWR reports appear.
+    The reports are parsed once they stop changing between two polls; their rows are appended to the
+    parsed data and to the tables in memory, and only the processors and the pages that use the
+    changed tables are built again (see generate_report)
+    """
+
+    print(f"Watching {args.inputDir} every {args.interval} seconds (Ctrl+C to stop)")
+    parsed = input_state()
+    previous = parsed
+    try:
+        while True:
+            time.sleep(args.interval)
+            current = input_state()
+            if current == parsed or current != previous:  # nothing new, or reports still being written
+                previous = current
+                continue
+
+            new_data = parse_reports(awr_parser, 'append')
+            parsed = previous = current
+            if len(new_data) == 0:
+                continue
+
+            if online is not None:
+                score_online(new_data, online)
+
+            for csvname, rows in new_data.items():
+                dataset.append_rows(csvname, rows)
+
+            print("Updating report...")
+            generate_report(dataset, pages, figure_cache, stage_cache, state)
+
+    except KeyboardInterrupt:
+        print("Watch stopped")
+
+
+def run():
+    data = get_tables_from_json(args.tables)
+    awr_parser = AWRParser(data, engine=args.engine)
+    new_data = parse_reports(awr_parser, args.mode)
+
+    online = None
+    if args.onlineState is not None and args.fleet:
+        print('Error! the online anomaly detector is not supported in fleet mode')
+    elif args.onlineState is not None:
+        online = OnlineDetector(args.onlineState)
+        score_online(new_data, online)
+
+    print("Generating report...")
+    pages = args.pages.split(',')
+    for page in pages:
+        if page not in PAGES:
+            print(f'Error! unknown report page {page}')
+    pages = [page for page in pages if page in PAGES]
+
+    # tables shared by the processors, each of them is read once and only if a page needs it
+    dataset = AWRDataset(args.outputDir)
+
+    if args.fleet:
+        if args.watch:
+            print('Error! watch mode is not supported in fleet mode')
+        generate_fleet(dataset, pages)
+        return
+
+    # figures built in parallel and stored, only the ones whose data changed are built again
+    figure_cache = FigureCache(Path(args.outputDir) / 'figures' if args.figureCache else None, workers=args.jobs)
+
+    # pages stored with the fingerprint of their input, only the ones whose input changed are built again
+    stage_cache = StageCache(Path(args.outputDir) / 'stages' if args.stageCache else None)
+
+    state = {}
+    generate_report(dataset, pages, figure_cache, stage_cache, state)
+
+    if args.watch:
+        watch(awr_parser, dataset, pages, figure_cache, stage_cache, state, online)
+
+
+def main():
+    if args.profile is not None:
+        PROFILER.enabled = True
+    try:
+        run()
+    finally:
+        if PROFILER.enabled:
+            trace_format = args.profileFormat
+            if trace_format not in TRACE_FORMATS:
+                print(f'Error! unknown trace format {trace_format}, using default (json)')
+                trace_format = 'json'
+            PROFILER.write(args.profile, trace_format)
+            PROFILER.print_summary()
+            print(f"Trace written to {args.profile}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 from bs4 import BeautifulSoup
+from lxml import etree
 import codecs
 import os
 import re
@@ -8,8 +9,15 @@ from datetime import datetime
 from pathlib import Path
 from shutil import move
 import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from tqdm import tqdm
 
+from profiling import PROFILER, run_profiled
+from .manifest import read_manifest, write_manifest, select_new_files
+from .storage import FORMATS, table_path, table_name, stored_formats, write_table
+from .schema import SYSTEM_COLUMNS, BEGIN_SNAP, END_SNAP, HOST_COLUMNS, is_numeric_column, to_epoch
+
 
 def move_file(input_path, output_path):
     src = Path(input_path)
@@ -37,6 +45,117 @@ def get_tables_from_json(file_path):
     return data
 
 
+# sections read by the parser besides the ones listed in the tables .json file
+INSTANCE_SECTION = 'This table displays database instance information'
+SNAPSHOT_SECTION = 'This table displays snapshot information'
+HOST_SECTION = 'This table displays host information'
+
+ENGINES = ['soup', 'lxml']
+SUFFIXES = {'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+CHUNK_SIZE = 1 << 16  # size of the chunks fed to the streaming parser
+
+
+def lxml_string(elem):
+    """
+    Equivalent of BeautifulSoup's Tag.string for an lxml element: the text of the only child
+    of the element (searched recursively), None if the element has more than one child
+
+    Parameters
+    ----------
+    elem : lxml.etree._Element
+
+    Returns
+    -------
+    str or None
+    """
+
+    children = list(elem)
+    n_children = (1 if elem.text else 0) + len(children) + sum(1 for c in children if c.tail)
+    if n_children != 1:
+        return None
+    if elem.text:
+        return elem.text
+    if not isinstance(children[0].tag, str):  # comment or processing instruction
+        return children[0].text
+    return lxml_string(children[0])
+
+
+def to_number(text):
+    """
+    Convert the text of a numeric AWR cell to a float. Thousands separators are removed
+    and the K/M/G/T suffixes used by AWR for big values are expanded
+
+    Parameters
+    ----------
+    text : str
+            text of the cell, ie '1,234.5' or '4.2K'
+
+    Returns
+    -------
+    float, or None if the cell is empty or not a number
+    """
+
+    text = text.replace(',', '')
+    if text == '':
+        return None
+
+    multiplier = SUFFIXES.get(text[-1])
+    if multiplier is not None:
+        text = text[:-1]
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return value * multiplier if multiplier is not None else value
+
+
+def to_text(text):
+    return text if text != '' else None
+
+
+def to_int(text):
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def row_converters(columns):
+    """
+    Functions converting the cells of each column to its declared type (see parsing.schema)
+
+    Parameters
+    ----------
+    columns : list
+                columns of the table
+
+    Returns
+    -------
+    list of functions, one for each column
+    """
+
+    return [to_number if is_numeric_column(c) else to_text for c in columns]
+
+
+def free_element(elem):
+    """
+    Release an lxml element already processed by the streaming parser, together with the
+    siblings that precede it. Nested tables are kept since their parent is still being built
+
+    Parameters
+    ----------
+    elem : lxml.etree._Element
+    """
+
+    if next(elem.iterancestors('table'), None) is not None:
+        return
+    elem.clear()
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
 class AWRParser:
     """
     Parser class for the AWR miner
@@ -46,29 +165,193 @@ class AWRParser:
     t : dict
         dictionary containing the name of the final .csv file as a key and the
         text of the 'summary' tag to find the AWR table of interest in the html report
+    engine : (optional) str
+        'soup' (default) to build the whole BeautifulSoup tree of each report,
+        'lxml' to stream the reports and materialize only the tables read by the parser
     """
 
-    def __init__(self, t):
+    def __init__(self, t, engine='soup'):
+        if engine not in ENGINES:
+            print('Error! wrong engine specified, using default (soup)')
+            engine = 'soup'
         self.t = t
+        self.engine = engine
+        self.sections = {INSTANCE_SECTION, SNAPSHOT_SECTION, HOST_SECTION}.union(t.keys())
+
+    ##### helpers working on both BeautifulSoup and lxml elements
+    def find_all(self, elem, tag):
+        if self.engine == 'lxml':
+            return list(elem.iterdescendants(tag))
+        return elem.find_all(tag)
+
+    def text(self, elem):
+        if self.engine == 'lxml':
+            return ''.join(elem.itertext())
+        return elem.text
+
+    def string(self, elem):
+        if self.engine == 'lxml':
+            return lxml_string(elem)
+        return elem.string
+
+    def iter_tables(self, filename):
+        """
+        Iterate over the tables of an html AWR report
+
+        Parameters
+        ----------
+        filename : str or Path()
+                    html file to parse
+
+        Returns
+        -------
+        generator of (summary, table) tuples. With the 'lxml' engine only the tables whose
+        summary is read by the parser are returned, and each one is freed once processed
+        """
+
+        if self.engine == 'soup':
+            with open(filename) as file:
+                soup = BeautifulSoup(file, features='lxml')
+            for table in soup.find_all('table'):
+                yield table.get('summary'), table
+            return
+
+        parser = etree.HTMLPullParser(events=('end',), tag='table')
+        with open(filename) as file:
+            while True:
+                chunk = file.read(CHUNK_SIZE)
+                if chunk:
+                    parser.feed(chunk)
+                else:
+                    parser.close()
+
+                for _, table in parser.read_events():
+                    summary = table.get('summary')
+                    if summary and " ".join(summary.split()) in self.sections:
+                        yield summary, table
+                    free_element(table)
+
+                if not chunk:
+                    break
 
     ##### extract text from <th> or <td> tag
     def tfix(self, elem):
         # use the tag's own text, if it exists
-        text = elem.string or ''
+        text = self.string(elem) or ''
 
         # if <a> exists as a child, use its text instead (ie SQLID)
-        for a in elem.find_all('a'):
-            text = a.text
-
-        # format
-        text = text.strip()
-        text = re.sub(r'\s+', ' ', text)
-        for c in ['&#160;', ',', ':']:
-            text = text.replace(c, '')
+        for a in self.find_all(elem, 'a'):
+            text = self.text(a)
+
+        # format, dropping the colon that ends the labels (ie 'DB Time(s):')
+        text = text.replace('&#160;', '')
+        text = re.sub(r'\s+', ' ', text).strip()
+        if text.endswith(':'):
+            text = text[:-1].rstrip()
         return text
 
+    def _parse_file_profiled(self, filename, verbose=False):
+        # parse_file recorded as a stage of the profiler, with the number of rows parsed
+        with PROFILER.stage('parse_file', 'parse', file=Path(filename).name) as info:
+            output, host_info = self.parse_file(filename, verbose)
+            info['rows'] = sum(len(rows) - 1 for rows in output.values())
+        return output, host_info
+
+    # parse a single AWR report in html format
+    def parse_file(self, filename, verbose=False):
+        """
+        parse a single html AWR report
+
+        Parameters
+        ----------
+        filename : str or Path()
+                    html file to parse
+        verbose: (optional)
+                    to display detailed information of what the parser is doing
+
+        Returns
+        -------
+        output : dict
+                    dictionary containing the name of the AWR table parsed as a key
+                    and as a values the rows of the report (header included)
+        host_info : dict
+                    dictionary containing the host name as a key and the host information as a value
+        """
+
+        if verbose:
+            print('Processing {0}...'.format(filename))
+
+        output = {}
+        host_info = {}
+
+        b_header = False  # begin header
+        l_base = []  # report-specific info
+        converters = {}  # type of the columns of each table
+        flag = 0
+
+        for summary, table in self.iter_tables(filename):
+            ##### extract <table summary=XXXXXX>
+            section = ''
+            # print(table.get('summary'))
+            if summary:
+                section = " ".join(summary.split())
+            # print(section)
+            ##### extract DBName, etc from the 2nd row, columns1-4
+            if section == INSTANCE_SECTION:
+                if flag == 0:
+                    l_base = [self.tfix(x) for x in self.find_all(table, 'td')][:4]
+
+                elif flag == 1:
+                    l_base.extend([self.tfix(x) for x in self.find_all(table, 'td')][:2])
+                    l_base[-1] = to_int(l_base[-1])  # INST_NUM
+
+                flag += 1
+
+            ##### extract begin/end snap time from 2nd-3rd row, column3
+            elif section == SNAPSHOT_SECTION:
+                for tr in list(self.find_all(table, 'tr'))[1:3]:
+                    snap = list(self.find_all(tr, 'td'))[2]
+                    st = datetime.strptime(self.text(snap), '%d-%b-%y %H:%M:%S')
+                    # st = dup.parse(snap.text)  # dateutil parser
+                    l_base.append(to_epoch(st))
+
+            ##### extract host informaion
+            elif section == HOST_SECTION:
+                l_host = [self.tfix(x) for x in self.find_all(table, 'td')]
+                if l_host[0] not in host_info.keys():
+                    host_info[l_host[0]] = [f(x) for f, x in zip(row_converters(HOST_COLUMNS), l_host)]
+
+            ##### for other sections, convert <th><td> structure into a CSV
+            elif section in self.t:
+                # print(section)
+                (csvname, header) = self.t[section]
+
+                ##### create file entry on a first access
+                if csvname not in output:
+                    output[csvname] = []
+                    b_header = True
+
+                ##### iterate over <tr> tag
+                for tr in self.find_all(table, 'tr'):
+                    ##### override header if specified by a grand table, otherwise use <th>
+                    if b_header:
+                        h_base = SYSTEM_COLUMNS + [BEGIN_SNAP, END_SNAP]
+                        h_data = header.split(',') if header else [self.tfix(x) for x in self.find_all(tr, 'th')]
+                        output[csvname].append(h_base + h_data)
+                        converters[csvname] = row_converters(h_data)
+                        b_header = False
+
+                    ##### extract <td> data, converting each cell to the type of its column
+                    l_td = [self.tfix(x) for x in self.find_all(tr, 'td')]
+                    if len(l_td) > 0:
+                        d_data = [f(x) for f, x in zip(converters[csvname], l_td)]
+                        d_data.extend(l_td[len(d_data):])  # more cells than columns
+                        output[csvname].append(l_base + d_data)
+
+        return output, host_info
+
     # parse AWR in html format
-    def parse(self, filelist, verbose=False):
+    def parse(self, filelist, verbose=False, workers=1):
         """
         parse the html AWR reports into a pandas Dataframe
 
@@ -76,100 +359,72 @@ class AWRParser:
         ----------
         filelist : list
                     list of html files to parse
+        verbose: (optional)
+                    to display detailed information of what the parser is doing
+        workers : (optional) int
+                    number of processes used to parse the reports, 1 (default) parses them serially.
+                    The results are merged following the order of 'filelist', so the output is
+                    the same for any number of workers
 
         Returns
         -------
         output : dict
                     dictionary containing the name of the AWR table parsed as a key
-                    and as a values the parsed data ready to be saved in .csv format
+                    and as a values the rows of the table (header included). Numeric cells are
+                    converted to float, empty cells to None, the begin/end snapshot times to epoch seconds
         """
 
         output = {}
-        host_info = {}
-
-        for filename in tqdm(filelist):
-            if verbose:
-                print('Processing {0}...'.format(filename))
+        host_info = {'__header__': HOST_COLUMNS}
 
-            b_header = False  # begin header
-            l_base = []  # report-specific info (list)
-            d_base = ''  # report-specific info (string)
-            flag = 0
+        if workers is None or workers < 1:
+            workers = os.cpu_count() or 1
 
-            #### open file
-            file = open(filename)
-            soup = BeautifulSoup(file, features='lxml')
-
-            for table in soup.find_all('table'):
-                ##### extract <table summary=XXXXXX>
-                section = ''
-                summary = table.get('summary')
-                # print(table.get('summary'))
-                if summary is not None or summary != '':
-                    section = " ".join(summary.split())
-                # print(section)
-                ##### extract DBName, etc from the 2nd row, columns1-4
-                if section == 'This table displays database instance information':
-                    if flag == 0:
-                        l_base = [self.tfix(x) for x in table.find_all('td')][:4]
-
-                    elif flag == 1:
-                        l_base.extend([self.tfix(x) for x in table.find_all('td')][:2])
-
-                    flag += 1
-
-                ##### extract begin/end snap time from 2nd-3rd row, column3
-                elif section == 'This table displays snapshot information':
-                    for tr in list(table.find_all('tr'))[1:3]:
-                        snap = list(tr.find_all('td'))[2]
-                        st = datetime.strptime(snap.text, '%d-%b-%y %H:%M:%S')
-                        # st = dup.parse(snap.text)  # dateutil parser
-                        l_base.extend(str(x) for x in (st.year, st.month, st.day, st.hour, st.minute, st.second))
-                    d_base = ','.join(l_base) + ','
-
-                ##### extract host informaion
-                elif section == 'This table displays host information':
-                    host_info['__header__'] = 'Host Name,Platform,CPUs,Cores,Sockets,Memory (GB)'
-                    l_host = [self.tfix(x) for x in table.find_all('td')]
-                    if l_host[0] not in host_info.keys():
-                        host_info[l_host[0]] = ','.join(l_host)
-
-                ##### for other sections, convert <th><td> structure into a CSV
-                elif section in self.t:
-                    # print(section)
-                    (csvname, header) = self.t[section]
-
-                    ##### create file entry on a first access
-                    if csvname not in output:
-                        output[csvname] = []
-                        b_header = True
-
-                    ##### iterate over <tr> tag
-                    for tr in table.find_all('tr'):
-                        ##### override header if specified by a grand table, otherwise use <th>
-                        if b_header:
-                            h_base = 'DB_NAME,DB_ID,UNIQUE_NAME,ROLE,INSTANCE_NAME,INST_NUM,B_Y,B_MO,B_D,B_H,B_MI,B_S,E_Y,E_MO,E_D,E_H,E_MI,E_S,'
-                            h_data = header or ','.join(self.tfix(x) for x in tr.find_all('th'))
-                            output[csvname].append(h_base + h_data)
-                            b_header = False
-
-                        ##### extract <td> data
-                        l_td = [self.tfix(x) for x in tr.find_all('td')]
-                        if len(l_td) > 0:
-                            d_data = ','.join(l_td)
-                            output[csvname].append(d_base + d_data)
+        parse_file = self._parse_file_profiled if PROFILER.enabled else self.parse_file
+        if workers == 1 or len(filelist) < 2:
+            results = (parse_file(filename, verbose) for filename in filelist)
+            self._merge(results, output, host_info, len(filelist))
+        else:
+            chunksize = max(1, len(filelist) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                if PROFILER.enabled:  # the events of the workers are returned with the results
+                    results = PROFILER.collect(executor.map(run_profiled, repeat(parse_file), filelist,
+                                                            repeat(verbose), chunksize=chunksize))
+                else:
+                    results = executor.map(parse_file, filelist, repeat(verbose), chunksize=chunksize)
+                self._merge(results, output, host_info, len(filelist))
 
         output['host_info.csv'] = []
-        for v in host_info.values():
-            output['host_info.csv'].append(v)
+        if len(host_info) > 1:  # at least one host besides the header
+            for v in host_info.values():
+                output['host_info.csv'].append(v)
 
         ##### return output
         return output
 
+    def _merge(self, results, output, host_info, total):
+        """
+        Merge the per-file results of 'parse_file' into 'output' and 'host_info', keeping
+        only the first header of each table and the first occurrence of each host
+        """
+
+        for file_output, file_host_info in tqdm(results, total=total):
+            for csvname, rows in file_output.items():
+                if csvname not in output:
+                    output[csvname] = rows
+                else:
+                    output[csvname].extend(rows[1:])
+
+            for host, line in file_host_info.items():
+                if host not in host_info:
+                    host_info[host] = line
+
     def make_csv(self, mode='append', input_dir='data/raw/awr', output_dir='data/parsed/awr',
-                        recursive=False, verbose=False):
+                        recursive=False, verbose=False, workers=1, output_format='csv'):
         """
-        Parse the data and stores it into multiple .csv files, one for each AWR table
+        Parse the data and stores it into multiple .csv files, one for each AWR table.
+        The parsed reports are recorded in a manifest in 'output_dir', in 'append' mode only the
+        reports that are new or changed since the last run are parsed
 
         Parameters
         ----------
@@ -185,54 +440,67 @@ class AWRParser:
                     (like the -r in unix)
         verbose: (optional)
                     to display detailed information of what the parser is doing
+        workers: (optional) int
+                    number of processes used to parse the reports (see 'parse')
+        output_format: (optional) str
+                    'csv' (default), 'parquet', 'feather' or 'sqlite'. The other formats store typed
+                    columns, with the begin/end snapshot time as a single datetime column each.
+                    'sqlite' stores all the tables in a single indexed database file.
+                    In 'append' mode it must be the format of the tables already stored
         """
 
         if mode not in ['append', 'new']:
             print('Error! wrong mode specified, using default (append)')
             mode = 'append'
 
+        if output_format not in FORMATS:
+            print('Error! wrong output format specified, using default (csv)')
+            output_format = 'csv'
+
+        # the new reports are appended to the stored tables only with their same format
+        if mode == 'append':
+            csvnames = [csvname for csvname, _ in self.t.values()] + ['host_info.csv']
+            stored = {fmt for csvname in csvnames for fmt in stored_formats(output_dir, csvname)}
+            if len(stored - {output_format}) > 0:
+                print(f"Error! the parsed data in {output_dir} is stored as {', '.join(sorted(stored))}, "
+                      f"append with the same format or use mode 'new' to parse all the reports as {output_format}")
+                return {}
+
         filepath = Path(f'{input_dir}')
         if recursive:
             filelist = sorted(filepath.rglob('*.html'))
         else:
             filelist = sorted(filepath.glob('*.html'))
 
+        # skip the reports already parsed
+        manifest = read_manifest(output_dir) if mode == 'append' else {}
+        filelist, entries = select_new_files(filelist, manifest, verbose)
+        manifest.update(entries)
+        if len(filelist) == 0:
+            print('No new AWR reports to parse')
+            if len(entries) > 0:
+                write_manifest(output_dir, manifest)
+            return {}
+
         # parse AWR
-        output = self.parse(filelist, verbose)
+        output = self.parse(filelist, verbose, workers)
 
 
-        print("Writing csv files...")
-        # write .csv file
-        out_filepath = Path(output_dir)
+        print(f"Writing {output_format} files...")
+        # write a different file for each table
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
         for csvname in tqdm(output):
-            flag = False  # if flag is true skip first line (skip intestation if append mode)
-            if mode == 'append':
-                out_filepath = Path(f'{output_dir}') / csvname
-                if os.path.isfile(out_filepath):
-                    f = open(out_filepath, 'a', encoding='utf-8')  # if file already exists append
-                    flag = True
-                    print('  Updated: ' + csvname)
-                else:
-                    f = open(out_filepath, 'w', encoding='utf-8')
-                    print('  Created: ' + csvname)
-            else:  # new
-                # timestamp = int(time())
-                # out_filepath = Path(f'{output_dir}') / str(timestamp)
-                if not os.path.exists(out_filepath):
-                    os.mkdir(out_filepath)
-                out_filepath = Path(f'{output_dir}') / csvname
-                f = open(out_filepath, 'w', encoding='utf-8')
-                print('  Created: ' + csvname)
-
-            # write/append on a different file for each table
-            for line in output[csvname]:
-                if flag is True:
-                    flag = False
-                    continue
-                f.write(line + '\n')
-
-            f.close()
-
+            if len(output[csvname]) == 0:
+                continue
+            with PROFILER.stage('write_table', 'write', table=csvname, rows=len(output[csvname]) - 1):
+                status = write_table(output_dir, csvname, output[csvname], mode, output_format)
+            target = table_path(output_dir, csvname, output_format).name
+            if output_format == 'sqlite':
+                target += f' ({table_name(csvname)})'
+            print(f'  {status}: ' + target)
+
+        write_manifest(output_dir, manifest)
 
         return output
 
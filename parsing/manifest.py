@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    """
+    Compute the sha256 of a file
+
+    Parameters
+    ----------
+    file_path : str or Path()
+    chunk_size : (optional) int
+                    size of the blocks read from the file
+
+    Returns
+    -------
+    the hex digest of the content of the file
+    """
+
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_manifest(output_dir):
+    """
+    Read the manifest of the AWR reports already parsed into 'output_dir'
+
+    Parameters
+    ----------
+    output_dir : str or Path()
+                    path of the parsed data
+
+    Returns
+    -------
+    manifest : dict
+                dictionary with the path of each parsed report as a key and
+                its 'size', 'mtime' and 'sha256' as a value (empty if there is no manifest)
+    """
+
+    manifest_path = Path(output_dir) / MANIFEST_NAME
+    if not os.path.isfile(manifest_path):
+        return {}
+
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(output_dir, manifest):
+    """
+    Write the manifest of the parsed AWR reports into 'output_dir'
+
+    Parameters
+    ----------
+    output_dir : str or Path()
+                    path of the parsed data
+    manifest : dict
+                see read_manifest
+    """
+
+    manifest_path = Path(output_dir) / MANIFEST_NAME
+    tmp_path = manifest_path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)  # never leave a truncated manifest behind
+
+
+def select_new_files(filelist, manifest, verbose=False):
+    """
+    Select the reports that are not in the manifest yet, or whose content changed since they were parsed.
+    The content hash is computed only for the files whose size or mtime differ from the manifest
+
+    Parameters
+    ----------
+    filelist : list
+                list of html files
+    manifest : dict
+                see read_manifest
+    verbose: (optional)
+                to display which reports are skipped
+
+    Returns
+    -------
+    new_files : list
+                the files to be parsed, in the same order of 'filelist'
+    entries : dict
+                the manifest entries of the new files, to be added to the manifest once they are stored
+    """
+
+    known_hashes = {entry['sha256'] for entry in manifest.values()}
+    new_files = []
+    entries = {}
+
+    for filename in filelist:
+        key = str(Path(filename).resolve())
+        stat = os.stat(filename)
+        entry = manifest.get(key)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            continue  # unchanged
+
+        sha256 = file_hash(filename)
+        new_entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256}
+        if sha256 in known_hashes:  # touched, moved or copied: the rows are already stored
+            if verbose:
+                print('Skipping {0}, already parsed'.format(filename))
+            entries[key] = new_entry
+            continue
+
+        if entry is not None:
+            print('Warning! {0} changed since it was parsed, its rows will be appended again'.format(filename))
+
+        known_hashes.add(sha256)
+        new_files.append(filename)
+        entries[key] = new_entry
+
+    return new_files, entries
@@ -0,0 +1,120 @@
+from datetime import datetime
+
+
+# report-specific info prepended to every row of the AWR tables
+SYSTEM_COLUMNS = ['DB_NAME', 'DB_ID', 'UNIQUE_NAME', 'ROLE', 'INSTANCE_NAME', 'INST_NUM']
+
+# columns of the host information table
+HOST_COLUMNS = ['Host Name', 'Platform', 'CPUs', 'Cores', 'Sockets', 'Memory (GB)']
+
+# begin/end snapshot time as written in the .csv files by the older versions, one column for each field
+BEGIN_SNAP_COLUMNS = ['B_Y', 'B_MO', 'B_D', 'B_H', 'B_MI', 'B_S']
+END_SNAP_COLUMNS = ['E_Y', 'E_MO', 'E_D', 'E_H', 'E_MI', 'E_S']
+
+# begin/end snapshot time: epoch seconds in the rows of AWRParser.parse and in the .csv files,
+# datetime64 in the typed formats and in the dataframes
+BEGIN_SNAP = 'BEGIN_SNAP'
+END_SNAP = 'END_SNAP'
+
+# the snapshot times of the reports have no timezone, the epoch is the one of their wall-clock time
+EPOCH = datetime(1970, 1, 1)
+
+# identifiers of the database and of the instance, stored as categories
+CATEGORICAL_COLUMNS = ['DB_NAME', 'DB_ID', 'UNIQUE_NAME', 'ROLE', 'INSTANCE_NAME']
+
+# columns of the AWR tables holding text, every other column holds a number
+TEXT_COLUMNS = {
+    # load profile
+    'Name',
+    # top SQL
+    'SQL Id', 'SQL Module', 'PDB Name', 'SQL Text',
+    # foreground events and wait classes (average waits are reported with their unit, ie '1.05ms')
+    'Event', 'Avg Wait', 'Wait Class', 'Avg Wait Time',
+    # tablespace io
+    'Tablespace',
+    # blocking sessions
+    'Blocking Sid (Inst)', 'Event Caused', 'User', 'Program', 'XIDs',
+    # host info
+    'Host Name', 'Platform',
+}
+
+
+def to_epoch(snap_time):
+    """
+    Epoch seconds of a snapshot time
+
+    Parameters
+    ----------
+    snap_time : datetime
+                    begin or end snapshot time of a report, without timezone
+
+    Returns
+    -------
+    int
+    """
+
+    return int((snap_time - EPOCH).total_seconds())
+
+
+def snapshot_fields(prefix):
+    """
+    Mapping from the .csv snapshot columns to the fields used by pd.to_datetime
+
+    Parameters
+    ----------
+    prefix : str
+                'B' for the begin snapshot, 'E' for the end snapshot
+
+    Returns
+    -------
+    dict
+    """
+
+    return {f'{prefix}_Y': 'year', f'{prefix}_MO': 'month', f'{prefix}_D': 'day',
+            f'{prefix}_H': 'hour', f'{prefix}_MI': 'minute', f'{prefix}_S': 'second'}
+
+
+def is_numeric_column(column):
+    """
+    Whether a column of an AWR table holds numbers
+
+    Parameters
+    ----------
+    column : str
+
+    Returns
+    -------
+    bool
+    """
+
+    return column not in TEXT_COLUMNS and column not in CATEGORICAL_COLUMNS
+
+
+def column_dtypes(columns):
+    """
+    Declared dtypes of the columns of a parsed AWR table, to be used when reading it
+
+    Parameters
+    ----------
+    columns : list
+                columns of the table
+
+    Returns
+    -------
+    dict with the dtype of each column (the begin/end snapshot time columns are left out)
+    """
+
+    dtypes = {}
+    for column in columns:
+        if column in CATEGORICAL_COLUMNS:
+            dtypes[column] = 'category'
+        elif column == 'INST_NUM' or column in BEGIN_SNAP_COLUMNS or column in END_SNAP_COLUMNS:
+            dtypes[column] = 'int64'
+        elif column in (BEGIN_SNAP, END_SNAP):
+            continue
+        elif column in TEXT_COLUMNS:
+            dtypes[column] = 'object'
+        else:
+            dtypes[column] = 'float64'
+
+    return dtypes
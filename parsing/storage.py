@@ -0,0 +1,606 @@
+import csv
+import hashlib
+import os
+import sqlite3
+from datetime import timedelta
+from pathlib import Path
+import pandas as pd
+
+from .manifest import read_manifest
+from .schema import (BEGIN_SNAP_COLUMNS, END_SNAP_COLUMNS, BEGIN_SNAP, END_SNAP, EPOCH,
+                     snapshot_fields, column_dtypes)
+
+
+FORMATS = ['csv', 'parquet', 'feather', 'sqlite']
+DATABASE_NAME = 'awr.db'  # single file holding all the tables with the 'sqlite' format
+SNAP_FORMAT = '%Y-%m-%d %H:%M:%S'  # begin/end snapshot time in the sqlite tables
+
+
+def table_path(directory, csvname, output_format='csv'):
+    """
+    Path of a parsed AWR table stored with the specified format
+
+    Parameters
+    ----------
+    directory : str or Path()
+                    path of the parsed data
+    csvname : str
+                name of the table as listed in the tables .json file (ie 'load_profile.csv')
+    output_format : (optional) str
+                one of FORMATS
+
+    Returns
+    -------
+    Path()
+    """
+
+    if output_format == 'sqlite':
+        return Path(directory) / DATABASE_NAME
+    return Path(directory) / Path(csvname).with_suffix('.' + output_format).name
+
+
+def table_name(csvname):
+    """
+    Name of the table in the sqlite database (ie 'load_profile' for 'load_profile.csv')
+    """
+
+    return Path(csvname).stem
+
+
+def stored_formats(directory, csvname):
+    """
+    Formats a parsed AWR table is stored with
+
+    Parameters
+    ----------
+    directory : str or Path()
+                    path of the parsed data
+    csvname : str
+                name of the table as listed in the tables .json file (ie 'load_profile.csv')
+
+    Returns
+    -------
+    list of formats (see FORMATS), empty if the table is not found
+    """
+
+    formats = [fmt for fmt in FORMATS if os.path.isfile(table_path(directory, csvname, fmt))]
+    return [fmt for fmt in formats
+            if fmt != 'sqlite' or has_sqlite_table(table_path(directory, csvname, fmt), table_name(csvname))]
+
+
+def find_table(directory, csvname):
+    """
+    Find a parsed AWR table in any of the supported formats.
+    A table stored with more than one format is ambiguous (ie its history in one format and the
+    reports appended later in another one) and raises a ValueError
+
+    Parameters
+    ----------
+    directory : str or Path()
+                    path of the parsed data
+    csvname : str
+                name of the table as listed in the tables .json file (ie 'load_profile.csv')
+
+    Returns
+    -------
+    (path, format) of the table, (None, None) if the table is not found
+    """
+
+    formats = stored_formats(directory, csvname)
+    if len(formats) == 0:
+        return None, None
+    if len(formats) > 1:
+        raise ValueError(f"{csvname} is stored as {', '.join(formats)} in {directory}, "
+                         f"parse the reports again with mode 'new' to keep a single format")
+
+    return table_path(directory, csvname, formats[0]), formats[0]
+
+
+def remove_table(directory, csvname, output_format):
+    """
+    Remove a parsed AWR table stored with the specified format
+
+    Parameters
+    ----------
+    directory : str or Path()
+                    path of the parsed data
+    csvname : str
+                name of the table as listed in the tables .json file (ie 'load_profile.csv')
+    output_format : str
+                one of FORMATS
+    """
+
+    path = table_path(directory, csvname, output_format)
+    if output_format != 'sqlite':
+        os.remove(path)
+        return
+
+    con = connect(path)
+    try:
+        con.execute(f'DROP TABLE IF EXISTS "{table_name(csvname)}"')
+        con.commit()
+    finally:
+        con.close()
+
+
+def typed_frame(df):
+    """
+    Convert a parsed AWR table to typed columns: numbers as floats, begin/end snapshot time
+    as datetime64 and database/instance identifiers as categories.
+    The snapshot times are taken from the epoch seconds or, for the .csv files written by the older
+    versions, from one column for each field
+
+    Parameters
+    ----------
+    df : Dataframe
+            table with the .csv layout
+
+    Returns
+    -------
+    typed Dataframe
+    """
+
+    df = df.copy()
+    for column in (BEGIN_SNAP, END_SNAP):
+        if column in df.columns and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column].astype('int64'), unit='s')
+
+    if set(BEGIN_SNAP_COLUMNS).issubset(df.columns):
+        df.insert(df.columns.get_loc(BEGIN_SNAP_COLUMNS[0]), BEGIN_SNAP,
+                  pd.to_datetime(df[BEGIN_SNAP_COLUMNS].rename(columns=snapshot_fields('B'))))
+        df.insert(df.columns.get_loc(BEGIN_SNAP_COLUMNS[0]), END_SNAP,
+                  pd.to_datetime(df[END_SNAP_COLUMNS].rename(columns=snapshot_fields('E'))))
+        df = df.drop(BEGIN_SNAP_COLUMNS + END_SNAP_COLUMNS, axis=1)
+
+    for column, dtype in column_dtypes(df.columns).items():
+        if dtype == 'category':
+            df[column] = df[column].astype(str).astype('category')
+        elif dtype == 'float64':
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+        elif dtype == 'int64':
+            df[column] = df[column].astype('int64')
+
+    return df
+
+
+def rows_to_frame(rows):
+    """
+    Build a typed Dataframe from the rows produced by AWRParser.parse
+
+    Parameters
+    ----------
+    rows : list
+                rows of a table, header included
+
+    Returns
+    -------
+    typed Dataframe
+    """
+
+    df = pd.DataFrame(rows[1:], columns=rows[0])
+    return typed_frame(df)
+
+
+def snapshot_field_rows(rows):
+    """
+    Rows with the begin/end snapshot times split into one column for each field, as in the .csv files
+    written by the older versions, so that the new rows can be appended to them
+
+    Parameters
+    ----------
+    rows : list
+                rows of a table as returned by AWRParser.parse, header included
+
+    Returns
+    -------
+    list of rows, header included
+    """
+
+    begin = rows[0].index(BEGIN_SNAP)
+    end = rows[0].index(END_SNAP)
+    converted = [rows[0][:begin] + BEGIN_SNAP_COLUMNS + END_SNAP_COLUMNS + rows[0][end + 1:]]
+    for row in rows[1:]:
+        fields = []
+        for epoch in (row[begin], row[end]):
+            t = EPOCH + timedelta(seconds=epoch)
+            fields.extend((t.year, t.month, t.day, t.hour, t.minute, t.second))
+        converted.append(row[:begin] + fields + row[end + 1:])
+
+    return converted
+
+
+def write_csv(path, rows, append=False):
+    """
+    Write the rows of a table to a .csv file, quoting the cells when needed
+
+    Parameters
+    ----------
+    path : str or Path()
+    rows : list
+                rows of a table, header included
+    append : (optional) bool
+                to append to an existing file, skipping the header
+    """
+
+    # hosts already stored are not appended again
+    stored_hosts = set()
+    if append and Path(path).name == 'host_info.csv':
+        with open(path, 'r', encoding='utf-8', newline='') as f_host:
+            stored_hosts = {row[0] for row in csv.reader(f_host) if len(row) > 0}
+
+    if append and BEGIN_SNAP in rows[0]:
+        with open(path, 'r', encoding='utf-8', newline='') as f_old:
+            if BEGIN_SNAP_COLUMNS[0] in next(csv.reader(f_old), []):  # written by an older version
+                rows = snapshot_field_rows(rows)
+
+    with open(path, 'a' if append else 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        # write/append on a different file for each table
+        for row in rows[1:] if append else rows:
+            if row[0] in stored_hosts:
+                continue
+            writer.writerow(row)
+
+
+def write_columnar(path, df, output_format, append=False):
+    """
+    Write a typed table to a .parquet or .feather file
+
+    Parameters
+    ----------
+    path : str or Path()
+    df : Dataframe
+            typed table
+    output_format : str
+            'parquet' or 'feather'
+    append : (optional) bool
+            to append to an existing file (the file is read and rewritten)
+    """
+
+    if append:
+        stored = read_columnar(path, output_format)
+        df = pd.concat([stored, df], ignore_index=True)
+        if Path(path).stem == 'host_info':
+            df = df.drop_duplicates(subset=df.columns[0], keep='first')
+        df = typed_frame(df)  # categories are lost if they differ between the two frames
+
+    df = df.reset_index(drop=True)
+    if output_format == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_feather(path)
+
+
+def read_columnar(path, output_format):
+    if output_format == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_feather(path)
+
+
+def connect(path):
+    """
+    Open the sqlite database of the parsed AWR tables. The database is used in WAL mode,
+    so it can be read by other processes while new reports are being stored
+
+    Parameters
+    ----------
+    path : str or Path()
+
+    Returns
+    -------
+    sqlite3.Connection
+    """
+
+    con = sqlite3.connect(path)
+    con.execute('PRAGMA journal_mode=WAL')
+    return con
+
+
+def open_store(directory):
+    """
+    Open a read connection to the sqlite database of the parsed AWR tables, to be kept and reused
+    by the lookups (see query_table)
+
+    Parameters
+    ----------
+    directory : str or Path()
+                    path of the parsed data
+
+    Returns
+    -------
+    sqlite3.Connection, usable by any thread of the process
+    """
+
+    return sqlite3.connect(table_path(directory, '', 'sqlite'), check_same_thread=False)
+
+
+def has_sqlite_table(path, name):
+    con = sqlite3.connect(path)
+    try:
+        cursor = con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+        return cursor.fetchone() is not None
+    finally:
+        con.close()
+
+
+def write_sqlite(path, name, df, append=False):
+    """
+    Write a typed table to the sqlite database, indexing it on (DB_ID, INST_NUM, BEGIN_SNAP)
+    and, for the SQL tables, on the SQL Id
+
+    Parameters
+    ----------
+    path : str or Path()
+            path of the database
+    name : str
+            name of the table
+    df : Dataframe
+            typed table
+    append : (optional) bool
+            to append to an existing table
+    """
+
+    df = df.copy()
+    for column in (BEGIN_SNAP, END_SNAP):
+        if column in df.columns:
+            df[column] = df[column].dt.strftime(SNAP_FORMAT)
+
+    con = connect(path)
+    try:
+        if append and name == 'host_info':  # hosts already stored are not appended again
+            stored_hosts = pd.read_sql_query(f'SELECT "{df.columns[0]}" FROM "{name}"', con)
+            df = df[~df[df.columns[0]].isin(stored_hosts.iloc[:, 0])]
+
+        df.to_sql(name, con, if_exists='append' if append else 'replace', index=False)
+
+        if {'DB_ID', 'INST_NUM', BEGIN_SNAP}.issubset(df.columns):
+            con.execute(f'CREATE INDEX IF NOT EXISTS "ix_{name}_snap" ON "{name}" (DB_ID, INST_NUM, {BEGIN_SNAP})')
+        if 'SQL Id' in df.columns:
+            con.execute(f'CREATE INDEX IF NOT EXISTS "ix_{name}_sql_id" ON "{name}" ("SQL Id", INST_NUM)')
+        con.execute(f'ANALYZE "{name}"')  # lets the planner skip-scan DB_ID when it is not filtered
+        con.commit()
+    finally:
+        con.close()
+
+
+def read_sqlite(path, name, where='', params=(), order_by=None, limit=None, con=None):
+    """
+    Read a table from the sqlite database
+
+    Parameters
+    ----------
+    path : str or Path()
+            path of the database
+    name : str
+            name of the table
+    where : (optional) str
+            WHERE clause of the query, with '?' placeholders
+    params : (optional) tuple
+            values of the placeholders
+    order_by : (optional) str
+            column used to sort the rows in descending order
+    limit : (optional) int
+            maximum number of rows
+    con : (optional) sqlite3.Connection
+            open connection to the database (see open_store), a new one is opened if not specified
+
+    Returns
+    -------
+    typed Dataframe
+    """
+
+    query = f'SELECT * FROM "{name}"'
+    if where:
+        query += f' WHERE {where}'
+    if order_by is not None:
+        query += f' ORDER BY "{order_by}" DESC'
+    if limit is not None:
+        query += f' LIMIT {int(limit)}'
+
+    if con is not None:
+        df = pd.read_sql_query(query, con, params=params)
+    else:
+        con = sqlite3.connect(path)
+        try:
+            df = pd.read_sql_query(query, con, params=params)
+        finally:
+            con.close()
+
+    for column in (BEGIN_SNAP, END_SNAP):
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], format=SNAP_FORMAT)
+    return typed_frame(df)
+
+
+def query_table(directory, csvname, db_id=None, inst_num=None, start=None, end=None, sql_id=None,
+                order_by=None, limit=None, snaps=None, con=None):
+    """
+    Indexed lookup on a table stored in the sqlite database
+
+    Parameters
+    ----------
+    directory : str or Path()
+                    path of the parsed data
+    csvname : str
+                name of the table as listed in the tables .json file (ie 'sql_cpu.csv')
+    db_id : (optional) str
+    inst_num : (optional) int
+                INST_NUM of the instance
+    start : (optional) datetime
+                minimum begin snapshot time (included)
+    end : (optional) datetime
+                maximum begin snapshot time (included)
+    sql_id : (optional) str
+    order_by : (optional) str
+                column used to sort the rows in descending order
+    limit : (optional) int
+                maximum number of rows
+    snaps : (optional) list
+                begin snapshot times (datetime) of the rows
+    con : (optional) sqlite3.Connection
+                open connection to the database (see open_store), a new one is opened if not specified
+
+    Returns
+    -------
+    typed Dataframe
+    """
+
+    conditions = []
+    params = []
+    for column, value in (('DB_ID', db_id), ('INST_NUM', inst_num), ('"SQL Id"', sql_id)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            params.append(str(value) if column == 'DB_ID' else int(value) if column == 'INST_NUM' else value)
+    if start is not None:
+        conditions.append(f'{BEGIN_SNAP} >= ?')
+        params.append(pd.Timestamp(start).strftime(SNAP_FORMAT))
+    if end is not None:
+        conditions.append(f'{BEGIN_SNAP} <= ?')
+        params.append(pd.Timestamp(end).strftime(SNAP_FORMAT))
+    if snaps is not None:
+        snaps = [pd.Timestamp(snap).strftime(SNAP_FORMAT) for snap in snaps]
+        conditions.append(f'{BEGIN_SNAP} IN ({", ".join("?" * len(snaps))})' if snaps else '0')
+        params.extend(snaps)
+
+    return read_sqlite(table_path(directory, csvname, 'sqlite'), table_name(csvname),
+                       where=' AND '.join(conditions), params=tuple(params), order_by=order_by, limit=limit,
+                       con=con)
+
+
+def write_table(directory, csvname, rows, mode='append', output_format='csv'):
+    """
+    Store a table parsed by AWRParser.parse
+
+    Parameters
+    ----------
+    directory : str or Path()
+                    path of the output data
+    csvname : str
+                name of the table as listed in the tables .json file (ie 'load_profile.csv')
+    rows : list
+                rows of the table, header included
+    mode : (optional) str
+                'append' to add the rows to an already existing table
+                'new' to create a new table
+    output_format : (optional) str
+                one of FORMATS
+
+    Returns
+    -------
+    'Created' or 'Updated'
+    """
+
+    others = [fmt for fmt in stored_formats(directory, csvname) if fmt != output_format]
+    if mode == 'append' and len(others) > 0:
+        raise ValueError(f'{csvname} is already stored as {others[0]} in {directory}, '
+                         f'it cannot be appended as {output_format}')
+    for fmt in others:  # 'new' replaces the table in every format
+        remove_table(directory, csvname, fmt)
+
+    path = table_path(directory, csvname, output_format)
+    append = mode == 'append' and os.path.isfile(path)
+
+    if output_format == 'csv':
+        write_csv(path, rows, append)
+    elif output_format == 'sqlite':
+        append = append and has_sqlite_table(path, table_name(csvname))
+        write_sqlite(path, table_name(csvname), rows_to_frame(rows), append)
+    else:
+        write_columnar(path, rows_to_frame(rows), output_format, append)
+
+    return 'Updated' if append else 'Created'
+
+
+def read_table(directory, csvname):
+    """
+    Read a parsed AWR table, in whatever format it has been stored
+
+    Parameters
+    ----------
+    directory : str or Path()
+                    path of the parsed data
+    csvname : str
+                name of the table as listed in the tables .json file (ie 'load_profile.csv')
+
+    Returns
+    -------
+    Dataframe, with the .csv layout if the table is stored as .csv, typed otherwise
+    """
+
+    path, output_format = find_table(directory, csvname)
+    if path is None:
+        raise FileNotFoundError(f'{csvname} not found in {directory}')
+
+    if output_format == 'csv':
+        return read_csv(path)
+    if output_format == 'sqlite':
+        return read_sqlite(path, table_name(csvname))
+    return read_columnar(path, output_format)
+
+
+def table_fingerprint(directory, csvname):
+    """
+    Fingerprint of a parsed AWR table, cheap enough to be computed on every run: it changes whenever the
+    table is written, without reading its rows.
+    The files are fingerprinted from their size and modification time. The tables of the sqlite database,
+    which share a single file, from their last rowid (the rows are only appended) and from the reports
+    recorded in the manifest, so that a table parsed again in 'new' mode from other reports changes too
+
+    Parameters
+    ----------
+    directory : str or Path()
+                    path of the parsed data
+    csvname : str
+                name of the table as listed in the tables .json file (ie 'load_profile.csv')
+
+    Returns
+    -------
+    the fingerprint as a string, None if the table is not found
+    """
+
+    path, output_format = find_table(directory, csvname)
+    if path is None:
+        return None
+    if output_format != 'sqlite':
+        stat = os.stat(path)
+        return f'{output_format}-{stat.st_size}-{stat.st_mtime_ns}'
+
+    con = sqlite3.connect(path)
+    try:
+        last_rowid = con.execute(f'SELECT MAX(rowid) FROM "{table_name(csvname)}"').fetchone()[0]
+    finally:
+        con.close()
+    reports = hashlib.sha256(''.join(sorted(entry['sha256'] for entry in read_manifest(directory).values()))
+                             .encode()).hexdigest()
+    return f'sqlite-{last_rowid}-{reports}'
+
+
+def read_csv(path):
+    """
+    Read a parsed AWR table from a .csv file, using the declared dtypes of its columns.
+    Files written by older versions of the parser, whose cells do not always match the declared
+    dtypes, are read by inferring the dtypes
+
+    Parameters
+    ----------
+    path : str or Path()
+
+    Returns
+    -------
+    Dataframe
+    """
+
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        header = next(csv.reader(f), [])
+
+    dtypes = column_dtypes(header)
+    dtypes.update({column: 'int64' for column in (BEGIN_SNAP, END_SNAP) if column in header})
+    try:
+        df = pd.read_csv(path, dtype=dtypes)
+    except (ValueError, TypeError):
+        df = pd.read_csv(path)
+
+    for column in (BEGIN_SNAP, END_SNAP):  # epoch seconds
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], unit='s')
+    return df
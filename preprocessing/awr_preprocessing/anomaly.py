@@ -0,0 +1,269 @@
+import json
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+DETECTORS = ['iqr', 'mad', 'rolling']
+
+
+def iqr_mask(values, k=1.5):
+    """
+    Inter-quartile region thresholder (same as pythresh IQR), for each column at once:
+    the values are normalized and the ones beyond the third quartile plus 'k' times the
+    inter-quartile region are anomalies
+
+    Parameters
+    ----------
+    values : numpy array
+                2D array with the snapshots as rows and the series as columns, NaN for missing values
+    k : (optional) float
+
+    Returns
+    -------
+    boolean numpy array with the same shape of 'values'
+    """
+
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # series without values
+        low = np.nanmin(values, axis=0)
+        normalized = (values - low) / (np.nanmax(values, axis=0) - low)  # constant series are never anomalous
+
+        q1 = np.nanpercentile(normalized, 25, axis=0, method='midpoint')
+        q3 = np.nanpercentile(normalized, 75, axis=0, method='midpoint')
+        return normalized >= q3 + k * np.abs(q3 - q1)
+
+
+def mad_mask(values, threshold=3.5, two_sided=False):
+    """
+    Robust z-score thresholder, for each column at once: the distance from the median is measured in
+    median absolute deviations and the values whose modified z-score exceeds 'threshold' are anomalies
+
+    Parameters
+    ----------
+    values : numpy array
+                2D array with the snapshots as rows and the series as columns, NaN for missing values
+    threshold : (optional) float
+    two_sided : (optional) bool
+                    whether the values far below the median are anomalies too, only peaks by default
+
+    Returns
+    -------
+    boolean numpy array with the same shape of 'values'
+    """
+
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # series without values
+        median = np.nanmedian(values, axis=0)
+        mad = np.nanmedian(np.abs(values - median), axis=0)
+        z = 0.6745 * (values - median) / mad  # a zero MAD gives inf or NaN, inf is always anomalous
+        if two_sided:
+            z = np.abs(z)
+        return z > threshold
+
+
+def rolling_mask(df, window=24, threshold=3.5, seasonal=False, min_periods=None):
+    """
+    Rolling baseline thresholder: every value is compared with the median and the spread of the
+    'window' previous snapshots, so that slow trends are not anomalies.
+    With 'seasonal' the baseline is made of the snapshots taken at the same time of the day on the
+    previous days, so that the daily workload cycle is not an anomaly either
+
+    Parameters
+    ----------
+    df : Dataframe
+            snapshots as rows (DatetimeIndex) and the series as columns
+    window : (optional) int
+            number of snapshots (days if 'seasonal') of the baseline
+    threshold : (optional) float
+            see mad_mask
+    seasonal : (optional) bool
+    min_periods : (optional) int
+            minimum number of snapshots of the baseline, the snapshots without a baseline are never anomalous
+
+    Returns
+    -------
+    boolean numpy array with the same shape of 'df'
+    """
+
+    if min_periods is None:
+        min_periods = max(3, window // 2)
+
+    def rolling_median(frame):
+        # statistics of the previous snapshots only, the current one does not contribute
+        return frame.rolling(window, min_periods=min_periods).median().shift(1)
+
+    def rolling_mad(frame):
+        # half of the inter-quartile range, the same as the MAD for symmetric distributions
+        rolling = frame.rolling(window, min_periods=min_periods)
+        return ((rolling.quantile(0.75) - rolling.quantile(0.25)) / 2).shift(1)
+
+    if seasonal:
+        phase = (df.index.hour * 60 + df.index.minute).values
+        frame = df.reset_index(drop=True)
+        median = frame.groupby(phase, group_keys=False).apply(rolling_median).sort_index()
+        mad = frame.groupby(phase, group_keys=False).apply(rolling_mad).sort_index()
+    else:
+        frame = df
+        median = rolling_median(frame)
+        mad = rolling_mad(frame)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = 0.6745 * (frame.values - median.values) / mad.values
+        return z > threshold
+
+
+def detect_anomalies(grouped_dfs, detector='iqr', metrics=None, **params):
+    """
+    Find the anomalies of several metrics of several instances at once
+
+    Parameters
+    ----------
+    grouped_dfs : list
+                    dataframes (one for each instance) with the metrics as columns and the timestamps as index
+    detector : (optional) str
+                    'iqr', 'mad' or 'rolling'
+    metrics : (optional) list
+                    metrics to be checked, all of them by default
+    params : (optional)
+                    parameters of the detector (see iqr_mask, mad_mask and rolling_mask)
+
+    Returns
+    -------
+    List of boolean dataframes aligned with 'grouped_dfs', True for the anomalous values
+    """
+
+    if detector not in DETECTORS:
+        print(f'Error! unknown anomaly detector {detector}')
+        return
+
+    if metrics is not None:
+        grouped_dfs = [df[metrics] for df in grouped_dfs]
+
+    if detector == 'rolling':  # the baseline depends on the position of the snapshots of each instance
+        return [pd.DataFrame(rolling_mask(df, **params), index=df.index, columns=df.columns) for df in grouped_dfs]
+
+    # all the series of all the instances side by side, padded with NaN on the snapshots an instance misses
+    wide = pd.concat(grouped_dfs, axis=1, keys=range(len(grouped_dfs)))
+    values = wide.to_numpy(dtype='float64')
+    if detector == 'iqr':
+        mask = iqr_mask(values, **params)
+    else:
+        mask = mad_mask(values, **params)
+    mask = pd.DataFrame(mask, index=wide.index, columns=wide.columns)
+
+    return [mask[i].reindex(df.index) for i, df in enumerate(grouped_dfs)]
+
+
+class OnlineDetector:
+    """
+    Online anomaly detector for the snapshots that keep arriving: the exponentially weighted mean and
+    variance of every metric of every instance are kept in a small state file, so that each new snapshot
+    is scored and flagged in constant time, without the history of the previous snapshots.
+    The snapshots not newer than the last one scored for an instance are skipped, so the same
+    snapshots can be given more than once
+    """
+
+    def __init__(self, state_path=None, alpha=0.05, threshold=3.0, warmup=12):
+        """
+
+        Parameters
+        ----------
+        state_path : (optional) str or Path()
+                        .json file of the running statistics, nothing is stored if not specified
+        alpha : (optional) float
+                    weight of the newest snapshot in the running statistics
+        threshold : (optional) float
+                    number of standard deviations above the running mean of the anomalous values
+        warmup : (optional) int
+                    number of snapshots of a metric before its values can be anomalous
+        """
+
+        self.state_path = Path(state_path) if state_path is not None else None
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+
+        # table -> INST_NUM -> {'last': last snapshot scored, 'metrics': {metric: [mean, variance, count]}}
+        self.state = {}
+        if self.state_path is not None and os.path.isfile(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def save(self):
+        if self.state_path is None:
+            return
+
+        tmp_path = self.state_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def update_instance(self, table, inst_num, df):
+        """
+        Score the new snapshots of one instance and add them to its running statistics
+
+        Parameters
+        ----------
+        table : str
+                    name of the table of the metrics (ie 'load_profile')
+        inst_num : int
+                    INST_NUM of the instance
+        df : Dataframe
+                snapshots as rows (DatetimeIndex, sorted) and the metrics as columns
+
+        Returns
+        -------
+        boolean Dataframe with the new snapshots as rows, True for the anomalous values
+        """
+
+        entry = self.state.setdefault(table, {}).setdefault(str(inst_num), {'last': None, 'metrics': {}})
+        if entry['last'] is not None:
+            df = df[df.index > pd.Timestamp(entry['last'])]
+
+        stats = np.array([entry['metrics'].get(metric, [0.0, 0.0, 0]) for metric in df.columns],
+                         dtype='float64').reshape(-1, 3)
+        mean, var, count = stats[:, 0], stats[:, 1], stats[:, 2]
+
+        values = df.to_numpy(dtype='float64')
+        mask = np.zeros(values.shape, dtype=bool)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for i, x in enumerate(values):
+                z = (x - mean) / np.sqrt(var)  # a constant metric is anomalous as soon as it grows
+                mask[i] = (count >= self.warmup) & (z > self.threshold)
+
+                seen = ~np.isnan(x)
+                diff = np.where(seen, x - mean, 0)
+                incr = self.alpha * diff
+                first = seen & (count == 0)
+                mean = np.where(first, x, mean + incr)
+                var = np.where(first, 0, np.where(seen, (1 - self.alpha) * (var + diff * incr), var))
+                count = count + seen
+
+        for metric, m, v, c in zip(df.columns, mean, var, count):
+            if c > 0:
+                entry['metrics'][metric] = [float(m), float(v), int(c)]
+        if len(df) > 0:
+            entry['last'] = str(df.index[-1])
+
+        return pd.DataFrame(mask, index=df.index, columns=df.columns)
+
+    def update(self, table, grouped_dfs):
+        """
+        Score the new snapshots of every instance, see update_instance
+
+        Parameters
+        ----------
+        table : str
+                    name of the table of the metrics (ie 'load_profile')
+        grouped_dfs : list
+                        dataframes (one for each instance) with the metrics as columns and the timestamps as index
+
+        Returns
+        -------
+        List of boolean dataframes (one for each instance) with the new snapshots as rows
+        """
+
+        return [self.update_instance(table, i + 1, df) for i, df in enumerate(grouped_dfs)]
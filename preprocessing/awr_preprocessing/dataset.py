@@ -0,0 +1,283 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from parsing.schema import BEGIN_SNAP, END_SNAP
+from parsing.storage import read_table, find_table, rows_to_frame, open_store
+from profiling import PROFILER
+
+
+def read_awr_table(filepath):
+    """
+    Read the table and extract the timestamp.
+    The table is loaded from the .parquet, .feather or sqlite file with the same name if
+    it has been stored with one of the typed formats
+
+    Parameters
+    ----------
+    filepath : str or Path()
+                path of the .csv file
+
+    Returns
+    -------
+    Returns a pandas Dataframe, sorted by instance and timestamp so that the instance partitions are
+    contiguous slices and the lookups by timestamp are binary searches (see AWRProcessor)
+    """
+
+    filepath = Path(filepath)
+    with PROFILER.stage('read_table', 'read', table=filepath.name) as info:
+        df = read_table(filepath.parent, filepath.name)
+        info['rows'] = len(df)
+    if BEGIN_SNAP in df.columns:  # typed format
+        return typed_awr_table(df)
+
+    # df = pd.read_csv(filepath,
+    #                  usecols=['DB_NAME', 'DB_ID', 'DB_NAME','DB_ID', 'UNIQUE_NAME', 'ROLE', 'INSTANCE_NAME', 'INST_NUM',
+    #                           'B_Y', 'B_MO', 'B_D', 'B_H', 'B_MI', 'B_S',
+    #                           'Name', 'Per Second'])
+    df = df.rename(columns={'B_Y': 'year', 'B_MO': 'month', 'B_D': 'day',
+                            'B_H': 'hour', 'B_MI': 'minute', 'B_S': 'second'})
+    with PROFILER.stage('to_datetime', 'read', table=filepath.name, rows=len(df)):
+        df['timestamp'] = pd.to_datetime(df[['month', 'day', 'year', 'hour', 'minute', 'second']])
+    df = df.drop(['month', 'day', 'year', 'hour', 'minute', 'second',
+                  'E_Y', 'E_MO', 'E_D', 'E_H', 'E_MI', 'E_S'], axis=1)
+    return df.sort_values(['INST_NUM', 'timestamp'], kind='mergesort')
+
+
+def typed_awr_table(df):
+    """
+    Extract the timestamp of a typed table (see read_awr_table)
+
+    Parameters
+    ----------
+    df : Dataframe
+            typed table, as returned by parsing.storage.read_table or rows_to_frame
+
+    Returns
+    -------
+    Returns a pandas Dataframe, sorted by instance and timestamp
+    """
+
+    df = df.drop(END_SNAP, axis=1)
+    df['timestamp'] = df.pop(BEGIN_SNAP)
+    return df.sort_values(['INST_NUM', 'timestamp'], kind='mergesort')
+
+
+class AWRDataset:
+    """
+    Parsed AWR tables shared by the processors.
+    Each table is read on first access and then kept in memory, so that the tables used by several
+    processors are read once and the tables of the report pages that are not generated are never read
+    """
+
+    def __init__(self, input_path='data/parsed/awr', db_id=None):
+        """
+
+        Parameters
+        ----------
+        input_path : str or Path()
+                        path of the parsed data folder
+        db_id : (optional) str
+                    DB_ID of the database, if the dataset holds the tables of a single database of a fleet
+                    (see split_by_database)
+        """
+
+        if input_path is None:
+            input_path = 'data/parsed/awr'
+        self.input_path = Path(input_path)
+        self.db_id = db_id
+        self.store = None  # path of the sqlite database, if the tables are stored there
+        self.tables = {}
+        self._connection = None  # connection to the sqlite database, see get_connection
+
+        # sorted timestamps and instance partitions of the dataframes, shared by the processors
+        # (see AWRProcessor.get_time_index and AWRProcessor.get_instance_index)
+        self.time_index = {}
+        self.instance_index = {}
+
+    def __getstate__(self):
+        # the connection is not sent to the worker processes (ie in fleet mode), they open their own
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    def get_connection(self):
+        """
+        Connection to the sqlite database of the tables, opened on first use and shared by the lookups
+        of all the processors of the dataset (see AWRProcessor.query_store)
+
+        Returns
+        -------
+        sqlite3.Connection
+        """
+
+        if self._connection is None:
+            self._connection = open_store(self.input_path)
+        return self._connection
+
+    def in_store(self, csvname):
+        """
+        Whether the lookups on a table are answered by the sqlite database instead of the table in memory:
+        the table is stored there and it is not already in memory (ie the rows just parsed, see add_rows,
+        or the partitions of a database of a fleet, which are never read from the database)
+
+        Parameters
+        ----------
+        csvname : str
+                    name of the table (ie 'sql_cpu.csv')
+
+        Returns
+        -------
+        bool
+        """
+
+        if csvname in self.tables or self.db_id is not None:
+            return False
+        if find_table(self.input_path, csvname)[1] != 'sqlite':
+            return False
+        self.store = self.input_path
+        return True
+
+    def contains(self, filepath):
+        """
+        Whether the file is one of the tables of the dataset
+
+        Parameters
+        ----------
+        filepath : str or Path()
+
+        Returns
+        -------
+        bool
+        """
+
+        return Path(filepath).parent.resolve() == self.input_path.resolve()
+
+    def get_table(self, csvname):
+        """
+        Get one of the parsed tables, reading it on first access
+
+        Parameters
+        ----------
+        csvname : str
+                    name of the table (ie 'load_profile.csv')
+
+        Returns
+        -------
+        Dataframe with the same layout of the ones returned by AWRProcessor.read_df.
+        The same dataframe is returned to every caller, so it must not be modified in place
+        """
+
+        if csvname not in self.tables:
+            if find_table(self.input_path, csvname)[1] == 'sqlite':
+                self.store = self.input_path
+            self.tables[csvname] = read_awr_table(self.input_path / csvname)
+
+        return self.tables[csvname]
+
+    def get_num_instances(self, csvname='load_profile.csv'):
+        """
+        Number of instances of the database
+
+        Parameters
+        ----------
+        csvname : (optional) str
+                    table used to count the instances, the load profile by default
+
+        Returns
+        -------
+        int
+        """
+
+        return self.get_table(csvname)['INST_NUM'].values.max()
+
+    def add_rows(self, csvname, rows):
+        """
+        Use the rows just parsed as the table, instead of reading it from the parsed data folder
+        (ie to process only the snapshots of the new AWR reports)
+
+        Parameters
+        ----------
+        csvname : str
+                    name of the table (ie 'load_profile.csv')
+        rows : list
+                    rows of the table as returned by AWRParser.parse, header included
+        """
+
+        self.tables[csvname] = typed_awr_table(rows_to_frame(rows))
+
+    def append_rows(self, csvname, rows):
+        """
+        Add the rows just parsed to a table already in memory, so that it is not read again.
+        Nothing is done if the table has not been read yet, it will be read with the new rows on first access
+
+        Parameters
+        ----------
+        csvname : str
+                    name of the table (ie 'load_profile.csv')
+        rows : list
+                    rows of the table as returned by AWRParser.parse, header included
+        """
+
+        if csvname not in self.tables or len(rows) < 2:
+            return
+
+        new_df = typed_awr_table(rows_to_frame(rows))
+        if find_table(self.input_path, csvname)[1] == 'csv':  # empty cells are read back from the .csv as NaN
+            for column in new_df.select_dtypes('object').columns:
+                new_df[column] = new_df[column].where(new_df[column].notna(), np.nan)
+
+        df = pd.concat([self.tables[csvname], new_df], ignore_index=True)
+        for column in self.tables[csvname].select_dtypes('category').columns:  # new categories become objects
+            df[column] = df[column].astype('category')
+        self.tables[csvname] = df.sort_values(['INST_NUM', 'timestamp'], kind='mergesort')
+
+    def get_databases(self, csvname='load_profile.csv'):
+        """
+        Databases of the parsed data
+
+        Parameters
+        ----------
+        csvname : (optional) str
+                    table used to list the databases, the load profile by default
+
+        Returns
+        -------
+        Dataframe with one row for each DB_ID and the DB_NAME, ordered by DB_NAME and DB_ID
+        """
+
+        df = self.get_table(csvname)[['DB_ID', 'DB_NAME']].drop_duplicates('DB_ID')
+        df = df.astype(str)
+        return df.sort_values(['DB_NAME', 'DB_ID']).reset_index(drop=True)
+
+    def split_by_database(self, csvnames):
+        """
+        Partition the tables by database (DB_ID), each table is read once for all the databases.
+        The partitions have the same layout of the tables of a single database (the instances are
+        numbered by their INST_NUM) and are processed in the same way
+
+        Parameters
+        ----------
+        csvnames : list
+                    names of the tables (ie 'load_profile.csv'), the ones not parsed are left out
+
+        Returns
+        -------
+        dict with the DB_ID (str) as a key and the AWRDataset of the database as a value.
+        The datasets hold their partitions in memory, they never read the parsed data folder
+        """
+
+        datasets = {db_id: AWRDataset(self.input_path, db_id=db_id) for db_id in self.get_databases()['DB_ID']}
+
+        for csvname in csvnames:
+            if find_table(self.input_path, csvname)[0] is None:
+                continue
+            df = self.get_table(csvname)
+            for dataset in datasets.values():  # the databases without rows in the table get an empty one
+                dataset.tables[csvname] = df.iloc[0:0]
+            # row positions of each database, in the order of the table (ie by instance and timestamp)
+            for db_id, positions in df.groupby(df['DB_ID'].astype(str).to_numpy(), sort=False).indices.items():
+                if db_id in datasets:
+                    datasets[db_id].tables[csvname] = df.iloc[positions]
+
+        return datasets
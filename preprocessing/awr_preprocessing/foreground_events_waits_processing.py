@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 from pythresh.thresholds.zscore import ZSCORE
+from parsing.schema import SYSTEM_COLUMNS
 from .utils import AWRProcessor
 
 
@@ -9,8 +10,8 @@ class ForegroundEventWaitProcessor(AWRProcessor):
     """
     Class for processing the Top 10 Foreground Events by Total Wait Time of the AWR report
     """
-    def __init__(self, name, input_path=None):
-        super().__init__(name, input_path)
+    def __init__(self, name, input_path=None, dataset=None):
+        super().__init__(name, input_path, dataset=dataset)
         self.df = None
         self.dfs = []
         self.timestamps = []
@@ -19,10 +20,15 @@ class ForegroundEventWaitProcessor(AWRProcessor):
 
     def set_df(self):
         """
-        Read the .csv file and create both a dataframe and a grouped dataframe
+        Read the .csv file and create both a dataframe and a grouped dataframe.
+        The table is not read if it is stored in the sqlite database, the events are looked up there
         """
 
         filepath = self.input_path / 'foreground_events_wait.csv'
+        if self.use_store(filepath):
+            self.tot_instances = self.dataset.get_num_instances()
+            return
+
         self.df = self.read_df(filepath)
 
         self.dfs = super().split_by_instance(self.df)  # split by instance the dataframe
@@ -30,7 +36,52 @@ class ForegroundEventWaitProcessor(AWRProcessor):
         for i in range(self.tot_instances):
             timestamp = np.sort(self.dfs[i]['timestamp'].unique())
             self.timestamps.append(timestamp)
-            self.dfs[i] = super().drop_system_info(self.dfs[i])
+
+    def get_events_instance(self, instance, timestamp):
+        """
+        Get the top foreground events of a snapshot, without the system information
+
+        Parameters
+        ----------
+        instance : int
+                    # of the instance
+        timestamp : str or Timestamp
+                    timestamp of the snapshot
+
+        Returns
+        -------
+        Dataframe containing the foreground events of the snapshot
+        """
+
+        if self.store is not None:
+            df = self.query_store('foreground_events_wait.csv', instance=instance, start=timestamp, end=timestamp)
+        else:
+            df = super().filter_by_date(self.dfs[instance], start=timestamp, end=timestamp)
+        return df.drop(SYSTEM_COLUMNS, axis=1)
+
+    def get_events_many(self, instance, timestamps):
+        """
+        Get the top foreground events of several snapshots at once, without the system information
+
+        Parameters
+        ----------
+        instance : int
+                    # of the instance
+        timestamps : list
+                    timestamps of the snapshots (str or Timestamp)
+
+        Returns
+        -------
+        dict with the timestamp (Timestamp) as a key and the dataframe containing its foreground events as a value
+        """
+
+        if self.store is not None:
+            df = self.query_store('foreground_events_wait.csv', instance=instance, timestamps=timestamps)
+        else:
+            df = self.dfs[instance]
+
+        slices = super().split_by_timestamps(df, timestamps)
+        return {ts: df.drop(SYSTEM_COLUMNS, axis=1) for ts, df in slices.items()}
 
     def write_df(self, df=None, path=None):
         if path is None:
@@ -39,5 +90,5 @@ class ForegroundEventWaitProcessor(AWRProcessor):
         else:
             # TODO is horrible - to be CHANGED
             for i in range(self.tot_instances):
-                super().write_df(f'{path}_{i + 1}.csv', self.dfs[i])
+                super().write_df(f'{path}_{i + 1}.csv', super().drop_system_info(self.dfs[i]))
 
@@ -2,8 +2,9 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 from pythresh.thresholds.zscore import ZSCORE
-from pythresh.thresholds.iqr import IQR
+from profiling import PROFILER
 from .utils import AWRProcessor
+from .anomaly import detect_anomalies
 
 
 
@@ -29,6 +30,45 @@ def aggregate_df(df):
     return grouped_df
 
 
+def summarize_databases(df):
+    """
+    Rank the databases of a fleet by DB time: the DB time per second of the instances of each database is
+    added up for each snapshot (ie the average active sessions of the database), then averaged over the snapshots
+
+    Parameters
+    ----------
+    df : Dataframe
+            load profile table of every database, as returned by AWRProcessor.read_df
+
+    Returns
+    -------
+    Dataframe with one row for each database, ordered by average DB time desc
+    """
+
+    df = df[df['Name'].isin(['DB Time(s)', 'DB CPU(s)'])]
+    df = df.astype({'DB_ID': str, 'DB_NAME': str})
+    per_snapshot = df.pivot_table(index=['DB_ID', 'timestamp'], columns='Name', values='Per Second',
+                                  aggfunc='sum', observed=True)
+    per_snapshot = per_snapshot.reindex(columns=['DB Time(s)', 'DB CPU(s)'])
+
+    grouped = per_snapshot.groupby(level='DB_ID')
+    summary = pd.DataFrame({
+        'Avg DB Time(s)/s': grouped['DB Time(s)'].mean(),
+        'Peak DB Time(s)/s': grouped['DB Time(s)'].max(),
+        'Avg DB CPU(s)/s': grouped['DB CPU(s)'].mean(),
+    })
+
+    info = df.groupby('DB_ID').agg(**{'DB_NAME': ('DB_NAME', 'first'),
+                                      'Instances': ('INST_NUM', 'nunique'),
+                                      'Snapshots': ('timestamp', 'nunique'),
+                                      'First Snapshot': ('timestamp', 'min'),
+                                      'Last Snapshot': ('timestamp', 'max')})
+    summary = info.join(summary).sort_values('Avg DB Time(s)/s', ascending=False).reset_index()
+    summary.insert(0, 'Rank', np.arange(1, len(summary) + 1))
+
+    return summary
+
+
 class LoadProcessor_old(AWRProcessor):
     """
     Class for processing the Load Profile of the AWR report
@@ -97,13 +137,17 @@ class LoadProcessor(AWRProcessor):
     Class for processing the Load Profile of the AWR report
     """
 
-    def __init__(self, name, input_path=None):
-        super().__init__(name, input_path)
+    def __init__(self, name, input_path=None, dataset=None, detector='iqr'):
+        super().__init__(name, input_path, dataset=dataset)
         self.df = None
 
         self.dfs = []
         self.grouped_dfs = []
 
+        self.detector = detector  # see anomaly.detect_anomalies
+        self.anomalies = None  # boolean dataframes aligned with grouped_dfs, computed on first use
+        self.online_anomalies = None  # new snapshots scored by the online detector, see find_online_anomalies
+
         self.set_df()
 
     def set_df(self):
@@ -115,15 +159,7 @@ class LoadProcessor(AWRProcessor):
         self.df = self.read_df(filepath)
 
         self.dfs = super().split_by_instance(self.df)  # split by instance the dataframe
-
-        for i in range(self.tot_instances):
-            timestamps = np.sort(self.dfs[i]['timestamp'].unique())
-
-            grouped_df = aggregate_df(self.dfs[i])
-            grouped_df = pd.DataFrame(np.array(grouped_df['Values'].tolist()).transpose(),
-                                      columns=grouped_df['Metric'].tolist())
-            grouped_df = grouped_df.set_index(timestamps)
-            self.grouped_dfs.append(grouped_df)
+        self.grouped_dfs = super().pivot_by_instance(self.df, columns='Name', values='Per Second')
 
     def write_df(self, df=None, path=None):
         if path is None:
@@ -134,9 +170,9 @@ class LoadProcessor(AWRProcessor):
             for i in range(self.tot_instances):
                 super().write_df(f'{path}_{i+1}.csv', self.grouped_dfs[i])
 
-    def find_peaks_instance(self, instance, metric=None):
+    def find_peaks_instance(self, instance, metric=None, online=None):
         """
-        Find outliers of the specified metric based on the Z-Score
+        Find outliers of the specified metric with the anomaly detector of the processor (see find_anomalies)
             for A SPECIFIC instance
 
         Parameters
@@ -145,6 +181,9 @@ class LoadProcessor(AWRProcessor):
             # of the instance
         metric : str
             metric of which find anomalies
+        online : (optional) OnlineDetector
+            to score only the snapshots not yet seen by the online detector, against its running statistics
+            (see find_online_anomalies)
 
         Returns
         -------
@@ -157,15 +196,83 @@ class LoadProcessor(AWRProcessor):
         if len(self.grouped_dfs) == 0:
             print("Error! 'grouped_dfs' not defined")
 
-        # thres = ZSCORE()
-        thres = IQR()
+        if online is not None:
+            labels = self.find_online_anomalies(online)[instance][metric]
+            return self.grouped_dfs[instance].loc[labels.index[labels.values]]
 
-        labels = thres.eval(self.grouped_dfs[instance][metric])
-        # peak_timestamps = self.grouped_df[labels == 1].index
-        peaks_df = self.grouped_dfs[instance][labels == 1]
+        labels = self.find_anomalies()[instance][metric]
+        peaks_df = self.grouped_dfs[instance][labels.values]
 
         return peaks_df
 
+    def find_anomalies(self, detector=None, **params):
+        """
+        Find the outliers of all the metrics of all the instances at once
+
+        Parameters
+        ----------
+        detector : (optional) str
+            'iqr', 'mad' or 'rolling' (see anomaly.detect_anomalies), self.detector by default
+        params : (optional)
+            parameters of the detector
+
+        Returns
+        -------
+        List of boolean dataframes aligned with grouped_dfs, True for the anomalous values
+        """
+
+        if detector is not None and (detector != self.detector or params):
+            return detect_anomalies(self.grouped_dfs, detector, **params)
+
+        if self.anomalies is None:
+            with PROFILER.stage('detect_anomalies', 'process', detector=self.detector,
+                                rows=sum(len(df) for df in self.grouped_dfs)):
+                self.anomalies = detect_anomalies(self.grouped_dfs, self.detector)
+
+        return self.anomalies
+
+    def find_online_anomalies(self, online):
+        """
+        Score the snapshots not yet seen by the online detector, updating its running statistics.
+        The snapshots are scored once, the following calls return the same result
+
+        Parameters
+        ----------
+        online : OnlineDetector
+
+        Returns
+        -------
+        List of boolean dataframes (one for each instance) with the new snapshots as rows
+        and the metrics as columns, True for the anomalous values
+        """
+
+        if self.online_anomalies is None:
+            self.online_anomalies = online.update('load_profile', self.grouped_dfs)
+
+        return self.online_anomalies
+
+    def get_peaks_instance(self, instance, metrics=None):
+        """
+        Find the outliers of several metrics for A SPECIFIC instance (see find_peaks_instance)
+
+        Parameters
+        ----------
+        instance : int
+            # of the instance
+        metrics : (optional) list
+            metrics of which find anomalies, all of them by default
+
+        Returns
+        -------
+        dict with the metric as a key and the timestamps of its anomalous values as a value
+        """
+
+        if metrics is None:
+            metrics = self.grouped_dfs[instance].columns.tolist()
+
+        labels = self.find_anomalies()[instance]
+        return {metric: labels.index[labels[metric].values] for metric in metrics}
+
     def find_peaks(self, metric=None):
         """
         Find outliers of the specified metric based on the Z-Score
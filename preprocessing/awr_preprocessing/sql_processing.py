@@ -1,7 +1,28 @@
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from .utils import AWRProcessor
+from parsing.schema import SYSTEM_COLUMNS
+from .utils import AWRProcessor, to_timestamp
+
+
+# table and ranking metric of each of the 3 top SQL tables
+SQL_CASES = {'cpu': ('sql_cpu.csv', 'CPU Time (s)'),
+             'elapsed': ('sql_elapsed.csv', 'Elapsed Time (s)'),
+             'io': ('sql_user_io.csv', 'User I/O Time (s)')}
+
+# key of the merged history of the 3 tables (see SqlProcessor.get_sql_history)
+HISTORY_KEY = ['SQL Id', 'INST_NUM', 'timestamp']
+
+# columns of the merged history taken from each table
+HISTORY_METRICS = {'cpu': ['CPU Time (s)', 'CPU per Exec (s)'],
+                   'elapsed': ['Elapsed Time (s)', 'Elapsed Time Per Exec'],
+                   'io': ['User I/O Time (s)', 'UIO per Exec (s)']}
+
+# columns of the merged history reported by all the tables, taken from the first table holding the query
+HISTORY_SHARED = ['Executions', '%CPU', '%IO', 'SQL Module', 'PDB Name', 'SQL Text']
+
+# cost per execution of the queries for each of the 3 cases (see SqlProcessor.get_per_exec_costs)
+PER_EXEC_COSTS = {'cpu': 'CPU/Exec (s)', 'elapsed': 'Elapsed/Exec (s)', 'io': 'UIO/Exec (s)'}
 
 
 def aggregate_df(df, case):
@@ -267,14 +288,21 @@ class SqlProcessor(AWRProcessor):
     Class for processing the top10 SQL tables of the AWR report
     """
 
-    def __init__(self, name, input_path=None):
-        super().__init__(name, input_path)
+    def __init__(self, name, input_path=None, dataset=None):
+        super().__init__(name, input_path, dataset=dataset)
         self.df1 = None  # cpu
         self.df2 = None  # elapsed time
         self.df3 = None  # user i/o
         self.merged_df = None
 
-        self.set_dfs()
+        self.query_index = {}  # positions of the rows of each (INST_NUM, SQL Id) in each of the 3 tables
+        self.history = None  # merged history of the 3 tables, built on first use (see get_sql_history)
+        self.per_exec_costs = None  # built on first use (see get_per_exec_costs)
+
+        # with the sqlite database the lookups query it, the tables are read only when their whole
+        # history is needed (see load_dfs)
+        if not self.use_store(self.input_path / 'sql_cpu.csv'):
+            self.set_dfs()
         # self.concatenate_dfs()
 
     def set_dfs(self):
@@ -294,6 +322,180 @@ class SqlProcessor(AWRProcessor):
         # self.df2 = self.drop_system_info(self.df2)
         # self.df3 = self.drop_system_info(self.df3)
 
+        # the tables are sorted by instance and timestamp, so the rows of each query are in time order
+        for case, df in zip(SQL_CASES, [self.df1, self.df2, self.df3]):
+            self.query_index[case] = df.groupby(['INST_NUM', 'SQL Id'], sort=False).indices
+
+    def load_dfs(self):
+        # the tables stored in the sqlite database are read on first use
+        if self.df1 is None or self.df2 is None or self.df3 is None:
+            self.set_dfs()
+
+    def get_sql_history(self):
+        """
+        History of all the queries: the 3 tables merged once on (SQL Id, INST_NUM, timestamp), with the
+        metrics of each table side by side.
+        The elapsed time of the queries missing from the elapsed time table is taken from the other tables
+
+        Returns
+        -------
+        Dataframe with one row for each query of each snapshot of each instance, indexed and sorted
+        by (SQL Id, INST_NUM, timestamp)
+        """
+
+        if self.history is not None:
+            return self.history
+
+        self.load_dfs()
+        frames = {}
+        for case, df in zip(SQL_CASES, [self.df1, self.df2, self.df3]):
+            columns = [c for c in HISTORY_METRICS[case] + HISTORY_SHARED + ['Elapsed Time'] if c in df.columns]
+            frames[case] = df.drop_duplicates(HISTORY_KEY, keep='last').set_index(HISTORY_KEY)[columns]
+        wide = pd.concat(frames, axis=1)  # outer join on the key, (case, column) as columns
+
+        history = pd.DataFrame(index=wide.index)
+        for case, columns in HISTORY_METRICS.items():
+            for column in columns:
+                history[column] = wide[(case, column)]
+        for column in HISTORY_SHARED + ['Elapsed Time']:
+            columns = [(case, column) for case in SQL_CASES if (case, column) in wide.columns]
+            history[column] = wide[columns].bfill(axis=1).iloc[:, 0]
+
+        history['Elapsed Time (s)'] = history['Elapsed Time (s)'].fillna(history.pop('Elapsed Time'))
+        self.history = history.sort_index()
+        return self.history
+
+    def get_per_exec_costs(self):
+        """
+        Elapsed, CPU and user I/O time per execution of all the queries over time (see get_sql_history).
+        The CPU and user I/O time of the queries missing from their tables are estimated from the elapsed
+        time and the %CPU and %IO columns; the snapshots without executions have no cost
+
+        Returns
+        -------
+        Dataframe indexed by (SQL Id, INST_NUM, timestamp) with the executions, the elapsed time and
+        the PER_EXEC_COSTS columns
+        """
+
+        if self.per_exec_costs is not None:
+            return self.per_exec_costs
+
+        history = self.get_sql_history()
+        elapsed = history['Elapsed Time (s)']
+        executions = history['Executions'].where(history['Executions'] > 0)
+        self.per_exec_costs = pd.DataFrame({
+            'Executions': history['Executions'],
+            'Elapsed Time (s)': elapsed,
+            PER_EXEC_COSTS['cpu']: history['CPU Time (s)'].fillna(history['%CPU'] * elapsed / 100) / executions,
+            PER_EXEC_COSTS['elapsed']: elapsed / executions,
+            PER_EXEC_COSTS['io']: history['User I/O Time (s)'].fillna(history['%IO'] * elapsed / 100) / executions,
+        }, index=history.index)
+
+        return self.per_exec_costs
+
+    def find_regressions(self, factor=2.0, baseline=5, case='elapsed'):
+        """
+        Find the queries whose cost per execution regressed: the baseline of each query (of each instance)
+        is the median cost of its first 'baseline' snapshots, the following snapshots costing more than
+        'factor' times the baseline are regressions.
+        The excess time of a regressed snapshot is the elapsed time spent above the baseline elapsed time per
+        execution, so the queries are ranked by the DB time their regressions cost
+
+        Parameters
+        ----------
+        factor : (optional) float
+                    ratio between the cost and the baseline cost above which a snapshot is a regression
+        baseline : (optional) int
+                    number of snapshots of the baseline, the queries seen in fewer snapshots are left out
+        case : (optional) str
+                one of the following values: ['cpu', 'elapsed', 'io'], the cost per execution to be checked
+
+        Returns
+        -------
+        Dataframe with one row for each regressed query of each instance, ordered by 'Excess Time (s)' desc
+        """
+
+        if case not in PER_EXEC_COSTS:
+            print('Error! case parameter not specified or wrong')
+            return
+
+        costs = self.get_per_exec_costs()
+        costs = costs[costs[PER_EXEC_COSTS[case]].notna()]
+        keys = ['SQL Id', 'INST_NUM']
+
+        position = costs.groupby(level=keys, sort=False).cumcount()
+        in_baseline = position < baseline
+        cost = costs[PER_EXEC_COSTS[case]]
+        base = cost.where(in_baseline).groupby(level=keys, sort=False).transform('median')
+        elapsed = costs[PER_EXEC_COSTS['elapsed']]
+        base_elapsed = elapsed.where(in_baseline).groupby(level=keys, sort=False).transform('median')
+
+        regressed = ~in_baseline & (cost > factor * base)
+        snapshots = pd.DataFrame({
+            'Baseline': base,
+            'Worst': cost.where(regressed),
+            'Regressed': regressed,
+            'Excess Time (s)': ((elapsed - base_elapsed) * costs['Executions']).clip(lower=0).where(regressed, 0),
+            'First Regression': costs.index.get_level_values('timestamp').where(regressed.values),
+        })
+        snapshots = snapshots[snapshots.groupby(level=keys, sort=False)['Regressed'].transform('any')]
+
+        regressions = snapshots.groupby(level=keys).agg(**{
+            'Snapshots': ('Regressed', 'size'),
+            'Regressed': ('Regressed', 'sum'),
+            'First Regression': ('First Regression', 'min'),
+            'Baseline': ('Baseline', 'first'),
+            'Worst': ('Worst', 'max'),
+            'Excess Time (s)': ('Excess Time (s)', 'sum'),
+        })
+        regressions.insert(5, 'Ratio', regressions['Worst'] / regressions['Baseline'])
+        regressions = regressions.rename(columns={'Baseline': f'Baseline {PER_EXEC_COSTS[case]}',
+                                                  'Worst': f'Worst {PER_EXEC_COSTS[case]}'})
+
+        info = self.get_sql_history()[['SQL Module', 'SQL Text']].groupby(level=keys).first()
+        regressions = regressions.join(info)
+        return regressions.sort_values('Excess Time (s)', ascending=False, kind='mergesort').reset_index()
+
+    def select(self, case, instance, start=None, end=None, sql_id=None):
+        """
+        Select the rows of one of the 3 tables for the specified instance, and optionally
+        between 'start' and 'end' and for a single query.
+        If the tables are stored in the sqlite database the selection is an indexed lookup
+
+        Parameters
+        ----------
+        case : str
+                one of the following values: ['cpu', 'elapsed', 'io']
+        instance : int
+                    # of the instance
+        start : (optional) str
+        end : (optional) str
+        sql_id : (optional) str
+                    SQL Id of the query
+
+        Returns
+        -------
+        Dataframe containing the selected rows
+        """
+
+        df, csvname = {'cpu': (self.df1, 'sql_cpu.csv'),
+                       'elapsed': (self.df2, 'sql_elapsed.csv'),
+                       'io': (self.df3, 'sql_user_io.csv')}[case]
+        if start is None or end is None:
+            start = end = None
+
+        if self.store is not None:
+            return self.query_store(csvname, instance=instance, start=start, end=end, sql_id=sql_id)
+
+        if sql_id is not None:  # lookup on the index, then only the rows of the query are filtered
+            positions = self.query_index[case].get((instance + 1, sql_id))
+            df = df.iloc[positions] if positions is not None else df.iloc[0:0]
+        else:
+            df = super().filter_by_instance(df, instance)
+        if start is not None:
+            df = self.filter_by_date(df, start, end)
+        return df
+
     def concatenate_dfs(self):
         """
         Concatenate the 3 grouped dataframes
@@ -303,8 +505,7 @@ class SqlProcessor(AWRProcessor):
         The Dataframe contatenation of the 3 grouped dataframes
         """
 
-        if self.df1 is None or self.df2 is None or self.df3 is None:
-            self.set_dfs()
+        self.load_dfs()
 
         g_df1 = aggregate_df(self.df1, case='cpu')
         g_df2 = aggregate_df(self.df2, case='elapsed')
@@ -329,14 +530,19 @@ class SqlProcessor(AWRProcessor):
         3 dataframes containing the top n entries
         """
 
-        if start is not None and end is not None:
-            top1 = super().filter_by_instance(self.df1, instance)
-            top2 = super().filter_by_instance(self.df2, instance)
-            top3 = super().filter_by_instance(self.df3, instance)
+        if start is not None and end is not None and self.store is not None:
+            top1 = self.query_store('sql_cpu.csv', instance, start, end, order_by='CPU Time (s)', n=n)
+            top2 = self.query_store('sql_elapsed.csv', instance, start, end, order_by='Elapsed Time (s)', n=n)
+            top3 = self.query_store('sql_user_io.csv', instance, start, end, order_by='User I/O Time (s)', n=n)
+
+            top1 = super().drop_system_info(top1)
+            top2 = super().drop_system_info(top2)
+            top3 = super().drop_system_info(top3)
 
-            top1 = self.filter_by_date(top1, start, end)
-            top2 = self.filter_by_date(top2, start, end)
-            top3 = self.filter_by_date(top3, start, end)
+        elif start is not None and end is not None:
+            top1 = self.select('cpu', instance, start, end)
+            top2 = self.select('elapsed', instance, start, end)
+            top3 = self.select('io', instance, start, end)
 
             top1 = super().drop_system_info(top1.sort_values('CPU Time (s)', ascending=False).head(n))
             top2 = super().drop_system_info(top2.sort_values('Elapsed Time (s)', ascending=False).head(n))
@@ -344,12 +550,49 @@ class SqlProcessor(AWRProcessor):
 
         else:
             #TODO: add filter by instance
+            self.load_dfs()
             top1 = super().drop_system_info(self.df1.sort_values('CPU Time (s)', ascending=False).head(n))
             top2 = super().drop_system_info(self.df2.sort_values('Elapsed Time (s)', ascending=False).head(n))
             top3 = super().drop_system_info(self.df3.sort_values('User I/O Time (s)', ascending=False).head(n))
 
         return top1, top2, top3
 
+    def get_top_n_many(self, instance, timestamps, n=5):
+        """
+        Get top n queries of each of the snapshots for each dataframe based respectively on:
+        'CPU Time (s)', 'Elapsed Time (s)' and 'User I/O Time (s)'.
+        All the snapshots are ranked together, with a single pass on each table
+
+        Parameters
+        ----------
+        instance : int
+                    # of the instance
+        timestamps : list
+                    timestamps of the snapshots (str or Timestamp)
+        n : int
+            specify the top n rows desired
+
+        Returns
+        -------
+        dict with the timestamp (Timestamp) as a key and the 3 dataframes containing its top n entries as a value
+        """
+
+        timestamps = pd.DatetimeIndex(pd.to_datetime(list(timestamps))).unique()
+
+        tops = []
+        for case, (csvname, metric) in SQL_CASES.items():
+            if self.store is not None:
+                df = self.query_store(csvname, instance=instance, timestamps=timestamps)
+            else:
+                df = self.select(case, instance)
+                df = pd.concat(self.split_by_timestamps(df, timestamps).values())
+
+            df = df.sort_values(metric, ascending=False, kind='mergesort').groupby('timestamp', sort=False).head(n)
+            df = df.drop(SYSTEM_COLUMNS, axis=1)
+            tops.append(self.split_by_timestamps(df, timestamps))
+
+        return {ts: tuple(top[ts] for top in tops) for ts in timestamps}
+
     def get_query_info(self, sql_id, instance, start=None, end=None):
         """
         Retrieve all the statistic available in the 3 dataframes about the specified query
@@ -363,36 +606,18 @@ class SqlProcessor(AWRProcessor):
 
         Returns
         -------
-        A merged dataframe containing all the statistic available in the 3 dataframes about the specified query
+        A merged dataframe containing all the statistic available in the 3 dataframes about the specified query,
+        with one row for each snapshot (see get_sql_history)
         """
 
-        df1 = super().filter_by_instance(self.df1, instance)
-        df2 = super().filter_by_instance(self.df2, instance)
-        df3 = super().filter_by_instance(self.df3, instance)
-
-        df1 = df1[df1['SQL Id'] == sql_id]
-        df2 = df2[df2['SQL Id'] == sql_id]
-        df3 = df3[df3['SQL Id'] == sql_id]
+        history = self.get_sql_history()
+        try:
+            merged_df = history.loc[(sql_id, instance + 1)]  # binary search on the sorted index
+        except KeyError:
+            merged_df = history.iloc[0:0].droplevel(['SQL Id', 'INST_NUM'])
 
         if start is not None and end is not None:
-            # df1 = self.filter_by_date(self.df1, start, end)
-            # df2 = self.filter_by_date(self.df2, start, end)
-            # df3 = self.filter_by_date(self.df3, start, end)
-            df1 = self.filter_by_date(df1, start, end)
-            df2 = self.filter_by_date(df2, start, end)
-            df3 = self.filter_by_date(df3, start, end)
-            # df1 = df1[df1['SQL Id'] == sql_id]
-            # df2 = df2[df2['SQL Id'] == sql_id]
-            # df3 = df3[df3['SQL Id'] == sql_id]
-        # else:
-        #     df1 = self.df1[self.df1['SQL Id'] == sql_id]
-        #     df2 = self.df2[self.df2['SQL Id'] == sql_id]
-        #     df3 = self.df3[self.df3['SQL Id'] == sql_id]
-
-        # merged_df = pd.concat([df1, df2, df3], axis=0, ignore_index=True)
-        merged_df = merge_dfs(df1, df2, df3)
-        merged_df = self.drop_system_info(merged_df)
-        merged_df = merged_df.set_index('timestamp')
+            merged_df = merged_df.loc[to_timestamp(start):to_timestamp(end)]
         # merged_df = merged_df[['timestamp', 'CPU Time (s)', 'Executions', 'CPU per Exec (s)', '%Total',
         #                        'Elapsed Time', '%CPU', '%IO', 'SQL Module', 'PDB Name',
         #                        'SQL Text', 'Elapsed Time (s)', 'Elapsed Time Per Exec',
@@ -415,12 +640,8 @@ class SqlProcessor(AWRProcessor):
         Dataframe containing the data about the cpu time over time
         """
 
-        df1 = super().filter_by_instance(self.df1, instance)
-        df1 = df1[df1['SQL Id'] == sql_id]
-        if start is not None and end is not None:
-            df1 = self.filter_by_date(df1, start, end)
-
-        df1 = df1[df1['SQL Id'] == sql_id][['CPU Time (s)', 'timestamp']]
+        df1 = self.select('cpu', instance, start, end, sql_id=sql_id)
+        df1 = df1[['CPU Time (s)', 'timestamp']]
         df1 = df1.set_index('timestamp')
         return df1
 
@@ -440,12 +661,8 @@ class SqlProcessor(AWRProcessor):
         Dataframe containing the data about the elapsed time over time
         """
 
-        df2 = super().filter_by_instance(self.df2, instance)
-        df2 = df2[df2['SQL Id'] == sql_id]
-        if start is not None and end is not None:
-            df2 = self.filter_by_date(df2, start, end)
-
-        df2 = df2[df2['SQL Id'] == sql_id][['Elapsed Time (s)', 'timestamp']]
+        df2 = self.select('elapsed', instance, start, end, sql_id=sql_id)
+        df2 = df2[['Elapsed Time (s)', 'timestamp']]
         df2 = df2.set_index('timestamp')
         return df2
 
@@ -465,17 +682,14 @@ class SqlProcessor(AWRProcessor):
         Dataframe containing the data about the user i/o time over time
         """
 
-        df3 = super().filter_by_instance(self.df3, instance)
-        df3 = df3[df3['SQL Id'] == sql_id]
-        if start is not None and end is not None:
-            df3 = self.filter_by_date(df3, start, end)
-
-        df3 = df3[df3['SQL Id'] == sql_id][['User I/O Time (s)', 'timestamp']]
+        df3 = self.select('io', instance, start, end, sql_id=sql_id)
+        df3 = df3[['User I/O Time (s)', 'timestamp']]
         df3 = df3.set_index('timestamp')
         return df3
 
     def get_num_instances(self, df=None):
         if df is None:
+            self.load_dfs()
             df = self.df1
 
         return super().get_num_instances(df)
@@ -1,4 +1,5 @@
 import pandas as pd
+from parsing.schema import SYSTEM_COLUMNS
 from .utils import AWRProcessor
 
 
@@ -30,8 +31,8 @@ class TablespaceIoProcessor(AWRProcessor):
     Class for processing the 'Wait Classes by Total Wait Time' table of the AWR report
     """
 
-    def __init__(self, name, input_path=None):
-        super().__init__(name, input_path)
+    def __init__(self, name, input_path=None, dataset=None):
+        super().__init__(name, input_path, dataset=dataset)
         self.df = None
 
         self.dfs = []
@@ -50,10 +51,48 @@ class TablespaceIoProcessor(AWRProcessor):
         self.dfs = super().split_by_instance(self.df)  # split by instance the dataframe
 
         for i in range(self.tot_instances):
-            self.dfs[i] = super().drop_system_info(self.dfs[i])
             grouped_df = aggregate_df(self.dfs[i])
             self.grouped_dfs.append(grouped_df)
 
+    def get_io_stats_instance(self, instance, timestamp):
+        """
+        Get the tablespace IO statistics of a snapshot, without the system information
+
+        Parameters
+        ----------
+        instance : int
+                    # of the instance
+        timestamp : str or Timestamp
+                    timestamp of the snapshot
+
+        Returns
+        -------
+        Dataframe containing the IO statistics of each tablespace in the snapshot
+        """
+
+        df = super().filter_by_date(self.dfs[instance], start=timestamp, end=timestamp)
+        return df.drop(SYSTEM_COLUMNS, axis=1)
+
+    def get_io_stats_many(self, instance, timestamps):
+        """
+        Get the tablespace IO statistics of several snapshots at once, without the system information
+
+        Parameters
+        ----------
+        instance : int
+                    # of the instance
+        timestamps : list
+                    timestamps of the snapshots (str or Timestamp)
+
+        Returns
+        -------
+        dict with the timestamp (Timestamp) as a key and the dataframe containing the IO statistics
+        of each tablespace in the snapshot as a value
+        """
+
+        slices = super().split_by_timestamps(self.dfs[instance], timestamps)
+        return {ts: df.drop(SYSTEM_COLUMNS, axis=1) for ts, df in slices.items()}
+
     def get_metric_to_plot(self, instance, tablespace_name):
         line = self.grouped_dfs[instance][self.grouped_dfs[instance]['Tablespace'] == tablespace_name]
         y1 = line['Av Rds/s'].to_list()[0]
@@ -1,7 +1,32 @@
+import weakref
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from dateutil.parser import parse
+
+from parsing.schema import BEGIN_SNAP, END_SNAP
+from parsing.storage import find_table, query_table
+from .dataset import AWRDataset, read_awr_table
+
+
+def to_timestamp(value):
+    """
+    Timestamp of a snapshot given as a string, a Timestamp/datetime or epoch seconds (see parsing.schema),
+    without going through the dateutil parser
+
+    Parameters
+    ----------
+    value : str, Timestamp, datetime or int
+
+    Returns
+    -------
+    Timestamp
+    """
+
+    if isinstance(value, pd.Timestamp):
+        return value
+    if isinstance(value, (int, np.integer)):
+        return pd.Timestamp(int(value), unit='s')
+    return pd.Timestamp(value)
 
 
 class AWRProcessor:
@@ -9,7 +34,7 @@ class AWRProcessor:
     Base AWRProcessor class, inherited by the other more specific Processor classes for the different AWR tables
     """
 
-    def __init__(self, name, input_path='data/parsed/awr', aggregated_path=None):
+    def __init__(self, name, input_path='data/parsed/awr', aggregated_path=None, dataset=None):
         """
 
         Parameters
@@ -19,6 +44,8 @@ class AWRProcessor:
         input_path : str or Path()
                         path of the input data folder
         aggregated_path : Deprecated
+        dataset : (optional) AWRDataset
+                    tables shared with the other processors, a private one is created if not specified
         """
         self.name = name
         if input_path is None:
@@ -27,10 +54,45 @@ class AWRProcessor:
         # self.aggregated_path = Path(aggregated_path)
         self.system_info = None
         self.tot_instances = None
+        self.store = None  # path of the sqlite database, if the tables are stored there
+
+        if dataset is None:
+            dataset = AWRDataset(self.input_path)
+        self.dataset = dataset
+
+        # sorted timestamps and instance partitions of the dataframes, built on first use and
+        # shared with the other processors of the dataset
+        self._time_index = dataset.time_index
+        self._instance_index = dataset.instance_index
 
     def read_df(self, filepath):
         """
-        Read the csv file and extract the timestamp
+        Read the table and extract the timestamp.
+        The tables of the dataset are read once and shared with the other processors (see AWRDataset)
+
+        Parameters
+        ----------
+        filepath : path of the file
+
+        Returns
+        -------
+        Returns a pandas Dataframe created from the .csv file, sorted by instance and timestamp
+        """
+
+        if self.dataset.contains(filepath):
+            df = self.dataset.get_table(Path(filepath).name)
+            self.store = self.dataset.store
+            return df
+
+        filepath = Path(filepath)
+        if find_table(filepath.parent, filepath.name)[1] == 'sqlite':
+            self.store = filepath.parent
+        return read_awr_table(filepath)
+
+    def use_store(self, filepath):
+        """
+        Whether the lookups on the table are answered by the sqlite database (see AWRDataset.in_store),
+        so that the processor does not need to read the whole table
 
         Parameters
         ----------
@@ -38,19 +100,123 @@ class AWRProcessor:
 
         Returns
         -------
-        Returns a pandas Dataframe created from the .csv file
-        """
-
-        # df = pd.read_csv(filepath,
-        #                  usecols=['DB_NAME', 'DB_ID', 'DB_NAME','DB_ID', 'UNIQUE_NAME', 'ROLE', 'INSTANCE_NAME', 'INST_NUM',
-        #                           'B_Y', 'B_MO', 'B_D', 'B_H', 'B_MI', 'B_S',
-        #                           'Name', 'Per Second'])
-        df = pd.read_csv(filepath)
-        df = df.rename(columns={'B_Y': 'year', 'B_MO': 'month', 'B_D': 'day',
-                                'B_H': 'hour', 'B_MI': 'minute', 'B_S': 'second'})
-        df['timestamp'] = pd.to_datetime(df[['month', 'day', 'year', 'hour', 'minute', 'second']])
-        df = df.drop(['month', 'day', 'year', 'hour', 'minute', 'second',
-                      'E_Y', 'E_MO', 'E_D', 'E_H', 'E_MI', 'E_S'], axis=1)
+        bool
+        """
+
+        filepath = Path(filepath)
+        if self.dataset.contains(filepath) and self.dataset.in_store(filepath.name):
+            self.store = self.dataset.store
+            return True
+        return False
+
+    @staticmethod
+    def _get_cached(cache, df):
+        entry = cache.get(id(df))
+        if entry is not None and entry[0]() is df:
+            return entry[1]
+        return None
+
+    @staticmethod
+    def _set_cached(cache, df, value):
+        # the entry is dropped together with the dataframe
+        key = id(df)
+
+        def drop(ref):
+            if key in cache and cache[key][0] is ref:
+                del cache[key]
+
+        cache[key] = (weakref.ref(df, drop), value)
+        return value
+
+    def get_time_index(self, df):
+        """
+        Sorted timestamps of the dataframe, built once for each dataframe
+
+        Parameters
+        ----------
+        df : Dataframe
+
+        Returns
+        -------
+        numpy array of datetime64, or None if the dataframe is not sorted by timestamp
+        """
+
+        timestamps = self._get_cached(self._time_index, df)
+        if timestamps is None:
+            timestamps = df['timestamp'].to_numpy()
+            if not df['timestamp'].is_monotonic_increasing:
+                timestamps = False
+            self._set_cached(self._time_index, df, timestamps)
+
+        return timestamps if timestamps is not False else None
+
+    def get_instance_index(self, df):
+        """
+        Partitions of the dataframe by instance, built once for each dataframe.
+        Each partition is a slice of the dataframe, sorted by timestamp if the dataframe comes from read_df
+
+        Parameters
+        ----------
+        df : Dataframe
+
+        Returns
+        -------
+        dict with the INST_NUM as a key and the partition as a value,
+        or None if the dataframe is not sorted by instance
+        """
+
+        partitions = self._get_cached(self._instance_index, df)
+        if partitions is None:
+            partitions = False
+            if df['INST_NUM'].is_monotonic_increasing:
+                inst_nums = df['INST_NUM'].to_numpy()
+                values = np.unique(inst_nums)
+                starts = np.searchsorted(inst_nums, values, side='left')
+                ends = np.searchsorted(inst_nums, values, side='right')
+                partitions = {v: df.iloc[s:e] for v, s, e in zip(values, starts, ends)}
+            self._set_cached(self._instance_index, df, partitions)
+
+        return partitions if partitions is not False else None
+
+    def query_store(self, csvname, instance=None, start=None, end=None, sql_id=None, order_by=None, n=None,
+                    timestamps=None):
+        """
+        Indexed lookup on the sqlite database holding the tables (see self.store), through the connection
+        shared by the processors of the dataset
+
+        Parameters
+        ----------
+        csvname : str
+                    name of the table (ie 'sql_cpu.csv')
+        instance : (optional) int
+                    # of the instance
+        start : (optional) str, Timestamp or epoch seconds
+                    start timestamp
+        end : (optional) str, Timestamp or epoch seconds
+                    end timestamp
+        sql_id : (optional) str
+                    SQL Id of the query
+        order_by : (optional) str
+                    column used to sort the rows in descending order
+        n : (optional) int
+                    maximum number of rows
+        timestamps : (optional) list
+                    timestamps of the snapshots
+
+        Returns
+        -------
+        Dataframe with the same layout of the ones returned by read_df
+        """
+
+        inst_num = instance + 1 if instance is not None else None
+        start = to_timestamp(start) if start is not None else None
+        end = to_timestamp(end) if end is not None else None
+
+        con = self.dataset.get_connection() if Path(self.store) == self.dataset.input_path else None
+        df = query_table(self.store, csvname, inst_num=inst_num, start=start, end=end, sql_id=sql_id,
+                         order_by=order_by, limit=n, snaps=timestamps, con=con)
+        df = df.drop(END_SNAP, axis=1)
+        df['timestamp'] = df.pop(BEGIN_SNAP)
         return df
 
     def write_df(self, filepath, df):
@@ -73,9 +239,9 @@ class AWRProcessor:
         Parameters
         ----------
         df : Dataframe
-        start : str
+        start : str, Timestamp or epoch seconds
                 start timestamp
-        end : str
+        end : str, Timestamp or epoch seconds
                 end timestamp
 
         Returns
@@ -84,14 +250,47 @@ class AWRProcessor:
         """
 
         try:
-            ts_start = parse(start)
-            ts_end = parse(end)
+            ts_start = to_timestamp(start)
+            ts_end = to_timestamp(end)
+
+            timestamps = self.get_time_index(df)
+            if timestamps is not None:  # binary search on the sorted timestamps
+                lo = timestamps.searchsorted(ts_start.to_datetime64(), side='left')
+                hi = timestamps.searchsorted(ts_end.to_datetime64(), side='right')
+                return df.iloc[lo:hi]
+
             return df[(df['timestamp'] >= ts_start) & (df['timestamp'] <= ts_end)]
 
         except ValueError:
             print('Error! timestamp format is not correct')
             return df
 
+    def split_by_timestamps(self, df, timestamps):
+        """
+        Get the rows of the dataframe of each of the timestamps at once
+
+        Parameters
+        ----------
+        df : Dataframe
+        timestamps : list
+                        timestamps of the snapshots (str or Timestamp)
+
+        Returns
+        -------
+        dict with the timestamp (Timestamp) as a key and its rows as a value
+        """
+
+        timestamps = pd.DatetimeIndex(pd.to_datetime(list(timestamps))).unique()
+
+        index = self.get_time_index(df)
+        if index is not None:  # binary search of all the timestamps on the sorted ones
+            lo = index.searchsorted(timestamps.values, side='left')
+            hi = index.searchsorted(timestamps.values, side='right')
+            return {ts: df.iloc[l:h] for ts, l, h in zip(timestamps, lo, hi)}
+
+        groups = dict(list(df[df['timestamp'].isin(timestamps)].groupby('timestamp')))
+        return {ts: groups.get(ts, df.iloc[0:0]) for ts in timestamps}
+
     def drop_system_info(self, df):
         """
         Drop dataframe columns containing system information
@@ -136,13 +335,61 @@ class AWRProcessor:
 
         df_list = []
         for i in range(tot_instances):
-            df_list.append(df[df['INST_NUM'] == i + 1])
+            df_list.append(self.filter_by_instance(df, i))
 
         return df_list
 
     def filter_by_instance(self, df, instance):
+        partitions = self.get_instance_index(df)
+        if partitions is not None:  # slice of the sorted dataframe
+            if instance + 1 in partitions:
+                return partitions[instance + 1]
+            return df.iloc[0:0]
+
         return df[df['INST_NUM'] == instance + 1]
 
+    def pivot_by_instance(self, df, columns, values, metrics=None, fill_value=0):
+        """
+        Build the wide dataframe of every instance at once, with one row for each snapshot
+        and one column for each metric.
+        The metrics missing from a snapshot are filled with 'fill_value'
+
+        Parameters
+        ----------
+        df : Dataframe
+        columns : str
+                    column holding the name of the metric (ie 'Name')
+        values : str
+                    column holding the value of the metric (ie 'Per Second')
+        metrics : (optional) list
+                    metrics to be always present in the wide dataframes, even if they are never reported
+        fill_value : (optional)
+                    value of the missing metrics
+
+        Returns
+        -------
+        List of dataframes (one for each instance) with the metrics as columns and the timestamps as index
+        """
+
+        tot_instances = self.get_num_instances(df)
+
+        # if a snapshot is stored twice keep its last rows
+        series = df.set_index(['INST_NUM', 'timestamp', columns])[values]
+        series = series[~series.index.duplicated(keep='last')]
+        wide = series.unstack(columns, fill_value=fill_value)
+        if metrics is not None:
+            wide = wide.reindex(columns=wide.columns.union(metrics), fill_value=fill_value)
+        wide.columns.name = None
+
+        grouped_dfs = []
+        inst_nums = wide.index.get_level_values('INST_NUM')
+        for i in range(tot_instances):
+            grouped_df = wide[inst_nums == i + 1].droplevel('INST_NUM')
+            grouped_df.index.name = None
+            grouped_dfs.append(grouped_df)
+
+        return grouped_dfs
+
     def get_num_instances(self, df):
         if self.tot_instances is not None:
             return self.tot_instances
@@ -2,9 +2,15 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 from pythresh.thresholds.iqr import IQR
+from profiling import PROFILER
 from .utils import AWRProcessor
 
 
+# wait classes reported by the AWR, the ones missing from a snapshot are added with 0 wait time
+WAIT_CLASSES = ['Administrative', 'Application', 'Cluster', 'Commit', 'Concurrency', 'Configuration',
+                'DB CPU', 'Idle', 'Network', 'Other', 'Scheduler', 'System I/O', 'User I/O']
+
+
 def aggregate_df(df):
     """
     Aggregate the dataframe based on the 'Wait Class' column and for each value make a list of
@@ -32,37 +38,16 @@ class WaitClassProcessor(AWRProcessor):
     Class for processing the 'Wait Classes by Total Wait Time' table of the AWR report
     """
 
-    def __init__(self, name, input_path=None):
-        super().__init__(name, input_path)
+    def __init__(self, name, input_path=None, dataset=None):
+        super().__init__(name, input_path, dataset=dataset)
         self.df = None
 
         self.dfs = []
         self.grouped_dfs = []  # Total Wait Time (sec)
+        self.online_anomalies = None  # new snapshots scored by the online detector, see find_online_anomalies
 
         self.set_df()
 
-    def add_placeholders(self, df):
-        # sometimes the number of classes changes, this adds placeholders to fix the problem
-        wait_classes = ['Administrative', 'Application', 'Cluster', 'Commit', 'Concurrency', 'Configuration',
-                        'DB CPU', 'Idle', 'Network', 'Other', 'Scheduler', 'System I/O', 'User I/O']
-        tmp_df = pd.DataFrame(df.groupby('timestamp')['Wait Class'].apply(list))
-        l = []
-        for i in range(len(tmp_df)):
-            # print(tmp_df.iloc[i].name, np.setdiff1d(wait_classes, tmp_df.iloc[i]['Wait Class']))
-            columns = df.columns.to_list()
-            diff = np.setdiff1d(wait_classes, tmp_df.iloc[i]['Wait Class'])
-            for metric in diff:
-                a = [np.nan] * len(columns)
-                a[columns.index('Wait Class')] = metric
-                a[columns.index('Total Wait Time (sec)')] = 0
-                a[columns.index('timestamp')] = tmp_df.iloc[i].name
-                l.append(a)
-
-        tmp_df = pd.DataFrame(l, columns=df.columns.to_list())
-        df = pd.concat([df, tmp_df])
-
-        return df
-
     def set_df(self):
         """
         Read the .csv file and create both a dataframe and a grouped dataframe
@@ -73,16 +58,9 @@ class WaitClassProcessor(AWRProcessor):
 
         self.dfs = super().split_by_instance(self.df)  # split by instance the dataframe
 
-        for i in range(self.tot_instances):
-            self.dfs[i] = self.add_placeholders(self.dfs[i])
-
-            timestamps = np.sort(self.dfs[i]['timestamp'].unique())
-
-            grouped_df = aggregate_df(self.dfs[i])
-            grouped_df = pd.DataFrame(np.array(grouped_df['Values'].tolist()).transpose(),
-                                      columns=grouped_df['Metric'].tolist())
-            grouped_df = grouped_df.set_index(timestamps)
-            self.grouped_dfs.append(grouped_df)
+        # the wait classes missing from a snapshot are filled by the pivot (see pivot_by_instance)
+        self.grouped_dfs = super().pivot_by_instance(self.df, columns='Wait Class', values='Total Wait Time (sec)',
+                                                     metrics=WAIT_CLASSES)
 
     def write_df(self, path=None):
         if path is None:
@@ -93,7 +71,7 @@ class WaitClassProcessor(AWRProcessor):
             for i in range(self.tot_instances):
                 super().write_df(f'{path}_{i + 1}.csv', self.grouped_dfs[i])
 
-    def find_peaks_instance(self, instance, metric=None):
+    def find_peaks_instance(self, instance, metric=None, online=None):
         """
         Find outliers of the specified metric based on the Z-Score
             for A SPECIFIC instance
@@ -104,6 +82,9 @@ class WaitClassProcessor(AWRProcessor):
             # of the instance
         metric : str
             metric of which find anomalies
+        online : (optional) OnlineDetector
+            to score only the snapshots not yet seen by the online detector, against its running statistics
+            (see find_online_anomalies)
 
         Returns
         -------
@@ -116,15 +97,40 @@ class WaitClassProcessor(AWRProcessor):
         if len(self.grouped_dfs) == 0:
             print("Error! 'grouped_dfs' not defined")
 
+        if online is not None:
+            labels = self.find_online_anomalies(online)[instance][metric]
+            return self.grouped_dfs[instance].loc[labels.index[labels.values]]
+
         # thres = ZSCORE()
         thres = IQR()
 
-        labels = thres.eval(self.grouped_dfs[instance][metric])
+        with PROFILER.stage('pythresh IQR', 'process', rows=len(self.grouped_dfs[instance])):
+            labels = thres.eval(self.grouped_dfs[instance][metric])
         # peak_timestamps = self.grouped_df[labels == 1].index
         peaks_df = self.grouped_dfs[instance][labels == 1]
 
         return peaks_df
 
+    def find_online_anomalies(self, online):
+        """
+        Score the snapshots not yet seen by the online detector, updating its running statistics.
+        The snapshots are scored once, the following calls return the same result
+
+        Parameters
+        ----------
+        online : OnlineDetector
+
+        Returns
+        -------
+        List of boolean dataframes (one for each instance) with the new snapshots as rows
+        and the metrics as columns, True for the anomalous values
+        """
+
+        if self.online_anomalies is None:
+            self.online_anomalies = online.update('wait_classes', self.grouped_dfs)
+
+        return self.online_anomalies
+
     def find_peaks(self, metric=None):
         """
         Find outliers of the specified metric based on the Z-Score
@@ -160,7 +166,7 @@ class WaitClassProcessor(AWRProcessor):
         ----------
         instance : int
                     # of the instance
-        timestamp : str
+        timestamp : str or Timestamp
                     timestamp of the snapshot
 
         Returns
@@ -168,9 +174,39 @@ class WaitClassProcessor(AWRProcessor):
         Dataframe containing the  % of DB time used by each of the wait classes
         """
 
-        df = super().filter_by_date(self.df[['Wait Class', '% DB time', 'timestamp']], start=timestamp, end=timestamp)
+        if self.store is not None:
+            df = self.query_store('wait_classes.csv', instance=instance, start=timestamp, end=timestamp)
+            return df[['Wait Class', '% DB time']]
+
+        df = super().filter_by_instance(self.df, instance)
+        df = super().filter_by_date(df, start=timestamp, end=timestamp)
         return df[['Wait Class', '% DB time']]
 
+    def get_dbtime_percentages_many(self, instance, timestamps):
+        """
+        Get the wait classes and the % of DB time used by each of them for several snapshots at once
+
+        Parameters
+        ----------
+        instance : int
+                    # of the instance
+        timestamps : list
+                    timestamps of the snapshots (str or Timestamp)
+
+        Returns
+        -------
+        dict with the timestamp (Timestamp) as a key and the dataframe containing the % of DB time
+        used by each of the wait classes as a value
+        """
+
+        if self.store is not None:
+            df = self.query_store('wait_classes.csv', instance=instance, timestamps=timestamps)
+        else:
+            df = super().filter_by_instance(self.df, instance)
+
+        slices = super().split_by_timestamps(df, timestamps)
+        return {ts: df_ts[['Wait Class', '% DB time']] for ts, df_ts in slices.items()}
+
     def get_dbtime_percentages(self, timestamp):
         """
         Get a list of dataframes containing the wait classes and the % of DB time used by each of them
@@ -178,7 +214,7 @@ class WaitClassProcessor(AWRProcessor):
 
         Parameters
         ----------
-        timestamp : str
+        timestamp : str or Timestamp
                     timestamp of the snapshot
 
         Returns
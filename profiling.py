@@ -0,0 +1,186 @@
+"""
+Instrumentation of the stages of the pipeline (parsing, writing and reading the tables, processing,
+figures and report), enabled by the --profile option of main.py.
+
+Each stage records its wall time, CPU time, peak memory and number of rows. The events are written as
+a JSON trace, or in the Chrome trace format (chrome://tracing or https://ui.perfetto.dev),
+and summarized in a table at the end of the run
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from time import perf_counter, process_time
+
+try:
+    import resource
+except ImportError:  # not available on Windows, the peak memory is not recorded
+    resource = None
+
+
+TRACE_FORMATS = ['json', 'chrome']
+
+
+def peak_rss_mb():
+    # peak resident set size of the process so far, in MB
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if os.uname().sysname == 'Darwin' else rss / 1024  # bytes on macOS, KB on Linux
+
+
+class Profiler:
+    """
+    Collect the events of the instrumented stages, nothing is recorded unless the profiler is enabled
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+
+    @contextmanager
+    def stage(self, name, category='main', **info):
+        """
+        Record a stage, as a context manager:
+
+            with PROFILER.stage('read_table', 'read', table=csvname) as info:
+                df = ...
+                info['rows'] = len(df)
+
+        Parameters
+        ----------
+        name : str
+                name of the stage
+        category : (optional) str
+                    group of the stage in the summary (ie 'parse', 'figure')
+        info : (optional)
+                    other information on the stage (ie the file or the table), the stage can add
+                    its number of rows as 'rows'
+
+        Returns
+        -------
+        the 'info' dict
+        """
+
+        if not self.enabled:
+            yield info
+            return
+
+        start = time.time()
+        wall = perf_counter()
+        cpu = process_time()
+        rss = peak_rss_mb()
+        try:
+            yield info
+        finally:
+            peak = peak_rss_mb()
+            self.events.append({
+                'name': name,
+                'category': category,
+                'start': start,
+                'wall': perf_counter() - wall,
+                'cpu': process_time() - cpu,
+                'peak_rss_mb': peak,
+                'rss_growth_mb': peak - rss if peak is not None else None,
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'info': {k: v if isinstance(v, (int, float, bool)) or v is None else str(v) for k, v in info.items()},
+            })
+
+    def collect(self, results):
+        """
+        Add the events recorded by the worker processes (see run_profiled) to the ones of this process
+
+        Parameters
+        ----------
+        results : iterable
+                    (result, events) tuples returned by run_profiled
+
+        Returns
+        -------
+        generator of the results
+        """
+
+        for result, events in results:
+            self.events.extend(events)
+            yield result
+
+    def summary(self):
+        """
+        Returns
+        -------
+        list of dict, one for each (category, name) with the number of calls, the total wall and CPU time,
+        the maximum peak memory and the total number of rows, ordered by total wall time desc
+        """
+
+        stages = {}
+        for e in self.events:
+            s = stages.setdefault((e['category'], e['name']), {'category': e['category'], 'name': e['name'],
+                                                               'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                                               'peak_rss_mb': None, 'rows': None})
+            s['calls'] += 1
+            s['wall'] += e['wall']
+            s['cpu'] += e['cpu']
+            if e['peak_rss_mb'] is not None:
+                s['peak_rss_mb'] = max(s['peak_rss_mb'] or 0, e['peak_rss_mb'])
+            if isinstance(e['info'].get('rows'), int):
+                s['rows'] = (s['rows'] or 0) + e['info']['rows']
+
+        return sorted(stages.values(), key=lambda s: s['wall'], reverse=True)
+
+    def print_summary(self):
+        print(f"\n{'stage':<40} {'calls':>6} {'wall (s)':>10} {'cpu (s)':>10} {'peak RSS (MB)':>14} {'rows':>10}")
+        for s in self.summary():
+            rss = f"{s['peak_rss_mb']:.1f}" if s['peak_rss_mb'] is not None else '-'
+            rows = str(s['rows']) if s['rows'] is not None else '-'
+            print(f"{s['category'] + ' ' + s['name']:<40.40} {s['calls']:>6} {s['wall']:>10.3f} {s['cpu']:>10.3f} "
+                  f"{rss:>14} {rows:>10}")
+
+    def write(self, path, trace_format='json'):
+        """
+        Write the events to a file
+
+        Parameters
+        ----------
+        path : str or Path()
+                path of the .json file
+        trace_format : (optional) str
+                        'json' for the events and the summary as they are, 'chrome' for the Chrome trace format
+        """
+
+        if trace_format == 'chrome':
+            origin = min((e['start'] for e in self.events), default=0)
+            trace = {'traceEvents': [{'name': e['name'], 'cat': e['category'], 'ph': 'X',
+                                      'ts': (e['start'] - origin) * 1e6, 'dur': e['wall'] * 1e6,
+                                      'pid': e['pid'], 'tid': e['tid'],
+                                      'args': dict(e['info'], cpu=e['cpu'], peak_rss_mb=e['peak_rss_mb'],
+                                                   rss_growth_mb=e['rss_growth_mb'])}
+                                     for e in self.events],
+                     'displayTimeUnit': 'ms'}
+        else:
+            trace = {'events': self.events, 'summary': self.summary()}
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f)
+
+
+# profiler of the process, enabled by main.py
+PROFILER = Profiler()
+
+
+def run_profiled(function, *args):
+    """
+    Call a function in a worker process with the profiler enabled (ie AWRParser.parse_file), the events
+    it records are returned with its result, see Profiler.collect
+
+    Returns
+    -------
+    (result, events)
+    """
+
+    PROFILER.enabled = True
+    PROFILER.events = []  # the events inherited from the parent process are not returned again
+    result = function(*args)
+    events, PROFILER.events = PROFILER.events, []
+    return result, events
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+
+# default number of points of each plotted series
+MAX_POINTS = 1000
+
+METHODS = ['lttb', 'minmax']
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: select 'n_out' points that preserve the shape of the series.
+    The first and the last point are always selected, every other point is the one of its bucket
+    forming the largest triangle with the previous selected point and the average of the next bucket
+
+    Parameters
+    ----------
+    x : numpy array
+            x values, sorted
+    y : numpy array
+            y values
+    n_out : int
+            number of points to select
+
+    Returns
+    -------
+    numpy array with the positions of the selected points
+    """
+
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = x.astype('float64')
+    y = np.nan_to_num(y.astype('float64'))
+    edges = np.linspace(1, n - 1, n_out - 1).astype('int64')  # n_out - 2 buckets between the first and last point
+
+    indices = np.empty(n_out, dtype='int64')
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + np.argmax(area)
+        indices[i + 1] = a
+
+    return indices
+
+
+def minmax_indices(y, n_out):
+    """
+    Select the minimum and the maximum of 'n_out' / 2 buckets of the same size
+
+    Parameters
+    ----------
+    y : numpy array
+            y values
+    n_out : int
+            number of points to select
+
+    Returns
+    -------
+    numpy array with the positions of the selected points, sorted
+    """
+
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+
+    n_buckets = n_out // 2
+    buckets = np.arange(n) * n_buckets // n
+    order = np.lexsort((np.nan_to_num(y.astype('float64')), buckets))  # by bucket, then by value
+    bounds = np.searchsorted(buckets[order], np.arange(n_buckets))
+
+    firsts = order[bounds]
+    lasts = order[np.append(bounds[1:], n) - 1]
+    return np.unique(np.concatenate([firsts, lasts]))
+
+
+def downsample_indices(x, y, max_points=MAX_POINTS, keep=None, method='lttb'):
+    """
+    Select at most 'max_points' points of a series (plus the ones in 'keep')
+
+    Parameters
+    ----------
+    x : numpy array
+            x values, sorted
+    y : numpy array
+            y values
+    max_points : (optional) int
+            number of points to select, None or 0 to keep all of them
+    keep : (optional) numpy array
+            positions of the points that are always selected (ie the peaks)
+    method : (optional) str
+            'lttb' or 'minmax'
+
+    Returns
+    -------
+    numpy array with the positions of the selected points, sorted
+    """
+
+    if not max_points or len(y) <= max_points:
+        return np.arange(len(y))
+
+    if method == 'minmax':
+        indices = minmax_indices(y, max_points)
+    else:
+        indices = lttb_indices(x, y, max_points)
+
+    if keep is not None and len(keep) > 0:
+        indices = np.union1d(indices, keep)
+
+    return indices
+
+
+def downsample_series(series, max_points=MAX_POINTS, keep=None, method='lttb'):
+    """
+    Downsample a series with a DatetimeIndex, see downsample_indices
+
+    Parameters
+    ----------
+    series : Series
+    max_points : (optional) int
+    keep : (optional) Index
+            timestamps always kept (ie the peaks)
+    method : (optional) str
+
+    Returns
+    -------
+    Series with the selected points
+    """
+
+    if not max_points or len(series) <= max_points:
+        return series
+
+    positions = None
+    if keep is not None:
+        positions = series.index.get_indexer(pd.Index(keep))
+        positions = positions[positions >= 0]
+
+    x = series.index.values.astype('int64') if isinstance(series.index, pd.DatetimeIndex) else np.arange(len(series))
+    indices = downsample_indices(x, series.values, max_points, keep=positions, method=method)
+    return series.iloc[indices]
@@ -0,0 +1,250 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import plotly
+import plotly.graph_objs as go
+import plotly.io as pio
+
+from profiling import PROFILER, run_profiled
+
+
+# part of the key of every figure, change it when a builder changes to invalidate the stored figures
+CACHE_VERSION = '1'
+
+# the stored figures not used by the reports for this long are removed (seconds)
+MAX_AGE = 7 * 24 * 3600
+
+
+class StoredFigure(go.Figure):
+    """
+    Figure already serialized by a builder.
+    The report embeds the serialized figure as it is (datapane only calls to_json), without validating it again
+    """
+
+    def __init__(self, serialized):
+        super().__init__()
+        self._serialized = serialized
+
+    def to_json(self, *args, **kwargs):
+        return self._serialized
+
+    def __reduce__(self):
+        # pickled as the serialized figure (ie the pages stored by the StageCache)
+        return StoredFigure, (self._serialized,)
+
+    def to_figure(self):
+        """
+        Returns
+        -------
+        the plotly Figure, to be used when the figure must be modified
+        """
+
+        return pio.from_json(self._serialized)
+
+
+def hash_arg(h, arg):
+    """
+    Add an argument of a builder to the hash of the figure
+
+    Parameters
+    ----------
+    h : hashlib hash object
+    arg : Dataframe, Series, list, tuple, dict or any value with a stable repr
+    """
+
+    if isinstance(arg, pd.DataFrame):
+        h.update(repr((list(arg.columns), arg.dtypes.astype(str).tolist())).encode())
+        h.update(pd.util.hash_pandas_object(arg, index=True).values.tobytes())
+    elif isinstance(arg, pd.Series):
+        h.update(repr((arg.name, str(arg.dtype))).encode())
+        h.update(pd.util.hash_pandas_object(arg, index=True).values.tobytes())
+    elif isinstance(arg, (list, tuple)):
+        h.update(f'{type(arg).__name__}{len(arg)}'.encode())
+        for a in arg:
+            hash_arg(h, a)
+    elif isinstance(arg, dict):
+        for k in sorted(arg):
+            h.update(repr(k).encode())
+            hash_arg(h, arg[k])
+    else:
+        h.update(repr(arg).encode())
+
+
+def figure_key(builder, args, kwargs):
+    """
+    Key of a figure: hash of the builder and of its input
+
+    Parameters
+    ----------
+    builder : function
+                function returning the plotly figure
+    args : tuple
+    kwargs : dict
+
+    Returns
+    -------
+    the hex digest of the key
+    """
+
+    h = hashlib.sha256()
+    h.update(f'{CACHE_VERSION} {plotly.__version__} {builder.__module__}.{builder.__qualname__}'.encode())
+    hash_arg(h, args)
+    hash_arg(h, kwargs)
+    return h.hexdigest()
+
+
+def build_figure(builder, args, kwargs):
+    # runs in the worker processes
+    with PROFILER.stage(builder.__name__, 'figure'):
+        return builder(*args, **kwargs).to_json()
+
+
+class FigureCache:
+    """
+    Build the figures of the report in a pool of processes and store them serialized on disk,
+    so that the figures whose input did not change are not built again by the next report
+    """
+
+    def __init__(self, cache_dir=None, workers=1):
+        """
+
+        Parameters
+        ----------
+        cache_dir : (optional) str or Path()
+                        folder of the stored figures, nothing is stored if not specified
+        workers : (optional) int
+                        number of processes used to build the figures, 0 to use all the available cores
+        """
+
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        if workers is None or workers < 1:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.executor = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, key):
+        if self.cache_dir is None:
+            return None
+
+        path = self.cache_dir / f'{key}.json'
+        if not os.path.isfile(path):
+            return None
+
+        os.utime(path)  # last used, see close
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def store(self, key, serialized):
+        if self.cache_dir is None:
+            return
+
+        path = self.cache_dir / f'{key}.json'
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')  # the folder is shared by the fleet workers
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(serialized)
+        os.replace(tmp_path, path)
+
+    def build_many(self, jobs):
+        """
+        Build a list of figures, loading the ones already stored
+
+        Parameters
+        ----------
+        jobs : list
+                list of (builder, args, kwargs) tuples, the builder is a module level function
+                returning a plotly figure, called as builder(*args, **kwargs)
+
+        Returns
+        -------
+        List of StoredFigure, in the same order of 'jobs'
+        """
+
+        keys = [figure_key(builder, args, kwargs) for builder, args, kwargs in jobs]
+        serialized = [self.load(key) for key in keys]
+        todo = [i for i, s in enumerate(serialized) if s is None]
+        self.hits += len(jobs) - len(todo)
+        self.misses += len(todo)
+
+        if self.workers == 1 or len(todo) < 2:
+            built = [build_figure(*jobs[i]) for i in todo]
+        else:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            if PROFILER.enabled:  # the events of the workers are returned with the figures
+                futures = [self.executor.submit(run_profiled, build_figure, *jobs[i]) for i in todo]
+                built = list(PROFILER.collect(future.result() for future in futures))
+            else:
+                futures = [self.executor.submit(build_figure, *jobs[i]) for i in todo]
+                built = [future.result() for future in futures]
+
+        for i, s in zip(todo, built):
+            self.store(keys[i], s)
+            serialized[i] = s
+
+        return [StoredFigure(s) for s in serialized]
+
+    def build(self, builder, *args, **kwargs):
+        """
+        Build a single figure, see build_many
+
+        Returns
+        -------
+        StoredFigure
+        """
+
+        return self.build_many([(builder, args, kwargs)])[0]
+
+    def close(self, max_age=MAX_AGE):
+        """
+        Stop the worker processes and remove the stored figures that have not been used for a while
+
+        Parameters
+        ----------
+        max_age : (optional) int
+                    seconds since the last use after which a stored figure is removed, None to keep all of them
+        """
+
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+        if max_age is not None and self.cache_dir is not None:
+            now = time.time()
+            for path in self.cache_dir.glob('*.json'):
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+
+
+def build_figures(figure_cache, jobs):
+    """
+    Build a list of figures with the figure cache, or serially if there is no cache
+
+    Parameters
+    ----------
+    figure_cache : FigureCache or None
+    jobs : list
+            see FigureCache.build_many
+
+    Returns
+    -------
+    List of figures, in the same order of 'jobs'
+    """
+
+    if figure_cache is None:
+        figures = []
+        for builder, args, kwargs in jobs:
+            with PROFILER.stage(builder.__name__, 'figure'):
+                figures.append(builder(*args, **kwargs))
+        return figures
+
+    return figure_cache.build_many(jobs)
@@ -1,9 +1,61 @@
+import pandas as pd
 import plotly.express as px
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
 
+from .figure_cache import build_figures
+from .downsampling import downsample_series
+
+
+def render_mode(n_points, webgl_threshold=None):
+    """
+    Rendering mode of the lines of a figure: SVG is sharper and lighter for few points,
+    WebGL keeps the browser responsive with many points
+
+    Parameters
+    ----------
+    n_points : int
+            number of points of the figure
+    webgl_threshold : (optional) int
+            number of points above which WebGL is used, None to always use SVG
+
+    Returns
+    -------
+    'webgl' or 'svg' (see the 'render_mode' parameter of plotly express)
+    """
+
+    if webgl_threshold and n_points > webgl_threshold:
+        return 'webgl'
+    return 'svg'
+
+
+def melt_df(df, max_points=None, peaks=None):
+    """
+    Melt the wide dataframe (one column for each metric) into the long format used by the plots.
+    If 'max_points' is specified each metric is downsampled to that number of points, always keeping its peaks
+
+    Parameters
+    ----------
+    df : Dataframe
+            metrics as columns and the timestamps as index
+    max_points : (optional) int
+            number of points of each metric, None to keep all of them
+    peaks : (optional) dict
+            timestamps to be kept for each metric (ie the ones found by LoadProcessor.find_peaks_instance)
+
+    Returns
+    -------
+    Dataframe with the 'index', 'variable' and 'value' columns
+    """
+
+    if max_points:
+        peaks = peaks if peaks is not None else {}
+        melt_list = []
+        for metric in df.columns:
+            series = downsample_series(df[metric], max_points, keep=peaks.get(metric))
+            melt_list.append(pd.DataFrame({'variable': metric, 'value': series.values}, index=series.index))
+        return pd.concat(melt_list).reset_index()
 
-def melt_df(df):
     df_melt = df.melt(value_vars=df.columns.tolist(), ignore_index=False)
     # df_melt['timestamp'] = df_melt.index
     df_melt = df_melt.reset_index()
@@ -11,8 +63,9 @@ def melt_df(df):
     return df_melt
 
 
-def generate_overview(df_melt):
+def generate_overview(df_melt, webgl_threshold=None):
     fig = px.line(df_melt, x='index', y='value', facet_col='variable',
+                  render_mode=render_mode(len(df_melt), webgl_threshold),
                   facet_col_wrap=5,
                   color='INST_NUM',
                   facet_col_spacing=0.04, facet_row_spacing=0.04,
@@ -41,8 +94,9 @@ def generate_overview(df_melt):
     return fig
 
 
-def generate_overview_instance(df_melt):
+def generate_overview_instance(df_melt, webgl_threshold=None):
     fig = px.line(df_melt, x='index', y='value', facet_col='variable',
+                  render_mode=render_mode(len(df_melt), webgl_threshold),
                   facet_col_wrap=5,
                   color='variable',
                   facet_col_spacing=0.04, facet_row_spacing=0.04,
@@ -71,8 +125,9 @@ def generate_overview_instance(df_melt):
     return fig
 
 
-def generate_big_plots(df_melt):
+def generate_big_plots(df_melt, webgl_threshold=None):
     fig = px.line(df_melt, x='index', y='value', facet_col='variable',
+                  render_mode=render_mode(len(df_melt), webgl_threshold),
                   facet_col_wrap=2,
                   color='INST_NUM',
                   facet_col_spacing=0.05,
@@ -107,8 +162,9 @@ def generate_big_plots(df_melt):
     return fig
 
 
-def generate_big_plots_instace(df_melt):
+def generate_big_plots_instace(df_melt, webgl_threshold=None):
     fig = px.line(df_melt, x='index', y='value', facet_col='variable',
+                  render_mode=render_mode(len(df_melt), webgl_threshold),
                   facet_col_wrap=2,
                   color='variable',
                   facet_col_spacing=0.05,
@@ -143,10 +199,11 @@ def generate_big_plots_instace(df_melt):
     return fig
 
 
-def generate_wait_classes_plot(df):
-    df_melt = melt_df(df)
+def generate_wait_classes_plot(df, max_points=None, webgl_threshold=None):
+    df_melt = melt_df(df, max_points=max_points)
 
     fig = px.line(df_melt, x='index', y='value', color='variable',
+                  render_mode=render_mode(len(df_melt), webgl_threshold),
                   # width=1400,
                   height=600
                   )
@@ -162,10 +219,34 @@ def generate_wait_classes_plot(df):
     return fig
 
 
-def generate_peaks_figures(l, instance, df, metric_list):
+def generate_peaks_plot(df, peak_df, metric, max_points=None, webgl_threshold=None):
+    df = downsample_series(df[metric], max_points, keep=peak_df.index).to_frame()
+    mode = render_mode(len(df), webgl_threshold)
+
+    fig = px.line(df[[metric]], render_mode=mode)
+    fig = px.scatter(peak_df[[metric]],
+                     render_mode=mode,
+                     color_discrete_sequence=['#EF553B'],
+                     labels={
+                         "value": metric,
+                         "index": "time"
+                     },
+                     title=metric
+                     ).add_trace(fig.data[0])
+
+    fig.update_layout(
+        showlegend=False,
+        autosize=True,
+        template='plotly'
+    )
+
+    return fig
+
+
+def generate_peaks_figures(l, instance, df, metric_list, figure_cache=None, max_points=None, webgl_threshold=None):
     df = df[metric_list]
-    figure_list = []
     peak_list = []
+    jobs = []
     for metric in metric_list:
         # thres = IQR()
         # labels = thres.eval(df[metric])
@@ -174,24 +255,10 @@ def generate_peaks_figures(l, instance, df, metric_list):
         peak_df = l.find_peaks_instance(instance, metric)
         # peak_timestamps = peak_df.index
 
-        fig = px.line(df[[metric]])
-        fig = px.scatter(peak_df[[metric]],
-                         color_discrete_sequence=['#EF553B'],
-                         labels={
-                             "value": metric,
-                             "index": "time"
-                         },
-                         title=metric
-                         ).add_trace(fig.data[0])
-
-        fig.update_layout(
-            showlegend=False,
-            autosize=True,
-            template='plotly'
-        )
-
-        figure_list.append(fig)
         peak_list.append(peak_df)
+        jobs.append((generate_peaks_plot, (df[[metric]], peak_df[[metric]], metric), {'max_points': max_points, 'webgl_threshold': webgl_threshold}))
+
+    figure_list = build_figures(figure_cache, jobs)
 
     return peak_list, figure_list
 
@@ -203,19 +270,32 @@ def generate_wait_classes_pie(df):
     return fig
 
 
-def generate_tbs_io_plot(tbsProcessor, tablespace_name, instance):
+def generate_tbs_io_plot(tbsProcessor, tablespace_name, instance, max_points=None, webgl_threshold=None):
     x, y1, y2 = tbsProcessor.get_metric_to_plot(instance=instance, tablespace_name=tablespace_name)
 
+    return generate_tbs_io_lines(x, y1, y2, tablespace_name, max_points=max_points, webgl_threshold=webgl_threshold)
+
+
+def generate_tbs_io_lines(x, y1, y2, tablespace_name, max_points=None, webgl_threshold=None):
+    x1, x2 = x, x
+    if max_points:
+        s1 = downsample_series(pd.Series(y1, index=pd.DatetimeIndex(x)), max_points)
+        s2 = downsample_series(pd.Series(y2, index=pd.DatetimeIndex(x)), max_points)
+        x1, y1 = s1.index, s1.values
+        x2, y2 = s2.index, s2.values
+
+    scatter = go.Scattergl if render_mode(len(y1) + len(y2), webgl_threshold) == 'webgl' else go.Scatter
+
     # Create figure with secondary y-axis
     fig = make_subplots(specs=[[{"secondary_y": True}]])
 
     # Add traces
     fig.add_trace(
-        go.Scatter(x=x, y=y1, name='Av Rds/s'),
+        scatter(x=x1, y=y1, name='Av Rds/s'),
         secondary_y=False,
     )
     fig.add_trace(
-        go.Scatter(x=x, y=y2, name='Writes avg/s'),
+        scatter(x=x2, y=y2, name='Writes avg/s'),
         secondary_y=True,
     )
 
@@ -232,3 +312,50 @@ def generate_tbs_io_plot(tbsProcessor, tablespace_name, instance):
     fig.update_yaxes(title_text="<b>Writes avg/s</b>", secondary_y=True)
 
     return fig
+
+
+def generate_regression_plot(series, baseline, factor, sql_id, max_points=None, webgl_threshold=None):
+    series = downsample_series(series.dropna(), max_points)
+    scatter = go.Scattergl if render_mode(len(series), webgl_threshold) == 'webgl' else go.Scatter
+
+    fig = go.Figure(scatter(x=series.index, y=series.values, mode='lines+markers', name=series.name))
+    fig.add_hline(y=baseline, line_dash='dash', line_color='green', annotation_text='baseline')
+    fig.add_hline(y=factor * baseline, line_dash='dot', line_color='#EF553B', annotation_text=f'{factor}x baseline')
+
+    fig.update_layout(
+        title_text=f'SQL Id {sql_id}',
+        showlegend=False,
+        autosize=True,
+        template='plotly',
+        xaxis_title="time",
+        yaxis_title=series.name
+    )
+
+    return fig
+
+
+def generate_fleet_plot(summary, top=20):
+    """
+    Bar plot of the average and peak DB time of the databases of a fleet
+
+    Parameters
+    ----------
+    summary : Dataframe
+                see load_profile_processing.summarize_databases
+    top : (optional) int
+            number of databases plotted, the ones with the highest DB time
+
+    Returns
+    -------
+    plotly Figure
+    """
+
+    df = summary.head(top)
+    labels = df['DB_NAME'] + ' (' + df['DB_ID'] + ')'
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=labels, y=df['Avg DB Time(s)/s'], name='Avg DB Time(s)/s'))
+    fig.add_trace(go.Bar(x=labels, y=df['Peak DB Time(s)/s'], name='Peak DB Time(s)/s'))
+    fig.update_layout(barmode='group', autosize=True, template='plotly', height=500)
+
+    return fig
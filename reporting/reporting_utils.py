@@ -1,14 +1,16 @@
 import datapane as dp
+import pandas as pd
 
 # from mmparser.reporting.plot_utils import *
 from .plot_utils import *
+from preprocessing.awr_preprocessing.sql_processing import PER_EXEC_COSTS
 
-def generate_timestamp_block_tables(t1, t2, t3, pie_df, fw_df, tbs_df, label):
+def generate_timestamp_block_tables(t1, t2, t3, pie, fw_df, tbs_df, label):
     block = dp.Group(
         dp.Group(
             dp.Blocks(
                 dp.Text("""## Wait Classes % DB time"""),
-                dp.Plot(generate_wait_classes_pie(pie_df))
+                dp.Plot(pie)
             ),
             dp.Blocks(
                 dp.Text("""## Top 10 Foreground Events by Total Wait Time"""),
@@ -33,17 +35,23 @@ def generate_timestamp_block_tables(t1, t2, t3, pie_df, fw_df, tbs_df, label):
 
 
 def generate_timestamps_block_list(sqlProcessor, waitClassesProcessor, foregroundEventWaitProcessor,
-                                   tbsProcessor, peak_list, instance, n=3):
+                                   tbsProcessor, peak_list, instance, n=3, figure_cache=None, labels=None):
+    # the tables of all the timestamps are selected at once
+    tops = sqlProcessor.get_top_n_many(instance=instance, timestamps=peak_list, n=n)
+    pie_dfs = waitClassesProcessor.get_dbtime_percentages_many(instance=instance, timestamps=peak_list)
+    fw_dfs = foregroundEventWaitProcessor.get_events_many(instance=instance, timestamps=peak_list)
+    tbs_dfs = tbsProcessor.get_io_stats_many(instance=instance, timestamps=peak_list)
+
+    peak_list = [pd.Timestamp(ts) for ts in peak_list]
+    pies = build_figures(figure_cache, [(generate_wait_classes_pie, (pie_dfs[ts],), {}) for ts in peak_list])
+
+    if labels is None:
+        labels = [str(ts) for ts in peak_list]
+
     block_list = []
-    for ts in peak_list:
-        ts = str(ts)
-        t1, t2, t3 = sqlProcessor.get_top_n(n=n, instance=instance, start=ts, end=ts)
-        pie_df = waitClassesProcessor.get_dbtime_percentages_instance(instance=instance, timestamp=ts)
-        fw_df = foregroundEventWaitProcessor.filter_by_date(foregroundEventWaitProcessor.dfs[instance],
-                                                            start=ts, end=ts)
-        tbs_df = tbsProcessor.filter_by_date(tbsProcessor.dfs[instance],
-                                                start=ts, end=ts)
-        block = generate_timestamp_block_tables(t1, t2, t3, pie_df, fw_df, tbs_df, label=ts)
+    for ts, pie, label in zip(peak_list, pies, labels):
+        t1, t2, t3 = tops[ts]
+        block = generate_timestamp_block_tables(t1, t2, t3, pie, fw_dfs[ts], tbs_dfs[ts], label=label)
         block_list.append(block)
 
     return block_list
@@ -58,46 +66,66 @@ def generate_timestamps_dropdown(block_list):
     return dropdown
 
 
-def generate_critical_timestamp_block(sqlProcessor, waitClassesProcessor, foregroundEventWaitProcessor,
-                                        tbsProcessor, figure, peak_df, label, instance):
-    peak_list = list(peak_df.index)
-
-    if len(peak_list) == 0:  # less than 2 peaks dp.Select DOES NOT work
+def generate_peaks_block(figure, peak_df, label):
+    if len(peak_df) == 0:
         block = dp.Group(
             dp.Plot(figure),
             label=label,
         )
 
         return block
-    
-    if len(peak_list) == 1:
-        peak_list.append(peak_list[0])
-    
-    block_list = generate_timestamps_block_list(sqlProcessor, waitClassesProcessor, foregroundEventWaitProcessor,
-                                                tbsProcessor, peak_list, instance=instance, n=10)
-    
-    dropdown = generate_timestamps_dropdown(block_list)
 
     block = dp.Group(
-        dp.Group(
-            dp.Plot(figure),
-            # TODO change this, for now showing only 10 values but anomalies should not be too much
-            dp.Table(peak_df[[label]].head(10)),
-            widths=[75, 25],
-            columns=2
-        ),
-        dropdown,
-        label=label,
+        dp.Plot(figure),
+        # TODO change this, for now showing only 10 values but anomalies should not be too much
+        dp.Table(peak_df[[label]].head(10)),
+        widths=[75, 25],
+        columns=2,
+        label=label
+    )
+
+    return block
+
+
+def generate_critical_timestamps_instance(sqlProcessor, waitClassesProcessor, foregroundEventWaitProcessor,
+                                          tbsProcessor, figure_list, peak_list, metric_list, instance,
+                                          figure_cache=None):
+    # the snapshots flagged by more than one metric get a single drill-down block
+    flagged = {}
+    for peak_df, metric in zip(peak_list, metric_list):
+        for ts in peak_df.index:
+            flagged.setdefault(pd.Timestamp(ts), []).append(metric)
+    timestamps = sorted(flagged)
+
+    metric_blocks = [generate_peaks_block(figure, peak_df, metric)
+                     for figure, peak_df, metric in zip(figure_list, peak_list, metric_list)]
+    blocks = [dp.Select(blocks=metric_blocks) if len(metric_blocks) > 1 else metric_blocks[0]]
+
+    if len(timestamps) > 0:
+        block_list = generate_timestamps_block_list(sqlProcessor, waitClassesProcessor, foregroundEventWaitProcessor,
+                                                    tbsProcessor, timestamps, instance=instance, n=10,
+                                                    figure_cache=figure_cache,
+                                                    labels=[f'{ts} ({", ".join(flagged[ts])})' for ts in timestamps])
+
+        blocks.append(dp.Text("## Critical Timestamps"))
+        if len(block_list) > 1:  # less than 2 blocks dp.Select DOES NOT work
+            blocks.append(generate_timestamps_dropdown(block_list))
+        else:
+            blocks.append(block_list[0])
+
+    block = dp.Group(
+        blocks=blocks,
+        label=f'Instance {instance + 1}',
         columns=1
     )
 
     return block
 
 
-def generate_overiview_list(melt_list):
+def generate_overiview_list(melt_list, figure_cache=None, webgl_threshold=None):
+    jobs = [(generate_overview_instance, (df_melt,), {'webgl_threshold': webgl_threshold}) for df_melt in melt_list]
     block_list = []
-    for i, df_melt in enumerate(melt_list):
-        fig = generate_overview_instance(df_melt)
+    for i, fig in enumerate(build_figures(figure_cache, jobs)):
         page = dp.Plot(
             fig, label=f'Instance {i + 1}'
         )
@@ -106,10 +134,10 @@ def generate_overiview_list(melt_list):
     return block_list
 
 
-def generate_big_plots_lis(melt_list):
+def generate_big_plots_lis(melt_list, figure_cache=None, webgl_threshold=None):
+    jobs = [(generate_big_plots_instace, (df_melt,), {'webgl_threshold': webgl_threshold}) for df_melt in melt_list]
     block_list = []
-    for i, df_melt in enumerate(melt_list):
-        fig = generate_big_plots_instace(df_melt)
+    for i, fig in enumerate(build_figures(figure_cache, jobs)):
         page = dp.Plot(
             fig, label=f'Instance {i + 1}'
         )
@@ -118,10 +146,11 @@ def generate_big_plots_lis(melt_list):
     return block_list
 
 
-def generate_wait_class_list(waitClassProcessor):
+def generate_wait_class_list(waitClassProcessor, figure_cache=None, max_points=None, webgl_threshold=None):
+    jobs = [(generate_wait_classes_plot, (grouped_df,), {'max_points': max_points, 'webgl_threshold': webgl_threshold})
+            for grouped_df in waitClassProcessor.grouped_dfs]
     block_list = []
-    for i, grouped_df in enumerate(waitClassProcessor.grouped_dfs):
-        fig = generate_wait_classes_plot(grouped_df)
+    for i, fig in enumerate(build_figures(figure_cache, jobs)):
         page = dp.Plot(
             fig, label=f'Instance {i + 1}'
         )
@@ -130,11 +159,16 @@ def generate_wait_class_list(waitClassProcessor):
     return block_list
 
 
-def generate_tbs_io_list_instance(tbsProcessor, instance):
+def generate_tbs_io_list_instance(tbsProcessor, instance, figure_cache=None, max_points=None, webgl_threshold=None):
     tbs_list = tbsProcessor.get_most_used_tbs(instance=instance)
-    block_list = []
+    jobs = []
     for tbs in tbs_list:
-        fig = generate_tbs_io_plot(tbsProcessor, tablespace_name=tbs, instance=instance)
+        x, y1, y2 = tbsProcessor.get_metric_to_plot(instance=instance, tablespace_name=tbs)
+        jobs.append((generate_tbs_io_lines, (x, y1, y2, tbs),
+                     {'max_points': max_points, 'webgl_threshold': webgl_threshold}))
+
+    block_list = []
+    for tbs, fig in zip(tbs_list, build_figures(figure_cache, jobs)):
         block_list.append(dp.Plot(
             fig, label=tbs
         ))
@@ -142,14 +176,53 @@ def generate_tbs_io_list_instance(tbsProcessor, instance):
     return block_list
 
 
-def generate_tbs_io_list(tbsProcessor):
+def generate_tbs_io_list(tbsProcessor, figure_cache=None, max_points=None, webgl_threshold=None):
     select_list = []
     for i in range(tbsProcessor.get_num_instances(tbsProcessor.df)):
         sel = dp.Select(
-            blocks=generate_tbs_io_list_instance(tbsProcessor, instance=i),
+            blocks=generate_tbs_io_list_instance(tbsProcessor, instance=i, figure_cache=figure_cache,
+                                                 max_points=max_points, webgl_threshold=webgl_threshold),
             type=dp.SelectType.DROPDOWN,
             label=f'Instance {i+1}'
         )
         select_list.append(sel)
 
     return select_list
+
+
+def generate_sql_regressions_instance(sqlProcessor, regressions, instance, factor, case='elapsed', top=10,
+                                      figure_cache=None, max_points=None, webgl_threshold=None):
+    regressions = regressions[regressions['INST_NUM'] == instance + 1].head(top)
+    if len(regressions) == 0:
+        return dp.Text("No regressed queries", label=f'Instance {instance + 1}')
+
+    costs = sqlProcessor.get_per_exec_costs()
+    column = PER_EXEC_COSTS[case]
+    jobs = []
+    for sql_id, baseline in zip(regressions['SQL Id'], regressions[f'Baseline {column}']):
+        jobs.append((generate_regression_plot, (costs.loc[(sql_id, instance + 1), column], baseline, factor, sql_id),
+                     {'max_points': max_points, 'webgl_threshold': webgl_threshold}))
+
+    plots = [dp.Plot(fig, label=sql_id) for sql_id, fig in zip(regressions['SQL Id'], build_figures(figure_cache, jobs))]
+    if len(plots) > 1:
+        plots = [dp.Select(blocks=plots, type=dp.SelectType.DROPDOWN)]
+
+    return dp.Group(
+        dp.DataTable(regressions.drop('INST_NUM', axis=1)),
+        *plots,
+        label=f'Instance {instance + 1}',
+        columns=1
+    )
+
+
+def generate_sql_regressions_list(sqlProcessor, factor=2.0, baseline=5, case='elapsed', top=10, figure_cache=None,
+                                  max_points=None, webgl_threshold=None):
+    regressions = sqlProcessor.find_regressions(factor=factor, baseline=baseline, case=case)
+
+    block_list = []
+    for i in range(sqlProcessor.get_num_instances()):
+        block_list.append(generate_sql_regressions_instance(sqlProcessor, regressions, i, factor, case=case, top=top,
+                                                            figure_cache=figure_cache, max_points=max_points,
+                                                            webgl_threshold=webgl_threshold))
+
+    return block_list
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .figure_cache import hash_arg
+
+
+# part of the fingerprint of every stage, change it to invalidate the stored outputs
+STAGES_VERSION = '1'
+
+
+def fingerprint(*parts):
+    """
+    Fingerprint of the inputs of a stage
+
+    Parameters
+    ----------
+    parts : Dataframe, Series, list, tuple, dict or any value with a stable repr
+                the inputs of the stage (ie the fingerprints of its tables and its options)
+
+    Returns
+    -------
+    the hex digest of the inputs
+    """
+
+    h = hashlib.sha256()
+    h.update(STAGES_VERSION.encode())
+    hash_arg(h, parts)
+    return h.hexdigest()
+
+
+def source_fingerprint(paths):
+    """
+    Fingerprint of the code of the stages, so that their stored outputs are not used by a different version
+
+    Parameters
+    ----------
+    paths : list
+                source files (str or Path())
+
+    Returns
+    -------
+    the hex digest of the content of the files
+    """
+
+    h = hashlib.sha256()
+    for path in sorted(str(p) for p in paths):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def run_concurrently(calls, workers=1):
+    """
+    Run independent stages at once, in a pool of threads (ie the reads of the tables, which release the GIL
+    while parsing the files)
+
+    Parameters
+    ----------
+    calls : dict
+                name of the stage -> function without arguments
+    workers : (optional) int
+                number of threads, 0 to use all the available cores
+
+    Returns
+    -------
+    dict with the name of the stage as a key and the result of its function as a value
+    """
+
+    if workers is None or workers < 1:
+        workers = os.cpu_count() or 1
+    if workers == 1 or len(calls) < 2:
+        return {name: call() for name, call in calls.items()}
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(calls))) as executor:
+        futures = {name: executor.submit(call) for name, call in calls.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+class StageCache:
+    """
+    Outputs of the stages of the report (ie the pages), stored with the fingerprint of their inputs:
+    a stage whose fingerprint did not change since the previous run is skipped and its stored output used.
+    Only the last output of each stage is kept
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+
+        Parameters
+        ----------
+        cache_dir : (optional) str or Path()
+                        folder of the stored outputs, nothing is stored if not specified
+        """
+
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, stage, key):
+        """
+        Stored output of a stage
+
+        Parameters
+        ----------
+        stage : str
+                    name of the stage
+        key : str
+                fingerprint of the inputs of the stage
+
+        Returns
+        -------
+        the output, None if the stage has not been stored with the same fingerprint
+        """
+
+        path = self.cache_dir / f'{stage}.pkl' if self.cache_dir is not None else None
+        if path is None or not os.path.isfile(path):
+            self.misses += 1
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                stored_key, output = pickle.load(f)
+        except Exception:  # written by a different version of the libraries
+            stored_key, output = None, None
+
+        if stored_key != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return output
+
+    def store(self, stage, key, output):
+        if self.cache_dir is None:
+            return
+
+        path = self.cache_dir / f'{stage}.pkl'
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((key, output), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
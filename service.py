@@ -0,0 +1,227 @@
+"""
+Local HTTP service answering queries on the parsed AWR data, with the processors kept in memory
+
+usage (from the root of the repository):
+    python service.py --inputDir data/parsed/awr [--port 8050]
+
+    curl 'http://127.0.0.1:8050/top_n?instance=1&n=5&start=2023-01-01 10:00:00&end=2023-01-01 12:00:00'
+"""
+import argparse
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl
+
+import pandas as pd
+
+from parsing.manifest import MANIFEST_NAME
+from preprocessing.awr_preprocessing.dataset import AWRDataset
+from preprocessing.awr_preprocessing.sql_processing import SqlProcessor
+from preprocessing.awr_preprocessing.wait_classes_processing import WaitClassProcessor
+from preprocessing.awr_preprocessing.tablespace_io_processing import TablespaceIoProcessor
+
+
+# responses kept in memory
+CACHE_SIZE = 256
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               500: 'Internal Server Error'}
+
+
+def to_json(value):
+    """
+    Convert the result of a processor method to a JSON serializable value
+
+    Parameters
+    ----------
+    value : Dataframe, Series, list, tuple, dict or scalar
+
+    Returns
+    -------
+    the JSON serializable value, dataframes become lists of records (with the named index as the first field)
+    """
+
+    if isinstance(value, pd.DataFrame):
+        if value.index.name is not None:  # ie the timestamps, the positions of the rows are left out
+            value = value.reset_index()
+        return json.loads(value.to_json(orient='records', date_format='iso'))
+    if isinstance(value, pd.Series):
+        return to_json(value.to_frame())
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): to_json(v) for k, v in value.items()}
+    return json.loads(pd.Series([value]).to_json(orient='records', date_format='iso'))[0]
+
+
+class QueryService:
+    """
+    Answer the queries of the HTTP service with processors built once from the parsed data.
+    The responses are cached, the processors and the cache are dropped when the parsed data changes
+    (ie new AWR reports are parsed into the same folder)
+    """
+
+    def __init__(self, input_path, cache_size=CACHE_SIZE):
+        """
+
+        Parameters
+        ----------
+        input_path : str or Path()
+                        path of the parsed data folder
+        cache_size : (optional) int
+                        number of responses kept in memory
+        """
+
+        self.input_path = Path(input_path)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.version = None
+        self.dataset = None
+        self.processors = {}
+
+        # path -> (method, required parameters)
+        self.endpoints = {
+            '/query_info': (self.query_info, ['sql_id', 'instance']),
+            '/query_cpu_time': (self.query_cpu_time, ['sql_id', 'instance']),
+            '/top_n': (self.top_n, ['instance']),
+            '/dbtime_percentages': (self.dbtime_percentages, ['timestamp']),
+            '/tablespace_io': (self.tablespace_io, ['instance', 'tablespace']),
+        }
+
+    def data_version(self):
+        # the manifest is written every time new reports are parsed
+        manifest_path = self.input_path / MANIFEST_NAME
+        return os.path.getmtime(manifest_path) if os.path.isfile(manifest_path) else None
+
+    def refresh(self):
+        # new parsed data: the tables are read again and the cached responses are dropped
+        version = self.data_version()
+        if self.dataset is None or version != self.version:
+            self.version = version
+            self.dataset = AWRDataset(self.input_path)
+            self.processors = {}
+            self.cache.clear()
+
+    def get_processor(self, name):
+        if name not in self.processors:
+            processor_class = {'sql': SqlProcessor, 'wc': WaitClassProcessor, 'tio': TablespaceIoProcessor}[name]
+            self.processors[name] = processor_class(f'{name}-service', input_path=self.input_path,
+                                                    dataset=self.dataset)
+
+        return self.processors[name]
+
+    # the instances are numbered as in the report (INST_NUM, starting from 1)
+
+    def query_info(self, sql_id, instance, start=None, end=None):
+        return self.get_processor('sql').get_query_info(sql_id, int(instance) - 1, start, end)
+
+    def query_cpu_time(self, sql_id, instance, start=None, end=None):
+        return self.get_processor('sql').get_query_cpu_time(sql_id, int(instance) - 1, start, end)
+
+    def top_n(self, instance, n=5, start=None, end=None):
+        top1, top2, top3 = self.get_processor('sql').get_top_n(int(instance) - 1, int(n), start, end)
+        return {'cpu': top1, 'elapsed': top2, 'io': top3}
+
+    def dbtime_percentages(self, timestamp):
+        return self.get_processor('wc').get_dbtime_percentages(timestamp)
+
+    def tablespace_io(self, instance, tablespace):
+        x, y1, y2 = self.get_processor('tio').get_metric_to_plot(int(instance) - 1, tablespace)
+        return pd.DataFrame({'Av Rds/s': y1, 'Writes avg/s': y2}, index=pd.Index(x, name='timestamp'))
+
+    def handle(self, path, params):
+        """
+        Answer a query
+
+        Parameters
+        ----------
+        path : str
+                endpoint (ie '/top_n')
+        params : dict
+                    query string parameters
+
+        Returns
+        -------
+        (HTTP status, JSON body as bytes)
+        """
+
+        if path == '/':
+            endpoints = {p: required for p, (_, required) in self.endpoints.items()}
+            return 200, json.dumps({'endpoints': endpoints}).encode()
+        if path not in self.endpoints:
+            return 404, json.dumps({'error': f'unknown endpoint {path}'}).encode()
+
+        method, required = self.endpoints[path]
+        missing = [p for p in required if p not in params]
+        if len(missing) > 0:
+            return 400, json.dumps({'error': 'missing parameters ' + ', '.join(missing)}).encode()
+
+        self.refresh()
+        key = (path, tuple(sorted(params.items())))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        try:
+            response = 200, json.dumps(to_json(method(**params))).encode()
+        except (TypeError, ValueError, KeyError, IndexError) as e:  # wrong parameters or no data
+            print(f'Error! {path} {params}: {e!r}')
+            return 400, json.dumps({'error': repr(e)}).encode()
+        except Exception as e:
+            print(f'Error! {path} {params}: {e!r}')
+            return 500, json.dumps({'error': repr(e)}).encode()
+
+        self.cache[key] = response
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return response
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):  # headers
+                pass
+
+            if len(request_line) < 2 or request_line[0] != 'GET':
+                status, body = 405, json.dumps({'error': 'only GET requests are supported'}).encode()
+            else:
+                url = urlsplit(request_line[1])
+                status, body = self.handle(url.path, dict(parse_qsl(url.query)))
+
+            writer.write(f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n'
+                         f'Content-Type: application/json\r\n'
+                         f'Content-Length: {len(body)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8050):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f'Serving {self.input_path} on http://{host}:{port} (Ctrl+C to stop)')
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query service over the parsed AWR data')
+    parser.add_argument('--inputDir', type=str, required=True,
+                        help="Specify the path of the parsed data (the outputDir of main.py)")
+    parser.add_argument('--host', type=str, required=False, default='127.0.0.1',
+                        help="Address the service listens on, only the local host by default")
+    parser.add_argument('--port', type=int, required=False, default=8050)
+    parser.add_argument('--cacheSize', type=int, required=False, default=CACHE_SIZE,
+                        help="Number of responses kept in memory")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(QueryService(args.inputDir, cache_size=args.cacheSize).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print('Service stopped')
+
+
+if __name__ == '__main__':
+    main()